@@ -0,0 +1,161 @@
+# extract_timeline_data のスループット計測（行/秒）
+#
+#   python -m benchmarks.bench_extract_timeline --points 5000000
+#
+# "before" はベースラインの行ごとの実装（json.load + 行リスト）、
+# "after" は現在の tools.timeline_parser.extract_timeline_data。
+import argparse
+import io
+import json
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_timestamps import legacy_convert_series_to_utc
+from tools.timeline_parser import TIMELINE_CATEGORY_COLUMNS, extract_timeline_data
+
+POINTS_PER_SEGMENT = 50
+
+
+# 合成した Google Timeline エクスポート（バイト列）を生成
+def make_export(n_points, seed=0):
+    rng = random.Random(seed)
+    segments = []
+    t = pd.Timestamp("2020-01-01T00:00:00+09:00")
+    points = 0
+    while points < n_points:
+        count = min(POINTS_PER_SEGMENT, n_points - points)
+        start, end = t, t + pd.Timedelta(minutes=count)
+        fmt = lambda ts: ts.strftime("%Y-%m-%dT%H:%M:%S.000%z")[:-2] + ":00"
+        segments.append({
+            "startTime": fmt(start),
+            "endTime": fmt(end),
+            "timelinePath": [
+                {"point": f"{35 + rng.random():.7f}°, {139 + rng.random():.7f}°",
+                 "time": fmt(start + pd.Timedelta(minutes=i))}
+                for i in range(count)
+            ],
+        })
+        segments.append({
+            "startTime": fmt(end),
+            "endTime": fmt(end + pd.Timedelta(hours=1)),
+            "visit": {"probability": 0.9, "topCandidate": {
+                "placeId": f"place-{rng.randrange(500)}", "semanticType": "UNKNOWN", "probability": 0.8,
+                "placeLocation": {"latLng": f"{35 + rng.random():.7f}°, {139 + rng.random():.7f}°"}}},
+        })
+        segments.append({
+            "startTime": fmt(end),
+            "endTime": fmt(end + pd.Timedelta(hours=1)),
+            "activity": {"start": {"latLng": "35.1°, 139.2°"}, "end": {"latLng": "35.2°, 139.3°"},
+                         "distanceMeters": 1200.0, "probability": 0.9,
+                         "topCandidate": {"type": "WALKING", "probability": 0.7}},
+        })
+        points += count
+        t = end + pd.Timedelta(hours=1)
+    return json.dumps({"semanticSegments": segments}).encode()
+
+
+# ベースラインの実装（比較用にそのまま残す）
+def legacy_extract_timeline_data(uploaded_file, username):
+    file_content = uploaded_file.getvalue().decode()
+    data = json.load(io.StringIO(file_content))
+
+    records = []
+    for segment in data['semanticSegments']:
+        start_time = segment.get('startTime')
+        end_time = segment.get('endTime')
+
+        if 'timelinePath' in segment:
+            for path in segment['timelinePath']:
+                point_time = path.get('time')
+                try:
+                    lat, lng = map(float, path['point'].replace('°', '').split(', '))
+                except Exception:
+                    lat, lng = None, None
+                records.append([
+                    "timelinePath", start_time, end_time, point_time, lat, lng,
+                    None, None, None, None, None, None, username
+                ])
+
+        if 'visit' in segment:
+            visit = segment['visit']
+            top_candidate = visit.get('topCandidate', {})
+            try:
+                lat, lng = map(float, top_candidate.get('placeLocation', {}).get('latLng', '').replace('°', '').split(', '))
+            except Exception:
+                lat, lng = None, None
+            records.append([
+                "visit", start_time, end_time, None, lat, lng,
+                visit.get('probability'), top_candidate.get('placeId'), top_candidate.get('semanticType'),
+                None, None, None, username
+            ])
+
+        if 'activity' in segment:
+            activity = segment['activity']
+            top_candidate = activity.get('topCandidate', {})
+            for key in ['start', 'end']:
+                if key in activity and 'latLng' in activity[key]:
+                    try:
+                        lat, lng = map(float, activity[key]['latLng'].replace('°', '').split(', '))
+                    except Exception:
+                        lat, lng = None, None
+                    records.append([
+                        f"activity_{key}", start_time, end_time, None, lat, lng,
+                        None, None, None,
+                        activity.get('distanceMeters'), top_candidate.get('type'), top_candidate.get('probability'),
+                        username
+                    ])
+
+    columns = [
+        "type", "start_time", "end_time", "point_time", "latitude", "longitude",
+        "visit_probability", "visit_placeId", "visit_semanticType",
+        "activity_distanceMeters", "activity_type", "activity_probability",
+        "username"
+    ]
+    df = pd.DataFrame(records, columns=columns)
+    for col in ["start_time", "end_time", "point_time"]:
+        df[col] = legacy_convert_series_to_utc(df[col])
+    df = df.astype({
+        "latitude": "float64",
+        "longitude": "float64",
+        "activity_distanceMeters": "float32",
+        "visit_probability": "float32",
+        "activity_probability": "float32"
+    })
+    return df.replace({np.nan: None})
+
+
+# extract_timeline_data の結果を以前の表現（文字列列は object、欠損は None）に戻す
+def legacy_representation(df):
+    df = df.astype({column: object for column in TIMELINE_CATEGORY_COLUMNS})
+    return df.replace({np.nan: None})
+
+
+def run(label, func, payload):
+    start = time.perf_counter()
+    df = func(io.BytesIO(payload), "bench")
+    elapsed = time.perf_counter() - start
+    print(f"{label:>6}: {len(df):>10,} rows  {elapsed:8.2f} s  {len(df) / elapsed:>12,.0f} rows/s")
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=5_000_000)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    payload = make_export(args.points)
+    print(f"export: {len(payload) / 1e6:.1f} MB, {args.points:,} timelinePath points")
+
+    before = None if args.skip_legacy else run("before", legacy_extract_timeline_data, payload)
+    after = run("after", extract_timeline_data, payload)
+    if before is not None:
+        # 文字列列の dtype（str / category）の違いは無視して値を比べる
+        print("identical:", before.astype(object).equals(legacy_representation(after).astype(object)))
+
+
+if __name__ == "__main__":
+    main()
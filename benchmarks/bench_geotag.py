@@ -0,0 +1,79 @@
+# 写真のジオタグ付け（tools.geotag.locate_photos）の速度
+#
+#   python -m benchmarks.bench_geotag --points 5000000 --photos 5000
+#
+# 経路点は 30〜90 秒間隔で、ところどころ数時間の欠け（記録のない時間帯）を入れる。
+# 写真 1 枚ずつ bisect で前後の点を探す実装と結果を比べ、一致しない場合は終了コード 1。
+import argparse
+import bisect
+import sys
+import time
+
+import numpy as np
+
+from tools.geotag import DEFAULT_MAX_GAP_SECONDS, locate_photos
+
+
+def make_points(n_points, seed=0):
+    rng = np.random.default_rng(seed)
+    step = rng.uniform(30, 90, n_points)
+    step[rng.random(n_points) < 0.001] = rng.uniform(3600, 6 * 3600)
+    times = 1.6e9 + np.cumsum(step)
+    latitude = 35.0 + np.cumsum(rng.normal(0, 1e-4, n_points))
+    longitude = 139.0 + np.cumsum(rng.normal(0, 1e-4, n_points))
+    return times, latitude, longitude
+
+
+# 写真 1 枚ずつ前後の点を探す（結果の確認用）
+def locate_one_by_one(photo_times, times, latitude, longitude, max_gap_seconds):
+    result = []
+    for t in photo_times:
+        i = bisect.bisect_right(times, t) - 1
+        j = bisect.bisect_left(times, t)
+        before = i if i >= 0 else None
+        after = j if j < len(times) else None
+        if before is not None and after is not None and times[after] - times[before] <= max_gap_seconds:
+            f = 0.0 if times[after] == times[before] else (t - times[before]) / (times[after] - times[before])
+            result.append((latitude[before] + f * (latitude[after] - latitude[before]),
+                           longitude[before] + f * (longitude[after] - longitude[before])))
+            continue
+        candidates = [(t - times[before], before)] if before is not None else []
+        candidates += [(times[after] - t, after)] if after is not None else []
+        gap, nearest = min(candidates)
+        result.append((latitude[nearest], longitude[nearest]) if gap <= max_gap_seconds / 2 else (np.nan, np.nan))
+    return np.array(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=5_000_000)
+    parser.add_argument("--photos", type=int, default=5_000)
+    args = parser.parse_args()
+
+    times, latitude, longitude = make_points(args.points)
+    rng = np.random.default_rng(1)
+    photo_times = np.sort(rng.uniform(times[0] - 3600, times[-1] + 3600, args.photos))
+    points = {
+        "path_time": times, "path_latitude": latitude, "path_longitude": longitude,
+        "visit_start": np.empty(0), "visit_end": np.empty(0),
+        "visit_latitude": np.empty(0), "visit_longitude": np.empty(0),
+    }
+
+    start = time.perf_counter()
+    lat, lng = locate_photos(photo_times, points, DEFAULT_MAX_GAP_SECONDS)
+    elapsed = time.perf_counter() - start
+    located = ~np.isnan(lat)
+    print(f"{args.photos:,} photos x {args.points:,} points: {elapsed * 1000:8.1f} ms"
+          f"  located {located.sum():,} / {args.photos:,}")
+
+    start = time.perf_counter()
+    expected = locate_one_by_one(photo_times, times, latitude, longitude, DEFAULT_MAX_GAP_SECONDS)
+    print(f"one by one: {(time.perf_counter() - start) * 1000:8.1f} ms")
+    if not np.allclose(np.column_stack([lat, lng]), expected, equal_nan=True, rtol=0, atol=1e-9):
+        print("mismatch between vectorized and one-by-one results")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
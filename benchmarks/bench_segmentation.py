@@ -0,0 +1,105 @@
+# 滞在・移動の分割（tools.segmentation.segment_timeline）の速度
+#
+#   python -m benchmarks.bench_segmentation --points 3000000
+#
+# 合成の履歴は「滞在（半径 30 m 程度のばらつき、30 分〜10 時間）」と
+# 「移動（徒歩・車の 1 分ごとの点）」の繰り返し。
+# 先頭 --check 点について、1 点ずつ距離を測る素朴な実装と滞在の区切りを比べ、違えば終了コード 1。
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from tools.segmentation import DEFAULT_MIN_STAY_SECONDS, DEFAULT_STAY_RADIUS_M, detect_stays, segment_timeline
+from tools.trajectory import EARTH_RADIUS_M
+
+
+def make_history(n_points, seed=0):
+    rng = np.random.default_rng(seed)
+    times, latitude, longitude = [], [], []
+    t, lat, lng = 1.5e9, 35.0, 139.0
+    total = 0
+    while total < n_points:
+        # 滞在
+        count = int(rng.integers(15, 300))
+        times.append(t + np.cumsum(rng.uniform(60, 180, count)))
+        latitude.append(lat + rng.normal(0, 2e-4, count))
+        longitude.append(lng + rng.normal(0, 2e-4, count))
+        t = times[-1][-1]
+        # 移動（徒歩 1.3 m/s または車 12 m/s で向きがゆっくり変わる）
+        count = int(rng.integers(5, 120))
+        speed = rng.choice([1.3, 12.0])
+        heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.2, count))
+        step = speed * 60
+        lat_path = lat + np.cumsum(step * np.cos(heading)) / 111_320
+        lng_path = lng + np.cumsum(step * np.sin(heading)) / (111_320 * np.cos(np.radians(lat)))
+        times.append(t + 60 * np.arange(1, count + 1))
+        latitude.append(lat_path)
+        longitude.append(lng_path)
+        t, lat, lng = times[-1][-1], lat_path[-1], lng_path[-1]
+        total += len(times[-2]) + count
+    return pd.DataFrame({
+        "time": np.concatenate(times)[:n_points],
+        "latitude": np.concatenate(latitude)[:n_points],
+        "longitude": np.concatenate(longitude)[:n_points],
+    })
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+# アンカーから1点ずつ距離を測る実装（結果の確認用）
+def detect_stays_one_by_one(times, latitude, longitude, radius_m, min_stay_seconds):
+    first, last = [], []
+    a, n = 0, len(times)
+    while a < n:
+        j = a + 1
+        while j < n and haversine(latitude[a], longitude[a], latitude[j], longitude[j]) <= radius_m:
+            j += 1
+        if times[j - 1] - times[a] >= min_stay_seconds:
+            first.append(a)
+            last.append(j - 1)
+        a = j
+    return first, last
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=3_000_000)
+    parser.add_argument("--check", type=int, default=200_000)
+    args = parser.parse_args()
+
+    points = make_history(args.points)
+    years = (points["time"].iloc[-1] - points["time"].iloc[0]) / (365 * 86400)
+    activities = pd.DataFrame({"start": [], "end": [], "type": []})
+    print(f"{len(points):,} points over {years:.1f} years")
+
+    start = time.perf_counter()
+    stays, trips = segment_timeline(points, activities)
+    elapsed = time.perf_counter() - start
+    print(f"segment_timeline: {elapsed:6.2f} s  {len(points) / elapsed:>12,.0f} points/s"
+          f"  {len(stays):,} stays  {len(trips):,} trips")
+    print(trips.groupby("mode")["distance_m"].agg(["count", "sum"]).rename(columns={"sum": "distance_m"}))
+
+    head = points.iloc[:args.check]
+    arrays = [head[c].to_numpy() for c in ("time", "latitude", "longitude")]
+    first, last = detect_stays(*arrays, DEFAULT_STAY_RADIUS_M, DEFAULT_MIN_STAY_SECONDS)
+    start = time.perf_counter()
+    expected_first, expected_last = detect_stays_one_by_one(
+        *[a.tolist() for a in arrays], DEFAULT_STAY_RADIUS_M, DEFAULT_MIN_STAY_SECONDS
+    )
+    print(f"one by one ({len(head):,} points): {time.perf_counter() - start:6.2f} s")
+    if first.tolist() != expected_first or last.tolist() != expected_last:
+        print("mismatch between detect_stays and one-by-one results")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
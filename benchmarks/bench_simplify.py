@@ -0,0 +1,59 @@
+# timelinePath の間引き（tools.trajectory.simplify_timeline）の速度と圧縮率
+#
+#   python -m benchmarks.bench_simplify --points 1000000
+#
+# 許容誤差を守るかどうかは tests/test_trajectory.py で確かめる。
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from tools.trajectory import SIMPLIFY_METHODS, simplify_timeline
+
+POINTS_PER_SEGMENT = 50
+
+
+# 移動中の GPS 軌跡（向きがゆっくり変わる等速移動 + 数 m のノイズ）の timelinePath 行
+def make_paths(n_points, seed=0):
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.15, n_points))
+    speed = rng.uniform(0.2, 15, n_points // POINTS_PER_SEGMENT + 1).repeat(POINTS_PER_SEGMENT)[:n_points]
+    step_m = speed * 60 + rng.normal(0, 3, n_points)
+    latitude = 35.0 + np.cumsum(step_m * np.cos(heading)) / 111_320
+    longitude = 139.0 + np.cumsum(step_m * np.sin(heading)) / (111_320 * np.cos(np.radians(35.0)))
+
+    segment = np.arange(n_points) // POINTS_PER_SEGMENT
+    point_time = pd.Timestamp("2020-01-01", tz="UTC") + pd.to_timedelta(np.arange(n_points), unit="min")
+    start_time = pd.Timestamp("2020-01-01", tz="UTC") + pd.to_timedelta(segment * POINTS_PER_SEGMENT, unit="min")
+    return pd.DataFrame({
+        "type": "timelinePath",
+        "start_time": start_time,
+        "end_time": start_time + pd.Timedelta(minutes=POINTS_PER_SEGMENT),
+        "point_time": point_time,
+        "latitude": latitude,
+        "longitude": longitude,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=1_000_000)
+    parser.add_argument("--tolerance", type=float, nargs="+", default=[5.0, 10.0, 50.0, 200.0])
+    args = parser.parse_args()
+
+    df = make_paths(args.points)
+    print(f"{len(df):,} timelinePath points in {len(df) // POINTS_PER_SEGMENT:,} segments")
+
+    for method in SIMPLIFY_METHODS:
+        for tolerance in args.tolerance:
+            stats = {}
+            start = time.perf_counter()
+            simplify_timeline(df, method, tolerance, stats=stats)
+            elapsed = time.perf_counter() - start
+            print(f"{method:>16} {tolerance:6.1f} m: {stats['path_points_after'] / stats['path_points_before']:6.1%} kept"
+                  f"  {elapsed:6.2f} s  {len(df) / elapsed:>12,.0f} points/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# geohash（tools.spatial）の計算と、表示範囲の検索の速度
+#
+#   python -m benchmarks.bench_spatial --points 5000000
+#
+# 索引 (username, geohash) の代わりに geohash で並べた配列を使い、
+# 覆うセルの区間を二分探索で引く方法と、全件の緯度・経度を比べる方法とで表示範囲の点を数える。
+# 1点ずつ区間を二分していく geohash の実装と値を比べ、結果が違えば終了コード 1。
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from tools.spatial import GEOHASH_BASE32, GEOHASH_PRECISION, encode_geohash, geohash_ranges
+
+# 表示範囲の一辺（度）。市区町村程度から国全体まで
+VIEWPORT_SPANS = [0.01, 0.1, 1.0, 10.0]
+
+
+def make_points(n_points, seed=0):
+    rng = np.random.default_rng(seed)
+    latitude = np.clip(35.0 + np.cumsum(rng.normal(0, 2e-3, n_points)), 24.0, 46.0)
+    longitude = np.clip(139.0 + np.cumsum(rng.normal(0, 2e-3, n_points)), 122.0, 154.0)
+    return latitude, longitude
+
+
+def geohash_one(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    result, value, bits, even = "", 0, 0, True
+    while len(result) < precision:
+        target, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (target[0] + target[1]) / 2
+        if coordinate >= mid:
+            value, target[0] = value * 2 + 1, mid
+        else:
+            value, target[1] = value * 2, mid
+        even, bits = not even, bits + 1
+        if bits == 5:
+            result, value, bits = result + GEOHASH_BASE32[value], 0, 0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=5_000_000)
+    parser.add_argument("--check", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    latitude, longitude = make_points(args.points)
+
+    start = time.perf_counter()
+    geohash = encode_geohash(latitude, longitude)
+    elapsed = time.perf_counter() - start
+    print(f"encode_geohash: {elapsed:6.2f} s  {args.points / elapsed:>12,.0f} points/s")
+
+    start = time.perf_counter()
+    expected = [geohash_one(lat, lng) for lat, lng in zip(latitude[:args.check].tolist(), longitude[:args.check].tolist())]
+    elapsed = time.perf_counter() - start
+    print(f"one by one:     {elapsed:6.2f} s  {args.check / elapsed:>12,.0f} points/s")
+    if list(geohash[:args.check]) != expected:
+        print("mismatch between encode_geohash and one-by-one results")
+        return 1
+
+    order = np.argsort(geohash.astype(str), kind="stable")
+    index = geohash[order].astype(str)
+    index_lat, index_lng = latitude[order], longitude[order]
+
+    rng = np.random.default_rng(1)
+    print(f"{'span':>8} {'points':>10} {'read':>10} {'index ms':>10} {'scan ms':>10}")
+    for span in VIEWPORT_SPANS:
+        centers = rng.integers(0, args.points, args.repeat)
+        found = read = 0
+        index_seconds = scan_seconds = 0.0
+        for center in centers:
+            lat, lng = latitude[center], longitude[center]
+            bbox = (lat - span / 2, lng - span / 2, lat + span / 2, lng + span / 2)
+
+            start = time.perf_counter()
+            count = 0
+            for lower, upper in geohash_ranges(bbox):
+                first = np.searchsorted(index, lower, side="left")
+                last = np.searchsorted(index, upper, side="left") if upper else len(index)
+                lat_slice, lng_slice = index_lat[first:last], index_lng[first:last]
+                count += int(((lat_slice >= bbox[0]) & (lat_slice <= bbox[2])
+                              & (lng_slice >= bbox[1]) & (lng_slice <= bbox[3])).sum())
+                read += last - first
+            index_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            scanned = int(((latitude >= bbox[0]) & (latitude <= bbox[2])
+                           & (longitude >= bbox[1]) & (longitude <= bbox[3])).sum())
+            scan_seconds += time.perf_counter() - start
+
+            if count != scanned:
+                print(f"mismatch for {bbox}: index {count} scan {scanned}")
+                return 1
+            found += count
+        print(f"{span:>8} {found // args.repeat:>10,} {read // args.repeat:>10,}"
+              f" {index_seconds / args.repeat * 1000:>10.2f} {scan_seconds / args.repeat * 1000:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
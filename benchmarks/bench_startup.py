@@ -0,0 +1,66 @@
+# ログインページの初回描画までの時間を計測（新しいプロセスでの初回実行）
+#
+#   python -m benchmarks.bench_startup --runs 5 --baseline <比較するコミット>
+#
+# --baseline を指定すると、そのコミットのツリーを一時ディレクトリに展開して同じ計測を行う。
+# create_client は接続しないため、Supabase の URL / キーはダミーで計測できる。
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 1プロセスで1回だけ実行するスクリプト
+RUN_ONCE = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file("main.py", default_timeout=60)
+at.secrets["supabase"] = {"url": "http://localhost:54321", "key": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.bench"}
+at.secrets["postgresql"] = {"host": "localhost", "port": 5432, "dbname": "bench", "user": "bench", "password": ""}
+at.run()
+finished = time.perf_counter()
+assert not at.exception, at.exception
+modules = [m for m in ("folium", "PIL", "psycopg2", "pandas", "supabase") if m in sys.modules]
+print(json.dumps({"render": finished - imported, "total": finished - started, "modules": modules}))
+"""
+
+
+def measure(tree, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", RUN_ONCE], cwd=tree, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def report(label, results):
+    render = [r["render"] for r in results]
+    print(f"{label:>10}: first render median {statistics.median(render) * 1000:8.1f} ms "
+          f"(min {min(render) * 1000:.1f} / max {max(render) * 1000:.1f}), "
+          f"heavy modules loaded: {', '.join(results[-1]['modules']) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", help="比較するコミット（例: HEAD~1）")
+    args = parser.parse_args()
+
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tree:
+            archive = subprocess.run(["git", "archive", args.baseline], cwd=REPO_ROOT, capture_output=True, check=True)
+            subprocess.run(["tar", "-x", "-C", tree], input=archive.stdout, check=True)
+            report("before", measure(tree, args.runs))
+    report("after", measure(REPO_ROOT, args.runs))
+
+
+if __name__ == "__main__":
+    main()
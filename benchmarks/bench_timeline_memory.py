@@ -0,0 +1,43 @@
+# extract_timeline_data が返す DataFrame のメモリ使用量（バイト/行）
+#
+#   python -m benchmarks.bench_timeline_memory --points 1000000
+#
+# "before" は以前の表現（文字列列は object、欠損は None）、
+# "after" は現在の表現（文字列列は category、欠損は NaN / NaT）。
+import argparse
+import io
+import time
+
+from benchmarks.bench_extract_timeline import legacy_representation, make_export
+from tools.timeline_parser import extract_timeline_data
+
+
+def report(label, df):
+    usage = df.memory_usage(deep=True)
+    total = usage.sum()
+    print(f"{label:>6}: {total / 2**20:9.1f} MiB  {total / len(df):7.1f} bytes/row")
+    return usage
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    payload = make_export(args.points)
+    start = time.perf_counter()
+    df = extract_timeline_data(io.BytesIO(payload), "benchmark_user")
+    elapsed = time.perf_counter() - start
+    print(f"{len(df):,} rows ({len(payload) / 2**20:.1f} MiB JSON) in {elapsed:.2f} s")
+
+    before = report("before", legacy_representation(df))
+    after = report("after", df)
+    print()
+    print(f"{'column':>24} {'before':>12} {'after':>12}")
+    for column in df.columns:
+        print(f"{column:>24} {before[column] / len(df):10.1f} B {after[column] / len(df):10.1f} B")
+    print(f"\n{before.sum() / after.sum():.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Timeline の時刻文字列 → UTC 変換のスループット（件/秒）
+#
+#   python -m benchmarks.bench_timestamps --count 5000000
+#
+# 入力は行ごとに時差が異なる（JST・米国の夏時間/冬時間・+05:30・Z）ISO 8601 文字列。
+# "before" はベースラインの convert_series_to_utc（時差が混在すると ValueError になるため、
+# 時差が +09:00 だけの同じ件数の入力で計測）、
+# "pandas" は pd.to_datetime(utc=True, format="ISO8601")、
+# "after" は現在の tools.timeline_parser.parse_timeline_timestamps。
+# after の結果が pandas と一致しない場合は終了コード 1。
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from tools.timeline_parser import parse_timeline_timestamps
+
+OFFSETS = [
+    ("Asia/Tokyo", ".%f"),
+    ("America/Los_Angeles", ".%f"),
+    ("America/New_York", ""),
+    ("Asia/Kolkata", ".%f"),
+    ("UTC", ".%f"),
+]
+
+
+# ベースラインの実装
+def legacy_convert_series_to_utc(series):
+    dt_series = pd.to_datetime(series, errors='coerce')
+    if dt_series.dt.tz is None:
+        dt_series = dt_series.dt.tz_localize('Asia/Tokyo')
+    else:
+        dt_series = dt_series.dt.tz_convert('Asia/Tokyo')
+    return dt_series.dt.tz_convert('UTC')
+
+
+def iso_strings(instants, zone, fraction):
+    local = instants.tz_convert(zone)
+    text = local.strftime(f"%Y-%m-%dT%H:%M:%S{fraction}").str[:len("2020-01-01T00:00:00.000")]
+    if zone == "UTC":
+        return text + "Z"
+    offset = local.strftime("%z")
+    return text + offset.str[:3] + ":" + offset.str[3:]
+
+
+# count 件の時刻文字列。連続する 1000 件ずつ同じ地域にいたことにする
+def make_timestamps(count, seed=0):
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.integers(0, 6 * 365 * 86400, count))
+    millis = rng.integers(0, 1000, count)
+    instants = pd.DatetimeIndex(
+        pd.Timestamp("2019-01-01", tz="UTC") + pd.to_timedelta(seconds * 1000 + millis, unit="ms")
+    )
+    zone_of_row = (np.arange(count) // 1000) % len(OFFSETS)
+    text = np.empty(count, dtype=object)
+    for i, (zone, fraction) in enumerate(OFFSETS):
+        rows = np.flatnonzero(zone_of_row == i)
+        text[rows] = iso_strings(instants[rows], zone, fraction).to_numpy(dtype=object)
+    tokyo = iso_strings(instants, "Asia/Tokyo", ".%f").to_numpy(dtype=object)
+    return text, tokyo
+
+
+def run(label, func, values):
+    start = time.perf_counter()
+    result = func(values)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>6}: {elapsed:7.2f} s  {len(values) / elapsed:>12,.0f} timestamps/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=5_000_000)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    mixed, tokyo = make_timestamps(args.count)
+    print(f"{args.count:,} timestamps, e.g. {mixed[0]} / {mixed[-1]}")
+
+    if not args.skip_legacy:
+        run("before", lambda values: legacy_convert_series_to_utc(pd.Series(values)), tokyo)
+        expected = run("pandas", lambda values: pd.to_datetime(values, utc=True, format="ISO8601"), mixed)
+    after = run("after", parse_timeline_timestamps, mixed)
+
+    if not args.skip_legacy and not (after.as_unit("us") == expected.as_unit("us")).all():
+        print("mismatch between after and pandas")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
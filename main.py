@@ -1,17 +1,4 @@
 import streamlit as st
-from supabase import create_client, Client
-from tools.login import *
-from tools.dashboard import *
-from tools.current_location import *
-from tools.photo_uploader import *
-from tools.google_timeline import *
-from tools.database import *
-
-
-# Supabase のセットアップ
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 st.set_page_config(
     page_title="pathfinder",
@@ -20,6 +7,41 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+# 各ページのモジュール（folium, PIL, psycopg2 など）は、そのページを表示するときに初めて読み込む
+def login():
+    from tools.login import login
+    login()
+
+def signup():
+    from tools.login import signup
+    signup()
+
+def sign_out():
+    from tools.login import sign_out
+    sign_out()
+
+def dashboard():
+    from tools.dashboard import dashboard
+    dashboard()
+
+def display_location_info():
+    from tools.current_location import display_location_info
+    display_location_info()
+
+def photo_uploader():
+    from tools.photo_uploader import photo_uploader
+    photo_uploader()
+
+def google_timeline():
+    from tools.google_timeline import google_timeline
+    google_timeline()
+
+def database_view():
+    from tools.database import database_view
+    database_view()
+
+
 # 初期設定
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
@@ -0,0 +1,25 @@
+-- Google Timeline から取り込んだ行（tools/google_timeline.py の upload_to_postgresql が書き込む）
+CREATE TABLE IF NOT EXISTS timeline_data (
+    id bigserial PRIMARY KEY,
+    type text NOT NULL,
+    start_time timestamptz,
+    end_time timestamptz,
+    point_time timestamptz,
+    latitude double precision,
+    longitude double precision,
+    visit_probability real,
+    visit_placeId text,
+    visit_semanticType text,
+    activity_distanceMeters real,
+    activity_type text,
+    activity_probability real,
+    username text NOT NULL,
+    row_hash uuid
+);
+
+-- 既存のテーブルには差分取り込み用の列だけを追加する
+ALTER TABLE timeline_data ADD COLUMN IF NOT EXISTS row_hash uuid;
+
+-- 差分取り込み（ON CONFLICT DO NOTHING）用の一意キー。row_hash が NULL の行は対象外
+CREATE UNIQUE INDEX IF NOT EXISTS timeline_data_username_row_hash_key
+    ON timeline_data (username, row_hash);
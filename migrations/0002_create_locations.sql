@@ -0,0 +1,14 @@
+-- 写真・現在地ページから保存される地点（tools/locations.py の save_locations が upsert する）
+CREATE TABLE IF NOT EXISTS locations (
+    id bigserial PRIMARY KEY,
+    username text NOT NULL,
+    latitude double precision,
+    longitude double precision,
+    "timestamp" timestamp NOT NULL,
+    comment text,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- upsert(on_conflict="username,timestamp") 用の一意キー
+CREATE UNIQUE INDEX IF NOT EXISTS locations_username_timestamp_key
+    ON locations (username, "timestamp");
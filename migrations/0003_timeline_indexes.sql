@@ -0,0 +1,15 @@
+-- ユーザー + 時刻での絞り込み（tools/database.py の TIME_EXPR と同じ式）
+CREATE INDEX IF NOT EXISTS timeline_data_username_time_idx
+    ON timeline_data (username, (coalesce(point_time, start_time)));
+
+-- 差分取り込みの基準時刻 max(end_time)
+CREATE INDEX IF NOT EXISTS timeline_data_username_end_time_idx
+    ON timeline_data (username, end_time);
+
+-- 生データ表示のキーセットページング
+CREATE INDEX IF NOT EXISTS timeline_data_username_id_idx
+    ON timeline_data (username, id);
+
+-- 取り込み順にほぼ時刻順で並ぶため、期間での全体走査は BRIN で十分
+CREATE INDEX IF NOT EXISTS timeline_data_start_time_brin
+    ON timeline_data USING brin (start_time);
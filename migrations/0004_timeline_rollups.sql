@@ -0,0 +1,109 @@
+-- myDB の統計を timeline_data の全件走査ではなく事前集計から返すためのロールアップ（tools/database.py）
+-- 日付は JST の暦日。時刻が NULL の行は day = '-infinity' にまとめ、件数にだけ含める
+
+-- ユーザー・日・タイプ・分類（visit は semanticType、activity は activity_type）ごとの件数・距離・範囲
+CREATE TABLE IF NOT EXISTS timeline_daily_stats (
+    username text NOT NULL,
+    day date NOT NULL,
+    type text NOT NULL,
+    category text NOT NULL DEFAULT '',
+    rows bigint NOT NULL DEFAULT 0,
+    distance_m double precision NOT NULL DEFAULT 0,   -- activity_start の activity_distanceMeters の合計
+    first_time timestamptz,
+    last_time timestamptz,
+    min_latitude double precision,
+    max_latitude double precision,
+    min_longitude double precision,
+    max_longitude double precision,
+    PRIMARY KEY (username, day, type, category)
+);
+
+-- ユーザー・日・場所ごとの件数
+CREATE TABLE IF NOT EXISTS timeline_daily_places (
+    username text NOT NULL,
+    day date NOT NULL,
+    place_id text NOT NULL,
+    visits bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, day, place_id)
+);
+
+-- source（テーブル名またはトリガーの遷移テーブル名）の行をロールアップに加算する SQL
+CREATE OR REPLACE FUNCTION timeline_rollup_sql(source text) RETURNS text[]
+LANGUAGE sql IMMUTABLE AS $fn$
+SELECT ARRAY[
+    format($q$
+        INSERT INTO timeline_daily_stats AS s (
+            username, day, type, category, rows, distance_m, first_time, last_time,
+            min_latitude, max_latitude, min_longitude, max_longitude
+        )
+        SELECT username,
+               coalesce((coalesce(point_time, start_time) AT TIME ZONE 'Asia/Tokyo')::date, '-infinity'),
+               type,
+               coalesce(visit_semanticType, activity_type, ''),
+               count(*),
+               coalesce(sum(activity_distanceMeters) FILTER (WHERE type = 'activity_start'), 0),
+               min(coalesce(point_time, start_time)), max(coalesce(point_time, start_time)),
+               min(latitude), max(latitude), min(longitude), max(longitude)
+        FROM %1$I
+        WHERE $1 IS NULL OR username = $1
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (username, day, type, category) DO UPDATE SET
+            rows = s.rows + excluded.rows,
+            distance_m = s.distance_m + excluded.distance_m,
+            first_time = least(s.first_time, excluded.first_time),
+            last_time = greatest(s.last_time, excluded.last_time),
+            min_latitude = least(s.min_latitude, excluded.min_latitude),
+            max_latitude = greatest(s.max_latitude, excluded.max_latitude),
+            min_longitude = least(s.min_longitude, excluded.min_longitude),
+            max_longitude = greatest(s.max_longitude, excluded.max_longitude)
+    $q$, source),
+    format($q$
+        INSERT INTO timeline_daily_places AS p (username, day, place_id, visits)
+        SELECT username,
+               coalesce((coalesce(point_time, start_time) AT TIME ZONE 'Asia/Tokyo')::date, '-infinity'),
+               visit_placeId,
+               count(*)
+        FROM %1$I
+        WHERE visit_placeId IS NOT NULL AND ($1 IS NULL OR username = $1)
+        GROUP BY 1, 2, 3
+        ON CONFLICT (username, day, place_id) DO UPDATE SET visits = p.visits + excluded.visits
+    $q$, source)
+]
+$fn$;
+
+-- 取り込み（INSERT / COPY）ごとに、実際に追加された行だけをロールアップに加算する
+-- ON CONFLICT DO NOTHING で捨てられた重複行は遷移テーブルに含まれない
+CREATE OR REPLACE FUNCTION timeline_rollups_after_insert() RETURNS trigger
+LANGUAGE plpgsql AS $fn$
+DECLARE
+    statement text;
+BEGIN
+    FOREACH statement IN ARRAY timeline_rollup_sql('new_rows') LOOP
+        EXECUTE statement USING NULL::text;
+    END LOOP;
+    RETURN NULL;
+END
+$fn$;
+
+DROP TRIGGER IF EXISTS timeline_rollups_after_insert ON timeline_data;
+CREATE TRIGGER timeline_rollups_after_insert
+    AFTER INSERT ON timeline_data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION timeline_rollups_after_insert();
+
+-- timeline_data を直接削除・更新した後などに、ユーザー単位（NULL なら全員）で作り直す
+CREATE OR REPLACE FUNCTION rebuild_timeline_rollups(p_username text DEFAULT NULL) RETURNS void
+LANGUAGE plpgsql AS $fn$
+DECLARE
+    statement text;
+BEGIN
+    DELETE FROM timeline_daily_stats WHERE p_username IS NULL OR username = p_username;
+    DELETE FROM timeline_daily_places WHERE p_username IS NULL OR username = p_username;
+    FOREACH statement IN ARRAY timeline_rollup_sql('timeline_data') LOOP
+        EXECUTE statement USING p_username;
+    END LOOP;
+END
+$fn$;
+
+-- 既存の行を集計する
+SELECT rebuild_timeline_rollups();
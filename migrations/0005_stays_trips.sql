@@ -0,0 +1,52 @@
+-- timeline_data の点から求めた滞在と移動（tools/segmentation.py が計算して丸ごと入れ替える）
+-- 時刻の範囲で引くため、いずれも (username, start_time) の索引を持つ
+
+-- 半径 radius_m 以内に min_stay_seconds 以上とどまった区間。seq はユーザーごとの時刻順の番号
+CREATE TABLE IF NOT EXISTS timeline_stay_points (
+    username text NOT NULL,
+    seq integer NOT NULL,
+    start_time timestamptz NOT NULL,
+    end_time timestamptz NOT NULL,
+    latitude double precision NOT NULL,    -- 滞在中の点の重心
+    longitude double precision NOT NULL,
+    points integer NOT NULL,
+    PRIMARY KEY (username, seq)
+);
+
+CREATE INDEX IF NOT EXISTS timeline_stay_points_username_time_idx
+    ON timeline_stay_points (username, start_time);
+
+-- 滞在 from_stay の最後の点から滞在 to_stay の最初の点までの移動
+CREATE TABLE IF NOT EXISTS timeline_trips (
+    username text NOT NULL,
+    seq integer NOT NULL,
+    from_stay integer NOT NULL,
+    to_stay integer NOT NULL,
+    start_time timestamptz NOT NULL,
+    end_time timestamptz NOT NULL,
+    start_latitude double precision NOT NULL,
+    start_longitude double precision NOT NULL,
+    end_latitude double precision NOT NULL,
+    end_longitude double precision NOT NULL,
+    distance_m double precision NOT NULL,   -- 点を順に結んだ道のり
+    duration_s double precision NOT NULL,
+    mode text NOT NULL,                     -- Timeline の activity_type、なければ平均速度からの推定
+    mode_source text NOT NULL,              -- 'timeline' / 'speed'
+    points integer NOT NULL,
+    PRIMARY KEY (username, seq)
+);
+
+CREATE INDEX IF NOT EXISTS timeline_trips_username_time_idx
+    ON timeline_trips (username, start_time);
+
+-- ユーザーごとの最後の計算条件。source_max_id が timeline_data の max(id) と違えば取り込み後に未計算
+CREATE TABLE IF NOT EXISTS timeline_segmentation_runs (
+    username text PRIMARY KEY,
+    radius_m double precision NOT NULL,
+    min_stay_seconds double precision NOT NULL,
+    source_rows bigint NOT NULL,
+    source_max_id bigint,
+    stays integer NOT NULL,
+    trips integer NOT NULL,
+    computed_at timestamptz NOT NULL DEFAULT now()
+);
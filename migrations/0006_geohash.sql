@@ -0,0 +1,50 @@
+-- 地図の表示範囲・半径・場所での検索用に、各行の位置を geohash（tools/spatial.py）で持つ
+-- 取り込み時はアプリ側（numpy）で計算して書き込む。ここでは既存の行を埋めるための関数も用意する
+-- "C" の照合順序にして、前方一致を文字列の範囲 [prefix, 次の prefix) の索引スキャンで引けるようにする
+
+ALTER TABLE timeline_data ADD COLUMN IF NOT EXISTS geohash text COLLATE "C";
+ALTER TABLE locations ADD COLUMN IF NOT EXISTS geohash text COLLATE "C";
+
+-- 緯度・経度を digits 桁の geohash に（tools/spatial.py の encode_geohash と同じ値）
+CREATE OR REPLACE FUNCTION geohash_encode(latitude double precision, longitude double precision,
+                                          digits integer DEFAULT 9) RETURNS text
+LANGUAGE plpgsql IMMUTABLE STRICT AS $fn$
+DECLARE
+    alphabet constant text := '0123456789bcdefghjkmnpqrstuvwxyz';
+    lng_bits integer := (5 * digits + 1) / 2;
+    lat_bits integer := (5 * digits) / 2;
+    lng_index bigint := least(greatest(floor((longitude + 180) / 360 * (2::numeric ^ lng_bits)), 0), 2::numeric ^ lng_bits - 1);
+    lat_index bigint := least(greatest(floor((latitude + 90) / 180 * (2::numeric ^ lat_bits)), 0), 2::numeric ^ lat_bits - 1);
+    result text := '';
+    value integer := 0;
+    next_bit integer;
+BEGIN
+    -- 先頭のビットから経度・緯度を交互に取り出す
+    FOR i IN 0 .. 5 * digits - 1 LOOP
+        IF i % 2 = 0 THEN
+            lng_bits := lng_bits - 1;
+            next_bit := (lng_index >> lng_bits) & 1;
+        ELSE
+            lat_bits := lat_bits - 1;
+            next_bit := (lat_index >> lat_bits) & 1;
+        END IF;
+        value := value * 2 + next_bit;
+        IF i % 5 = 4 THEN
+            result := result || substr(alphabet, value + 1, 1);
+            value := 0;
+        END IF;
+    END LOOP;
+    RETURN result;
+END
+$fn$;
+
+-- 既存の行を埋める
+UPDATE timeline_data SET geohash = geohash_encode(latitude, longitude)
+WHERE geohash IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL;
+UPDATE locations SET geohash = geohash_encode(latitude, longitude)
+WHERE geohash IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS timeline_data_username_geohash_idx
+    ON timeline_data (username, geohash);
+CREATE INDEX IF NOT EXISTS locations_username_geohash_idx
+    ON locations (username, geohash);
@@ -0,0 +1,65 @@
+-- row_hash（重複取り込みの判定用）を、差分取り込み以外の書き込みも含めてすべての行に付ける
+-- 式は tools/google_timeline.py の ROW_HASH_SQL と同じ
+
+-- 書き込み側が row_hash を渡さない INSERT / COPY でも、同じ式で値を入れる
+CREATE OR REPLACE FUNCTION timeline_data_set_row_hash() RETURNS trigger
+LANGUAGE plpgsql AS $fn$
+BEGIN
+    IF NEW.row_hash IS NULL THEN
+        NEW.row_hash := md5(concat_ws('|',
+            NEW.type,
+            coalesce(extract(epoch FROM NEW.start_time)::text, ''),
+            coalesce(extract(epoch FROM NEW.end_time)::text, ''),
+            coalesce(extract(epoch FROM NEW.point_time)::text, ''),
+            coalesce(NEW.latitude::text, ''),
+            coalesce(NEW.longitude::text, '')
+        ))::uuid;
+    END IF;
+    RETURN NEW;
+END
+$fn$;
+
+DROP TRIGGER IF EXISTS timeline_data_set_row_hash ON timeline_data;
+CREATE TRIGGER timeline_data_set_row_hash
+    BEFORE INSERT ON timeline_data
+    FOR EACH ROW EXECUTE FUNCTION timeline_data_set_row_hash();
+
+-- row_hash が NULL の既存の行（差分取り込み以外で書き込まれた行）に値を入れ、
+-- 同じ内容の行は最初に取り込んだ1行だけを残してから一意キーを作り直す
+DROP INDEX IF EXISTS timeline_data_username_row_hash_key;
+
+UPDATE timeline_data
+SET row_hash = md5(concat_ws('|',
+        type,
+        coalesce(extract(epoch FROM start_time)::text, ''),
+        coalesce(extract(epoch FROM end_time)::text, ''),
+        coalesce(extract(epoch FROM point_time)::text, ''),
+        coalesce(latitude::text, ''),
+        coalesce(longitude::text, '')
+    ))::uuid
+WHERE row_hash IS NULL;
+
+DELETE FROM timeline_data t
+USING (
+    SELECT id, row_number() OVER (PARTITION BY username, row_hash ORDER BY id) AS n
+    FROM timeline_data
+) duplicates
+WHERE t.id = duplicates.id AND duplicates.n > 1;
+
+ALTER TABLE timeline_data ALTER COLUMN row_hash SET NOT NULL;
+
+-- 月別パーティション（migrations/optional/partition_timeline_by_month.sql）では一意キーに start_time を含める
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'timeline_data'::regclass) = 'p' THEN
+        CREATE UNIQUE INDEX timeline_data_username_row_hash_key
+            ON timeline_data (username, row_hash, start_time);
+    ELSE
+        CREATE UNIQUE INDEX timeline_data_username_row_hash_key
+            ON timeline_data (username, row_hash);
+    END IF;
+END
+$$;
+
+-- 削除した重複行の分を集計から除く
+SELECT rebuild_timeline_rollups();
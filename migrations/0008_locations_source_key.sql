@@ -0,0 +1,6 @@
+-- 写真の取り込み元（tools/photo_cache.py の zip_entry_key / file_content_key）
+-- ZIP を取り込むとき、保存済みのエントリを展開する前に読み飛ばすのに使う
+ALTER TABLE locations ADD COLUMN IF NOT EXISTS source_key text;
+
+CREATE INDEX IF NOT EXISTS locations_username_source_key_idx
+    ON locations (username, source_key);
@@ -0,0 +1,95 @@
+-- timeline_data を start_time の月ごとに RANGE パーティション化する（任意）
+-- 通常のマイグレーションには含まれない。適用する場合:
+--   python -m tools.migrations --file migrations/optional/partition_timeline_by_month.sql
+-- 既存の行はすべて新しいテーブルへコピーするため、書き込みを止めてから実行すること。
+-- migrations/ 直下のマイグレーション（0007_row_hash_everywhere.sql まで）を適用してから実行する。
+
+ALTER TABLE timeline_data RENAME TO timeline_data_unpartitioned;
+ALTER INDEX timeline_data_username_row_hash_key RENAME TO timeline_data_unpartitioned_username_row_hash_key;
+ALTER INDEX timeline_data_username_time_idx RENAME TO timeline_data_unpartitioned_username_time_idx;
+ALTER INDEX timeline_data_username_end_time_idx RENAME TO timeline_data_unpartitioned_username_end_time_idx;
+ALTER INDEX timeline_data_username_id_idx RENAME TO timeline_data_unpartitioned_username_id_idx;
+ALTER INDEX timeline_data_start_time_brin RENAME TO timeline_data_unpartitioned_start_time_brin;
+ALTER INDEX timeline_data_username_geohash_idx RENAME TO timeline_data_unpartitioned_username_geohash_idx;
+
+-- パーティションキーを含める必要があるため、主キーと一意キーに start_time を加える
+CREATE TABLE timeline_data (
+    id bigint NOT NULL DEFAULT nextval('timeline_data_id_seq'),
+    type text NOT NULL,
+    start_time timestamptz NOT NULL,
+    end_time timestamptz,
+    point_time timestamptz,
+    latitude double precision,
+    longitude double precision,
+    visit_probability real,
+    visit_placeId text,
+    visit_semanticType text,
+    activity_distanceMeters real,
+    activity_type text,
+    activity_probability real,
+    username text NOT NULL,
+    row_hash uuid NOT NULL,
+    geohash text COLLATE "C",
+    PRIMARY KEY (id, start_time)
+) PARTITION BY RANGE (start_time);
+
+ALTER SEQUENCE timeline_data_id_seq OWNED BY timeline_data.id;
+
+CREATE UNIQUE INDEX timeline_data_username_row_hash_key
+    ON timeline_data (username, row_hash, start_time);
+CREATE INDEX timeline_data_username_time_idx
+    ON timeline_data (username, (coalesce(point_time, start_time)));
+CREATE INDEX timeline_data_username_end_time_idx
+    ON timeline_data (username, end_time);
+CREATE INDEX timeline_data_username_id_idx
+    ON timeline_data (username, id);
+CREATE INDEX timeline_data_start_time_brin
+    ON timeline_data USING brin (start_time);
+CREATE INDEX timeline_data_username_geohash_idx
+    ON timeline_data (username, geohash);
+
+-- 2010年〜2035年の月別パーティションを作成し、範囲外は DEFAULT に入れる
+DO $$
+DECLARE
+    month date := date '2010-01-01';
+BEGIN
+    WHILE month < date '2036-01-01' LOOP
+        EXECUTE format(
+            'CREATE TABLE timeline_data_%s PARTITION OF timeline_data FOR VALUES FROM (%L) TO (%L)',
+            to_char(month, 'YYYYMM'), month, month + interval '1 month'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END
+$$;
+
+CREATE TABLE timeline_data_default PARTITION OF timeline_data DEFAULT;
+
+INSERT INTO timeline_data
+SELECT id, type, start_time, end_time, point_time, latitude, longitude,
+       visit_probability, visit_placeId, visit_semanticType,
+       activity_distanceMeters, activity_type, activity_probability,
+       username, row_hash, geohash
+FROM timeline_data_unpartitioned
+WHERE start_time IS NOT NULL;
+
+DROP TABLE timeline_data_unpartitioned;
+
+-- 書き込み時に row_hash を入れるトリガー（0007_row_hash_everywhere.sql）を新しいテーブルに付け直す
+CREATE TRIGGER timeline_data_set_row_hash
+    BEFORE INSERT ON timeline_data
+    FOR EACH ROW EXECUTE FUNCTION timeline_data_set_row_hash();
+
+-- ロールアップ（0004_timeline_rollups.sql）を適用済みなら、集計トリガーを新しいテーブルに付け直し、
+-- start_time が NULL で移さなかった行の分を除くため集計し直す
+DO $$
+BEGIN
+    IF to_regproc('timeline_rollups_after_insert') IS NOT NULL THEN
+        CREATE TRIGGER timeline_rollups_after_insert
+            AFTER INSERT ON timeline_data
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION timeline_rollups_after_insert();
+        PERFORM rebuild_timeline_rollups();
+    END IF;
+END
+$$;
@@ -0,0 +1,101 @@
+# tools.exif_reader の JPEG ヘッダーの読み取り（壊れたファイルで止まらず、EXIF がなければ空）
+#
+#   python -m pytest tests
+import io
+
+import pytest
+from PIL import Image
+
+from tools.exif_reader import (
+    EXIF_IFD, EXIF_PREFIX, GPS_IFD, JPEG_SOI, parse_exif_segment, photo_metadata, read_exif_segment,
+)
+
+DATE_TIME_ORIGINAL = 0x9003
+
+
+# 撮影日時と GPS（東京駅付近）を持つ JPEG
+def jpeg_with_exif():
+    exif = Image.Exif()
+    exif.get_ifd(EXIF_IFD)[DATE_TIME_ORIGINAL] = "2024:05:01 12:34:56"
+    exif.get_ifd(GPS_IFD).update({1: "N", 2: (35.0, 40.0, 52.8), 3: "E", 4: (139.0, 46.0, 1.2)})
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def jpeg_without_exif():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def segment(code, payload):
+    return bytes([0xFF, code]) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def read(data, **kwargs):
+    return read_exif_segment(io.BytesIO(data), **kwargs)
+
+
+def test_reads_exif_segment():
+    payload = read(jpeg_with_exif())
+    assert payload.startswith(EXIF_PREFIX)
+    assert parse_exif_segment(payload)["DateTimeOriginal"] == "2024:05:01 12:34:56"
+
+
+def test_photo_metadata():
+    metadata = photo_metadata(io.BytesIO(jpeg_with_exif()))
+    assert metadata["timestamp"] == "2024-05-01 12:34:56"
+    assert metadata["timestamp_source"] == "exif"
+    assert metadata["latitude"] == pytest.approx(35.6813, abs=1e-4)
+    assert metadata["longitude"] == pytest.approx(139.7670, abs=1e-4)
+
+
+def test_photo_metadata_without_exif():
+    metadata = photo_metadata(io.BytesIO(jpeg_without_exif()))
+    assert metadata["timestamp_source"] == "upload"
+    assert metadata["latitude"] is None
+
+
+def test_no_app1():
+    assert read(jpeg_without_exif()) == b""
+
+
+def test_not_jpeg():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "PNG")
+    assert read(buffer.getvalue()) is None
+    assert read(b"") is None
+
+
+def test_skips_other_app1():
+    # XMP など Exif 以外の APP1 は読み飛ばして次の APP1 を返す
+    exif = read(jpeg_with_exif())
+    data = JPEG_SOI + segment(0xE1, b"http://ns.adobe.com/xap/1.0/\x00<x/>") + segment(0xE1, exif)
+    assert read(data) == exif
+
+
+@pytest.mark.parametrize("size", [2, 3, 4, 5, 20, 100])
+def test_truncated_file(size):
+    data = JPEG_SOI + segment(0xE0, b"JFIF\x00" + bytes(200)) + segment(0xE1, read(jpeg_with_exif()))
+    assert read(data[:size]) == b""
+
+
+@pytest.mark.parametrize("length", [b"\x00\x00", b"\x00\x01"])
+def test_bad_segment_length(length):
+    data = JPEG_SOI + b"\xff\xe0" + length + bytes(100)
+    assert read(data) == b""
+
+
+def test_padding_until_eof():
+    assert read(JPEG_SOI + b"\xff" * 1000) == b""
+
+
+def test_not_a_marker():
+    assert read(JPEG_SOI + b"\x00\x01\x02\x03") == b""
+
+
+def test_stops_at_limit():
+    data = JPEG_SOI + segment(0xE2, bytes(1000)) * 20 + segment(0xE1, read(jpeg_with_exif()))
+    assert read(data, limit=4096) == b""
+    assert read(data).startswith(EXIF_PREFIX)
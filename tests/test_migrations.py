@@ -0,0 +1,69 @@
+# tools.migrations を2回適用しても同じ状態になるか
+#
+#   DATABASE_URL=postgresql://... python -m pytest tests
+# DATABASE_URL がない、または接続できないときはスキップする
+import os
+import glob
+import uuid
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from tools.migrations import MIGRATIONS_DIR, apply_migrations, migration_version
+
+
+# 使い捨てのスキーマを作り、search_path をそこに向けた接続を返す（終わったらスキーマごと消す）
+@pytest.fixture
+def conn():
+    dsn = os.environ.get("DATABASE_URL")
+    if not dsn:
+        pytest.skip("DATABASE_URL が設定されていません")
+    try:
+        conn = psycopg2.connect(dsn)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL に接続できません: {e}")
+
+    schema = f"test_migrations_{uuid.uuid4().hex[:8]}"
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"SET search_path TO {schema}")
+    conn.commit()
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def recorded_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations ORDER BY version")
+        return [row[0] for row in cur.fetchall()]
+
+
+def test_apply_migrations_twice(conn):
+    versions = sorted(migration_version(path) for path in glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql")))
+
+    assert apply_migrations(conn) == versions
+    assert recorded_versions(conn) == versions
+
+    # 2回目は何も適用せず、記録も増えない
+    assert apply_migrations(conn) == []
+    assert recorded_versions(conn) == versions
+
+
+def test_row_hash_is_filled_on_plain_insert(conn):
+    apply_migrations(conn)
+    with conn.cursor() as cur:
+        # row_hash を渡さない書き込みでも、トリガーで値が入り重複は一意キーで弾かれる
+        for _ in range(2):
+            cur.execute("""
+                INSERT INTO timeline_data (type, start_time, end_time, latitude, longitude, username)
+                VALUES ('visit', '2024-01-01 00:00+00', '2024-01-01 01:00+00', 35.0, 139.0, 'u')
+                ON CONFLICT DO NOTHING
+            """)
+        cur.execute("SELECT count(*), count(row_hash) FROM timeline_data")
+        assert cur.fetchone() == (1, 1)
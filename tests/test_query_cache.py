@@ -0,0 +1,82 @@
+# tools.query_cache のキーの作り方と、データのバージョンによる無効化
+#
+#   python -m pytest tests
+import pandas as pd
+import pytest
+
+from tools.query_cache import ALL_USERS, bump_data_version, data_version, get_query_cache, versioned_query
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    get_query_cache.clear()
+    yield
+    get_query_cache.clear()
+
+
+# 呼ばれた引数を記録する問い合わせ
+@pytest.fixture
+def query():
+    calls = []
+
+    @versioned_query
+    def fetch(username, filters=None, limit=100, columns=("id",)):
+        calls.append((username, filters, limit, columns))
+        return pd.DataFrame({"username": [username], "limit": [limit]})
+
+    fetch.calls = calls
+    return fetch
+
+
+def test_same_key_for_positional_keyword_and_default(query):
+    query("u")
+    query("u", None)
+    query("u", limit=100)
+    query(username="u", columns=("id",), filters=None)
+    assert len(query.calls) == 1
+
+
+def test_different_arguments_are_cached_separately(query):
+    query("u", limit=10)
+    query("u", limit=20)
+    query("v", limit=10)
+    query("u", limit=10)
+    assert len(query.calls) == 3
+
+
+def test_dict_and_list_arguments(query):
+    query("u", {"from": "2024-01-01", "types": ["visit", "timelinePath"]})
+    query("u", filters={"types": ["visit", "timelinePath"], "from": "2024-01-01"})
+    # dict のキーの順序は区別せず、list の要素の順序は区別する
+    query("u", {"from": "2024-01-01", "types": ["timelinePath", "visit"]})
+    assert len(query.calls) == 2
+
+
+def test_unhashable_argument(query):
+    with pytest.raises(TypeError):
+        query("u", pd.DataFrame({"a": [1]}))
+
+
+def test_result_is_copied(query):
+    query("u")["limit"] = 0
+    assert query("u")["limit"].tolist() == [100]
+    assert len(query.calls) == 1
+
+
+def test_bump_invalidates_only_that_user(query):
+    query("u")
+    query("v")
+    bump_data_version("u")
+    query("u")
+    query("v")
+    assert [call[0] for call in query.calls] == ["u", "v", "u"]
+
+
+def test_bump_invalidates_all_users_queries(query):
+    query(ALL_USERS)
+    before = data_version(ALL_USERS)
+    bump_data_version("u")
+
+    assert data_version(ALL_USERS) == before + 1
+    query(ALL_USERS)
+    assert [call[0] for call in query.calls] == [ALL_USERS, ALL_USERS]
@@ -0,0 +1,88 @@
+# tools.segmentation の滞在の検出が、1点ずつ距離を測る実装と同じ区切りになるか
+#
+#   python -m pytest tests
+import numpy as np
+import pytest
+
+from benchmarks.bench_segmentation import detect_stays_one_by_one, make_history
+from tools.segmentation import detect_stays, merge_adjacent_stays
+
+RADIUS_M = 200.0
+MIN_STAY_SECONDS = 20 * 60
+
+# 緯度 35 度付近で 1 m に当たる緯度・経度の差
+LAT_PER_M = 1 / 111_320
+LNG_PER_M = 1 / (111_320 * np.cos(np.radians(35.0)))
+
+
+# 1分ごとの点を (東向きの m, 北向きの m) の列から作る
+def make_points(east_m, north_m):
+    east_m, north_m = np.asarray(east_m, dtype=float), np.asarray(north_m, dtype=float)
+    times = 60.0 * np.arange(len(east_m))
+    return times, 35.0 + north_m * LAT_PER_M, 139.0 + east_m * LNG_PER_M
+
+
+def stays(times, latitude, longitude, radius_m=RADIUS_M, min_stay_seconds=MIN_STAY_SECONDS):
+    first, last = detect_stays(times, latitude, longitude, radius_m, min_stay_seconds)
+    return list(zip(first.tolist(), last.tolist()))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("radius_m", [50.0, 200.0])
+def test_detect_stays_matches_one_by_one(seed, radius_m):
+    points = make_history(5_000, seed)
+    times, latitude, longitude = (points[column].to_numpy() for column in ("time", "latitude", "longitude"))
+
+    first, last = detect_stays_one_by_one(times, latitude, longitude, radius_m, MIN_STAY_SECONDS)
+    assert stays(times, latitude, longitude, radius_m) == list(zip(first, last))
+
+
+def test_detect_stays_empty():
+    assert stays(np.empty(0), np.empty(0), np.empty(0)) == []
+
+
+def test_detect_stays_single_point():
+    # 1点だけの区間は時間を満たしても滞在にしない
+    assert stays(*make_points([0], [0]), min_stay_seconds=0) == []
+
+
+def test_detect_stays_whole_range():
+    # 最初の点から半径の中を 30 分歩き回るだけなら全体で1つの滞在
+    angle = np.linspace(0, 4 * np.pi, 31)
+    assert stays(*make_points(90 * (1 - np.cos(angle)), 90 * np.sin(angle))) == [(0, 30)]
+
+
+def test_detect_stays_too_short():
+    assert stays(*make_points(np.zeros(15), np.zeros(15))) == []
+
+
+def test_detect_stays_split_by_jump():
+    # 30 分とどまり、5 km 離れた場所でまた 30 分とどまる
+    east = np.concatenate([np.zeros(30), np.full(30, 5_000.0)])
+    assert stays(*make_points(east, np.zeros(60))) == [(0, 29), (30, 59)]
+
+
+def test_detect_stays_skips_moving_points():
+    # 100 m ずつ進む区間は滞在にならない
+    east = np.concatenate([np.zeros(25), 300 + 100 * np.arange(20), np.full(25, 2_500.0)])
+    assert stays(*make_points(east, np.zeros(70))) == [(0, 24), (45, 69)]
+
+
+def test_merge_adjacent_stays():
+    # 境目で分かれた滞在（重心が 150 m 差）と、間に移動がある滞在、離れた滞在
+    east = np.concatenate([np.zeros(25), np.full(25, 150.0), [1_000.0], np.full(25, 150.0), np.full(25, 3_000.0)])
+    _, latitude, longitude = make_points(east, np.zeros(len(east)))
+    first = np.array([0, 25, 51, 76])
+    last = np.array([24, 49, 75, 100])
+
+    merged_first, merged_last = merge_adjacent_stays(latitude, longitude, first, last, RADIUS_M)
+    assert merged_first.tolist() == [0, 51, 76]
+    assert merged_last.tolist() == [49, 75, 100]
+
+
+@pytest.mark.parametrize("count", [0, 1])
+def test_merge_adjacent_stays_few(count):
+    first, last = np.arange(count), np.arange(count)
+    merged_first, merged_last = merge_adjacent_stays(np.zeros(count), np.zeros(count), first, last, RADIUS_M)
+    assert merged_first.tolist() == first.tolist()
+    assert merged_last.tolist() == last.tolist()
@@ -0,0 +1,100 @@
+# tools.spatial の geohash と、範囲を覆う geohash の区間
+#
+#   python -m pytest tests
+import numpy as np
+import pytest
+
+from benchmarks.bench_spatial import geohash_one
+from tools.spatial import bbox_filter, encode_geohash, geohash_bounds, geohash_ranges, radius_bbox
+
+# よく知られた geohash（12桁）
+KNOWN_GEOHASHES = [
+    (57.64911, 10.40744, "u4pruydqqvj8"),
+    (42.6, -5.6, "ezs42e44yx96"),
+    (-25.382708, -49.265506, "6gkzwgjzn820"),
+    (90.0, 180.0, "zzzzzzzzzzzz"),
+    (-90.0, -180.0, "000000000000"),
+]
+
+
+def in_ranges(cell, ranges):
+    return any(lower <= cell and (upper is None or cell < upper) for lower, upper in ranges)
+
+
+# 範囲内のランダムな点と四隅がすべて区間のどれかに入るか
+def assert_covers(bbox, seed=0):
+    min_lat, min_lng, max_lat, max_lng = bbox
+    rng = np.random.default_rng(seed)
+    latitude = np.concatenate([rng.uniform(min_lat, max_lat, 500), [min_lat, min_lat, max_lat, max_lat]])
+    longitude = np.concatenate([rng.uniform(min_lng, max_lng, 500), [min_lng, max_lng, min_lng, max_lng]])
+    ranges = geohash_ranges(bbox)
+    assert ranges
+    for cell in encode_geohash(latitude, longitude):
+        assert in_ranges(cell, ranges), cell
+
+
+@pytest.mark.parametrize("latitude, longitude, expected", KNOWN_GEOHASHES)
+def test_encode_geohash_known_vectors(latitude, longitude, expected):
+    assert encode_geohash([latitude], [longitude], 12).tolist() == [expected]
+    assert encode_geohash([latitude], [longitude]).tolist() == [expected[:9]]
+
+
+def test_encode_geohash_matches_bit_by_bit():
+    rng = np.random.default_rng(0)
+    latitude, longitude = rng.uniform(-90, 90, 1000), rng.uniform(-180, 180, 1000)
+    for precision in (1, 5, 9, 12):
+        expected = [geohash_one(lat, lng, precision) for lat, lng in zip(latitude, longitude)]
+        assert encode_geohash(latitude, longitude, precision).tolist() == expected
+
+
+def test_encode_geohash_missing():
+    assert encode_geohash([35.0, np.nan, 35.0], [139.0, 139.0, np.nan]).tolist() == [geohash_one(35.0, 139.0), None, None]
+    assert encode_geohash([], []).tolist() == []
+
+
+def test_geohash_bounds_contains_point():
+    for latitude, longitude, cell in KNOWN_GEOHASHES[:3]:
+        min_lat, min_lng, max_lat, max_lng = geohash_bounds(cell)
+        assert min_lat <= latitude <= max_lat and min_lng <= longitude <= max_lng
+
+
+@pytest.mark.parametrize("bbox", [
+    (35.60, 139.60, 35.80, 139.90),
+    (-33.95, 151.15, -33.80, 151.30),
+    (35.681, 139.767, 35.681, 139.767),     # 1点だけの範囲
+    (-10.0, -170.0, 60.0, 170.0),           # 広い範囲は粗い桁数になる
+])
+def test_geohash_ranges_cover_bbox(bbox):
+    assert_covers(bbox)
+    assert len(geohash_ranges(bbox)) <= 32
+
+
+@pytest.mark.parametrize("bbox", [
+    (35.8, 139.6, 35.6, 139.9),
+    (35.6, 139.9, 35.8, 139.6),
+])
+def test_geohash_ranges_empty_bbox(bbox):
+    assert geohash_ranges(bbox) == []
+    assert bbox_filter(bbox) == ("FALSE", [])
+
+
+def test_radius_bbox_across_antimeridian():
+    # 日付変更線をまたぐ範囲は経度の全域にする
+    bbox = radius_bbox(0.0, 179.999, 1_000)
+    assert bbox[1] == -180.0 and bbox[3] == 180.0
+    assert_covers(bbox)
+    assert in_ranges(encode_geohash([0.001], [-179.999])[0], geohash_ranges(bbox))
+
+
+@pytest.mark.parametrize("latitude", [89.999, -89.999])
+def test_radius_bbox_at_pole(latitude):
+    bbox = radius_bbox(latitude, 10.0, 1_000)
+    assert bbox[1] == -180.0 and bbox[3] == 180.0
+    assert_covers(bbox)
+
+
+def test_geohash_ranges_last_cell_is_open():
+    # 北東の端のセル（zzz...）を含む区間は上限なし
+    ranges = geohash_ranges((89.9, 179.9, 90.0, 180.0))
+    assert ranges[-1][1] is None
+    assert in_ranges("zzzzzzzzz", ranges)
@@ -0,0 +1,177 @@
+# tools.timeline_parser の列ごとの解析が、ベースラインの行ごとの実装と同じ結果になるか
+#
+#   python -m pytest tests
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.bench_extract_timeline import legacy_extract_timeline_data, legacy_representation, make_export
+from benchmarks.bench_timestamps import legacy_convert_series_to_utc
+from tools.timeline_parser import (
+    TIMELINE_COLUMNS, TIMELINE_FLOAT_DTYPES, _parse_latlng_rowwise, _parse_timestamp_block, _parse_timestamps_rowwise,
+    append_segment, buffers_to_frame, compact_timeline_frame, extract_timeline_data, new_column_buffers, parse_latlng,
+    parse_timeline_timestamps,
+)
+
+# 行ごとに時差・小数秒の桁数が異なる時刻
+MIXED_TIMESTAMPS = [
+    "2024-01-01T09:00:00+09:00",
+    "2024-01-01T09:00:00.123+09:00",
+    "2024-03-10T01:59:59.999-08:00",
+    "2024-03-10T03:00:00-07:00",
+    "2024-06-30T23:59:59.5+05:30",
+    "2024-06-30T23:59:59.123456Z",
+    "2024-06-30T23:59:59.123456789Z",
+    "2023-12-31T15:00:00Z",
+    "1969-12-31T23:59:59.25-00:30",
+    "2024-02-29T12:00:00+14:00",
+]
+
+# 固定位置では読めず、1件ずつの解析に回る時刻
+ROWWISE_TIMESTAMPS = [
+    "2024-01-01T09:00:00",            # 時差なし（JST とみなす）
+    "2024-01-01 09:00:00+09:00",      # 区切りが空白
+    "2024-01-01T09:00+09:00",         # 秒がない
+    "2023-02-30T00:00:00+09:00",      # 存在しない日付
+    "2024-01-01T24:00:00+09:00",
+    "2024-01-01T09:00:00.+09:00",
+    "2024-01-01T09:00:00.1234567890+09:00",
+    "not a timestamp",
+    "",
+]
+
+
+# ベースラインの convert_series_to_utc を1件ずつ適用する（時差が混在してもよいように）
+def legacy_timestamps(values):
+    result = [legacy_convert_series_to_utc(pd.Series([value], dtype=object)).iloc[0] for value in values]
+    return pd.DatetimeIndex(result, dtype="datetime64[ns, UTC]").astype("datetime64[us, UTC]")
+
+
+def export(segments):
+    return io.BytesIO(json.dumps({"semanticSegments": segments}).encode())
+
+
+# ベースラインの結果と、文字列列の dtype（str / category）の違いを除いて比べる
+def assert_same_as_legacy(segments):
+    before = legacy_extract_timeline_data(export(segments), "u")
+    after = extract_timeline_data(export(segments), "u")
+
+    assert list(after.columns) == TIMELINE_COLUMNS
+    assert before.astype(object).equals(legacy_representation(after).astype(object))
+
+
+def test_parse_timestamp_block_mixed_offsets():
+    values = np.array(MIXED_TIMESTAMPS, dtype=object)
+    epoch, ok = _parse_timestamp_block(values)
+
+    assert ok.all()
+    assert epoch.tolist() == legacy_timestamps(values).asi8.tolist()
+
+
+def test_parse_timestamp_block_rejects_other_formats():
+    _, ok = _parse_timestamp_block(np.array(ROWWISE_TIMESTAMPS, dtype=object))
+    assert not ok.any()
+
+
+def test_parse_timestamps_rowwise():
+    values = np.array(ROWWISE_TIMESTAMPS, dtype=object)
+    assert _parse_timestamps_rowwise(values).tolist() == legacy_timestamps(values).asi8.tolist()
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_parse_timeline_timestamps_matches_legacy(seed):
+    rng = np.random.default_rng(seed)
+    values = np.array(MIXED_TIMESTAMPS + ROWWISE_TIMESTAMPS + [None, np.nan], dtype=object)
+    values = values[rng.permutation(len(values))]
+
+    assert parse_timeline_timestamps(values).equals(legacy_timestamps(values))
+
+
+def test_parse_latlng_falls_back_to_rowwise():
+    values = ["35.1°, 139.2°", "abc", None, "35.5°, 139.6°, 1°", "-33.9°, 151.2°"]
+    lat, lng = parse_latlng(values)
+    expected_lat, expected_lng = _parse_latlng_rowwise(values)
+
+    np.testing.assert_array_equal(lat, expected_lat)
+    np.testing.assert_array_equal(lng, expected_lng)
+    assert lat[[0, 4]].tolist() == [35.1, -33.9]
+    assert np.isnan(lat[[1, 2, 3]]).all()
+
+
+def test_extract_timeline_data_matches_legacy():
+    segments = json.loads(make_export(500, seed=3))["semanticSegments"]
+    assert_same_as_legacy(segments)
+
+
+def test_extract_timeline_data_with_missing_keys():
+    segments = [
+        # 点の時刻・座標がない、座標が壊れている
+        {"startTime": "2024-01-01T09:00:00.000+09:00", "endTime": "2024-01-01T10:00:00.000+09:00",
+         "timelinePath": [{"point": "35.1°, 139.2°"}, {"time": "2024-01-01T09:30:00.000+09:00"},
+                          {"point": "broken", "time": "2024-01-01T09:40:00.000+09:00"}]},
+        # topCandidate がない滞在、終了時刻がないセグメント
+        {"startTime": "2024-01-01T10:00:00.000+09:00", "visit": {"probability": 0.5}},
+        # 終点の座標がない移動、distanceMeters がない移動
+        {"startTime": "2024-01-01T11:00:00.000+09:00", "endTime": "2024-01-01T12:00:00.000+09:00",
+         "activity": {"start": {"latLng": "35.1°, 139.2°"}, "end": {},
+                      "topCandidate": {"type": "WALKING", "probability": 0.7}}},
+        {"startTime": "2024-01-01T12:00:00.000+09:00", "endTime": "2024-01-01T13:00:00.000+09:00",
+         "activity": {"start": {"latLng": "35.1°, 139.2°"}, "end": {"latLng": "35.2°, 139.3°"}}},
+    ]
+    assert_same_as_legacy(segments)
+
+
+# 時差のない時刻は JST とみなす（ベースラインは時差のある時刻と混在すると NaT にするので、時差なしだけで比べる）
+def test_extract_timeline_data_naive_timestamps():
+    segments = [
+        {"startTime": "2024-01-01T13:00:00", "endTime": "2024-01-01T14:00:00",
+         "visit": {"topCandidate": {"placeId": "p", "placeLocation": {"latLng": "35.3°, 139.4°"}}}},
+        {"startTime": "2024-01-01T14:00:00", "endTime": "2024-01-01T15:00:00",
+         "timelinePath": [{"point": "35.3°, 139.4°", "time": "2024-01-01T14:10:00"}]},
+    ]
+    assert_same_as_legacy(segments)
+
+
+def test_buffers_to_frame_keeps_file_order():
+    buffers = new_column_buffers()
+    append_segment(buffers, {
+        "startTime": "2024-01-01T09:00:00Z", "endTime": "2024-01-01T10:00:00Z",
+        "activity": {"end": {"latLng": "1°, 2°"}, "start": {"latLng": "3°, 4°"}},
+        "visit": {"topCandidate": {"placeLocation": {"latLng": "5°, 6°"}}},
+        "timelinePath": [{"point": "7°, 8°", "time": "2024-01-01T09:10:00Z"}],
+    })
+    append_segment(buffers, {"startTime": "2024-01-01T10:00:00Z", "visit": {}})
+    df = buffers_to_frame(buffers, "u")
+
+    assert df["type"].tolist() == ["timelinePath", "visit", "activity_start", "activity_end", "visit"]
+    assert df["latitude"].tolist()[:4] == [7.0, 5.0, 3.0, 1.0]
+    assert df["end_time"].isna().tolist() == [False] * 4 + [True]
+
+
+def test_buffers_to_frame_empty():
+    df = buffers_to_frame(new_column_buffers(), None)
+
+    assert df.empty
+    assert list(df.columns) == TIMELINE_COLUMNS
+    assert df["start_time"].dtype == "datetime64[us, UTC]"
+    assert all(df[column].dtype == dtype for column, dtype in TIMELINE_FLOAT_DTYPES.items())
+
+
+# DB から読んだ行（列名は小文字、数値は文字列や None のこともある）
+def test_compact_timeline_frame():
+    segments = json.loads(make_export(100, seed=4))["semanticSegments"]
+    legacy = legacy_extract_timeline_data(export(segments), "u")
+    from_db = legacy.rename(columns=str.lower).astype(object)
+    from_db["activity_distancemeters"] = from_db["activity_distancemeters"].map(
+        lambda value: None if value is None else str(value))
+
+    df = compact_timeline_frame(from_db)
+
+    assert df["visit_placeid"].dtype == "category"
+    assert df["activity_distancemeters"].dtype == "float32"
+    assert df["latitude"].dtype == "float64"
+    restored = legacy_representation(df.rename(columns=dict(zip(from_db.columns, legacy.columns))))
+    assert legacy.astype(object).equals(restored.astype(object))
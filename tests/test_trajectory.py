@@ -0,0 +1,157 @@
+# tools.trajectory の間引きが許容誤差を守るか
+#
+#   python -m pytest tests
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.trajectory import (
+    SIMPLIFY_METHODS, decimate_mask, douglas_peucker_mask, max_deviation_m, project_meters, simplify_timeline,
+)
+
+TOLERANCES_M = [1.0, 10.0, 50.0]
+
+
+# 1分ごとの timelinePath の点（segment_sizes の点数ずつ別のセグメントにする）
+def make_path(latitude, longitude, segment_sizes=None):
+    n = len(latitude)
+    segment_sizes = segment_sizes or [n]
+    segment = np.repeat(np.arange(len(segment_sizes)), segment_sizes)
+    start = pd.Timestamp("2024-01-01", tz="UTC")
+    start_time = start + pd.to_timedelta(segment * 1000, unit="min")
+    return pd.DataFrame({
+        "type": "timelinePath",
+        "start_time": start_time,
+        "end_time": start_time + pd.Timedelta(minutes=999),
+        "point_time": start + pd.to_timedelta(np.arange(n), unit="min"),
+        "latitude": np.asarray(latitude, dtype=float),
+        "longitude": np.asarray(longitude, dtype=float),
+    })
+
+
+# 向きがゆっくり変わりながら進む軌跡（数 m のノイズ入り）
+def random_walk(n, seed=0):
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.3, n))
+    step_m = rng.uniform(5, 80, n) + rng.normal(0, 3, n)
+    latitude = 35.0 + np.cumsum(step_m * np.cos(heading)) / 111_320
+    longitude = 139.0 + np.cumsum(step_m * np.sin(heading)) / (111_320 * np.cos(np.radians(35.0)))
+    return latitude, longitude
+
+
+# 半径 radius_m の円を一周して出発点に戻る軌跡
+def closed_loop(n, radius_m=200.0):
+    angle = np.linspace(0, 2 * np.pi, n)
+    latitude = 35.0 + radius_m * np.sin(angle) / 111_320
+    longitude = 139.0 + radius_m * (1 - np.cos(angle)) / (111_320 * np.cos(np.radians(35.0)))
+    return latitude, longitude
+
+
+# 間引いた結果と元の点を突き合わせ、間引かれた点の、前後に残った点を結ぶ線分からの最大距離（m）
+def deviation_after(df, simplified):
+    keep = df["point_time"].isin(simplified["point_time"]).to_numpy()
+    segment = df["start_time"].to_numpy()
+    deviation = 0.0
+    for value in np.unique(segment):
+        rows = segment == value
+        latitude = df["latitude"].to_numpy()[rows]
+        x, y = project_meters(latitude, df["longitude"].to_numpy()[rows], latitude.mean())
+        deviation = max(deviation, max_deviation_m(x, y, keep[rows]))
+    return deviation
+
+
+@pytest.mark.parametrize("method", SIMPLIFY_METHODS)
+@pytest.mark.parametrize("tolerance_m", TOLERANCES_M)
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_random_walk_within_tolerance(method, tolerance_m, seed):
+    df = make_path(*random_walk(600, seed), segment_sizes=[250, 200, 150])
+    stats = {}
+    simplified = simplify_timeline(df, method, tolerance_m, stats=stats)
+
+    assert stats["path_points_after"] <= stats["path_points_before"] == len(df)
+    assert stats["max_deviation_m"] <= tolerance_m
+    assert deviation_after(df, simplified) <= tolerance_m
+
+
+@pytest.mark.parametrize("method", SIMPLIFY_METHODS)
+def test_keeps_first_and_last_point_of_each_segment(method):
+    df = make_path(*random_walk(300), segment_sizes=[100, 120, 80])
+    simplified = simplify_timeline(df, method, 50.0)
+
+    ends = df.groupby("start_time")["point_time"].agg(["first", "last"])
+    assert set(ends["first"]) | set(ends["last"]) <= set(simplified["point_time"])
+
+
+@pytest.mark.parametrize("method", SIMPLIFY_METHODS)
+@pytest.mark.parametrize("n", [0, 1, 2])
+def test_few_points_are_kept(method, n):
+    latitude, longitude = random_walk(n)
+    df = make_path(latitude, longitude)
+    stats = {}
+    simplified = simplify_timeline(df, method, 10.0, stats=stats)
+
+    assert len(simplified) == n
+    assert stats["path_points_after"] == n
+    assert stats["max_deviation_m"] == 0.0
+
+
+@pytest.mark.parametrize("method", SIMPLIFY_METHODS)
+def test_duplicate_points(method):
+    latitude, longitude = random_walk(50)
+    latitude, longitude = np.repeat(latitude, 3), np.repeat(longitude, 3)
+    df = make_path(latitude, longitude)
+    stats = {}
+    simplified = simplify_timeline(df, method, 10.0, stats=stats)
+
+    assert stats["max_deviation_m"] <= 10.0
+    assert deviation_after(df, simplified) <= 10.0
+
+
+@pytest.mark.parametrize("method", SIMPLIFY_METHODS)
+def test_closed_loop(method):
+    # 始点と終点が同じなので、Douglas–Peucker の最初の弦の長さは 0 になる
+    df = make_path(*closed_loop(1000))
+    stats = {}
+    simplified = simplify_timeline(df, method, 5.0, stats=stats)
+
+    assert 2 < len(simplified) < len(df)
+    assert stats["max_deviation_m"] <= 5.0
+    assert deviation_after(df, simplified) <= 5.0
+
+
+def test_other_rows_are_kept():
+    df = make_path(*random_walk(100))
+    visit = pd.DataFrame({"type": ["visit"], "start_time": df["start_time"].iloc[:1], "end_time": df["end_time"].iloc[:1],
+                          "point_time": [pd.NaT], "latitude": [35.0], "longitude": [139.0]})
+    simplified = simplify_timeline(pd.concat([visit, df], ignore_index=True), "douglas_peucker", 50.0)
+
+    assert (simplified["type"] == "visit").sum() == 1
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        simplify_timeline(make_path(*random_walk(10)), "unknown", 10.0)
+
+
+@pytest.mark.parametrize("n", [0, 1, 2])
+def test_douglas_peucker_mask_few_points(n):
+    x, y = np.arange(n, dtype=float), np.zeros(n)
+    assert douglas_peucker_mask(x, y, 1.0).tolist() == [True] * n
+
+
+def test_douglas_peucker_mask_straight_line():
+    x, y = np.arange(10, dtype=float), np.zeros(10)
+    keep = douglas_peucker_mask(x, y, 0.1)
+    assert keep.tolist() == [True] + [False] * 8 + [True]
+
+
+def test_decimate_mask_within_tolerance():
+    rng = np.random.default_rng(3)
+    x, y = np.cumsum(rng.normal(0, 20, 500)), np.cumsum(rng.normal(0, 20, 500))
+    seconds = np.arange(500) * 60.0
+    group = np.repeat([0, 1], 250)
+    keep = decimate_mask(x, y, seconds, group, 25.0, 3600)
+
+    assert keep[[0, 249, 250, 499]].all()
+    for rows in (slice(0, 250), slice(250, 500)):
+        assert max_deviation_m(x[rows], y[rows], keep[rows]) <= 25.0
@@ -0,0 +1,438 @@
+import io
+import os
+import glob
+import json
+import time
+import shutil
+import threading
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import streamlit as st
+from tools.db_pool import db_connection
+from tools.map_clusters import grid_size
+from tools.query_cache import bump_data_version
+
+# .streamlit/secrets.toml の [analytics_cache] で上書きできる
+# 有効にすると、myDB の統計・地図・生データをユーザーごとのローカルの Parquet から返す
+ANALYTICS_CACHE_DEFAULTS = {
+    "enabled": False,
+    "path": ".analytics_cache",
+}
+
+# 1回の COPY で取り出す行数（id 順）
+SYNC_BATCH_ROWS = 500_000
+
+# 同期のたびに、前回の max_id からこの数だけ前までの id もキャッシュにあるか確かめる
+# 別の取り込みのトランザクションが前回の同期より後にコミットした、max_id より小さい id の行を拾うため
+SYNC_RESCAN_IDS = 200_000
+
+# 月のディレクトリのファイルがこの数を超えたら1ファイルにまとめ直す
+COMPACT_FILES = 8
+
+# 時刻の列は UTC のマイクロ秒（timeline_data の timestamptz と同じ）
+UTC_MICROS = pa.timestamp("us", tz="UTC")
+
+# Parquet に保存する列と型。time は各行の代表時刻（tools/database.py の TIME_EXPR）
+CACHE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("type", pa.dictionary(pa.int8(), pa.string())),
+    ("time", UTC_MICROS),
+    ("start_time", UTC_MICROS),
+    ("end_time", UTC_MICROS),
+    ("point_time", UTC_MICROS),
+    ("latitude", pa.float64()),
+    ("longitude", pa.float64()),
+    ("visit_probability", pa.float32()),
+    ("visit_placeId", pa.string()),
+    ("visit_semanticType", pa.dictionary(pa.int32(), pa.string())),
+    ("activity_distanceMeters", pa.float32()),
+    ("activity_type", pa.dictionary(pa.int32(), pa.string())),
+    ("activity_probability", pa.float32()),
+])
+
+TIME_COLUMNS = ["time", "start_time", "end_time", "point_time"]
+
+# 時刻はエポックからのマイクロ秒の整数で取り出す（CSV の時刻の書式に依存しない）
+SYNC_SELECT = """
+    SELECT id, type,
+           (extract(epoch FROM coalesce(point_time, start_time)) * 1000000)::bigint,
+           (extract(epoch FROM start_time) * 1000000)::bigint,
+           (extract(epoch FROM end_time) * 1000000)::bigint,
+           (extract(epoch FROM point_time) * 1000000)::bigint,
+           latitude, longitude,
+           visit_probability, visit_placeId, visit_semanticType,
+           activity_distanceMeters, activity_type, activity_probability
+    FROM timeline_data
+"""
+
+SYNC_SQL = SYNC_SELECT + """
+    WHERE username = %s AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+# 見直す範囲の id と、そのうちキャッシュにない行
+RESCAN_IDS_SQL = "SELECT id FROM timeline_data WHERE username = %s AND id > %s AND id <= %s"
+MISSING_ROWS_SQL = SYNC_SELECT + """
+    WHERE username = %s AND id = ANY(%s)
+    ORDER BY id
+"""
+
+# 月のパーティション（time の UTC の年月。時刻のない行は none）
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+NO_MONTH = "none"
+
+
+def analytics_config():
+    return {**ANALYTICS_CACHE_DEFAULTS, **st.secrets.get("analytics_cache", {})}
+
+
+def analytics_cache_enabled():
+    return bool(analytics_config()["enabled"])
+
+
+# プロセス全体で共有する状態
+# locks: 同じユーザーの同期が重ならないためのロック（バックグラウンドの取り込みジョブと画面から呼ばれる）
+# datasets: 読み込み用のデータセット（ファイルの一覧）。同期のたびに作り直す
+@st.cache_resource
+def _analytics_state():
+    return {"lock": threading.Lock(), "locks": {}, "datasets": {}}
+
+
+def _user_lock(username):
+    state = _analytics_state()
+    with state["lock"]:
+        return state["locks"].setdefault(username, threading.Lock())
+
+
+def user_cache_dir(username):
+    return os.path.join(analytics_config()["path"], quote(username, safe=""))
+
+
+def _state_path(username):
+    return os.path.join(user_cache_dir(username), "_state.json")
+
+
+# 最後に同期した時点の状態（max_id・行数・時刻）。未同期なら None
+def read_sync_state(username):
+    try:
+        with open(_state_path(username), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_sync_state(username, state):
+    path = _state_path(username)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def _part_ids(path):
+    first, last = os.path.splitext(os.path.basename(path))[0].split("-")[1:]
+    return int(first), int(last)
+
+
+def _parts(directory):
+    return sorted(glob.glob(os.path.join(directory, "month=*", "part-*.parquet")), key=_part_ids)
+
+
+def _fetch(cur, sql, params):
+    buffer = io.BytesIO()
+    query = cur.mogrify(sql, params).decode()
+    cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+    if buffer.tell() == 0:
+        return None
+    buffer.seek(0)
+    raw_types = {name: (pa.int64() if name in TIME_COLUMNS else field.type.value_type
+                        if pa.types.is_dictionary(field.type) else field.type)
+                 for name, field in zip(CACHE_SCHEMA.names, CACHE_SCHEMA)}
+    table = pa_csv.read_csv(
+        buffer,
+        read_options=pa_csv.ReadOptions(column_names=CACHE_SCHEMA.names),
+        convert_options=pa_csv.ConvertOptions(column_types=raw_types, strings_can_be_null=True),
+    )
+    columns = [table[name].cast(field.type) for name, field in zip(CACHE_SCHEMA.names, CACHE_SCHEMA)]
+    return pa.Table.from_arrays(columns, schema=CACHE_SCHEMA)
+
+
+def _fetch_batch(cur, username, after_id):
+    return _fetch(cur, SYNC_SQL, (username, after_id, SYNC_BATCH_ROWS))
+
+
+# max_id 以下でキャッシュにない行（前回の同期の後にコミットされた行）。なければ None
+def _fetch_missing(cur, directory, username, max_id):
+    after_id = max(max_id - SYNC_RESCAN_IDS, 0)
+    cur.execute(RESCAN_IDS_SQL, (username, after_id, max_id))
+    ids = np.array([row[0] for row in cur.fetchall()], dtype=np.int64)
+    if len(ids) == 0:
+        return None
+    cached = ds.dataset(_parts(directory), schema=CACHE_SCHEMA, format="parquet").to_table(
+        columns=["id"], filter=ds.field("id") > after_id)["id"].to_numpy()
+    missing = np.setdiff1d(ids, cached)
+    if len(missing) == 0:
+        return None
+    return _fetch(cur, MISSING_ROWS_SQL, (username, missing.tolist()))
+
+
+# バッチを time の月ごとのファイルに分けて書く。ファイル名は含まれる id の範囲
+def _write_batch(directory, table):
+    # 年月は文字列にせず year * 100 + month の整数で分ける（時刻のない行は 0）
+    months = pc.add(pc.multiply(pc.year(table["time"]), 100), pc.month(table["time"])).fill_null(0)
+    touched = set()
+    for month in pc.unique(months).to_pylist():
+        part = table.filter(pc.equal(months, month))
+        name = f"{month // 100:04d}-{month % 100:02d}" if month else NO_MONTH
+        month_dir = os.path.join(directory, f"month={name}")
+        os.makedirs(month_dir, exist_ok=True)
+        name = f"part-{part['id'][0].as_py()}-{part['id'][-1].as_py()}.parquet"
+        pq.write_table(part, os.path.join(month_dir, name + ".tmp"))
+        os.replace(os.path.join(month_dir, name + ".tmp"), os.path.join(month_dir, name))
+        touched.add(month_dir)
+    return touched
+
+
+def _compact_plan_path(month_dir):
+    return os.path.join(month_dir, "_compact.json")
+
+
+# まとめ直したファイルを置き、元のファイルを消す（途中で止まっても _compact.json から続きを行える）
+def _finish_compact(month_dir, plan):
+    target = os.path.join(month_dir, plan["target"])
+    if os.path.exists(target + ".tmp"):
+        os.replace(target + ".tmp", target)
+    for name in plan["parts"]:
+        if name != plan["target"] and os.path.exists(os.path.join(month_dir, name)):
+            os.remove(os.path.join(month_dir, name))
+    os.remove(_compact_plan_path(month_dir))
+
+
+# 月のファイルが増えすぎたら1つにまとめる（id 順に並べ直す）
+# 後から拾った行のファイルは id の範囲が他のファイルと重なるので、範囲ではなく _compact.json で元のファイルを記録する
+def _compact(month_dir):
+    paths = sorted(glob.glob(os.path.join(month_dir, "part-*.parquet")), key=_part_ids)
+    if len(paths) <= COMPACT_FILES:
+        return
+    table = pa.concat_tables(pq.read_table(path) for path in paths).sort_by("id")
+    name = f"part-{table['id'][0].as_py()}-{table['id'][-1].as_py()}.parquet"
+    pq.write_table(table, os.path.join(month_dir, name + ".tmp"))
+    plan = {"target": name, "parts": [os.path.basename(path) for path in paths]}
+    with open(_compact_plan_path(month_dir), "w", encoding="utf-8") as f:
+        json.dump(plan, f)
+    _finish_compact(month_dir, plan)
+
+
+# 中断した同期・まとめ直しの残りを片付ける
+# まとめ直しは _compact.json があれば最後まで行い、なければ書きかけのファイルを消す
+# max_id より後の行を含むファイル（状態を書く前に中断）も消す
+def _remove_leftovers(directory, max_id):
+    for month_dir in glob.glob(os.path.join(directory, "month=*")):
+        try:
+            with open(_compact_plan_path(month_dir), encoding="utf-8") as f:
+                _finish_compact(month_dir, json.load(f))
+        except (OSError, ValueError):
+            pass
+        for path in glob.glob(os.path.join(month_dir, "*.tmp")):
+            os.remove(path)
+        for path in glob.glob(os.path.join(month_dir, "part-*.parquet")):
+            if _part_ids(path)[1] > max_id:
+                os.remove(path)
+
+
+# timeline_data のうち前回の同期より後（id が大きい）の行と、前回の同期の後にコミットされた
+# max_id 以下の行（SYNC_RESCAN_IDS の範囲）をローカルの Parquet に追記する
+# rebuild=True なら作り直す（timeline_data を直接削除・更新した後など）
+def sync_analytics_cache(username, rebuild=False):
+    started = time.perf_counter()
+    directory = user_cache_dir(username)
+    with _user_lock(username):
+        if rebuild:
+            shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+        state = read_sync_state(username) or {"max_id": 0, "rows": 0}
+
+        _remove_leftovers(directory, state["max_id"])
+
+        added = 0
+        touched = set()
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                if state["max_id"]:
+                    table = _fetch_missing(cur, directory, username, state["max_id"])
+                    if table is not None:
+                        touched |= _write_batch(directory, table)
+                        added += table.num_rows
+                        state = {**state, "rows": state["rows"] + table.num_rows}
+                        _write_sync_state(username, {**state, "synced_at": time.time()})
+                while True:
+                    table = _fetch_batch(cur, username, state["max_id"])
+                    if table is None:
+                        break
+                    touched |= _write_batch(directory, table)
+                    added += table.num_rows
+                    state = {"max_id": table["id"][-1].as_py(), "rows": state["rows"] + table.num_rows}
+                    _write_sync_state(username, {**state, "synced_at": time.time()})
+                    if table.num_rows < SYNC_BATCH_ROWS:
+                        break
+        for month_dir in touched:
+            _compact(month_dir)
+        if not os.path.exists(_state_path(username)):
+            _write_sync_state(username, {**state, "synced_at": time.time()})
+
+    _analytics_state()["datasets"].pop(username, None)
+    # キャッシュから答えた結果を読み直させる
+    if added or rebuild:
+        bump_data_version(username)
+    return {"rows": added, "total_rows": state["rows"], "seconds": time.perf_counter() - started}
+
+
+# 取り込みの後に呼ぶ。キャッシュが有効で、一度でも同期したユーザーだけ追記する
+def refresh_analytics_cache(username):
+    if not analytics_cache_enabled() or read_sync_state(username) is None:
+        return None
+    return sync_analytics_cache(username)
+
+
+def user_dataset(username):
+    datasets = _analytics_state()["datasets"]
+    dataset = datasets.get(username)
+    if dataset is None:
+        dataset = ds.dataset(
+            _parts(user_cache_dir(username)), schema=CACHE_SCHEMA.append(pa.field("month", pa.string())),
+            format="parquet", partitioning=PARTITIONING, partition_base_dir=user_cache_dir(username),
+        )
+        datasets[username] = dataset
+    return dataset
+
+
+# myDB の表示にローカルのキャッシュを使うか（有効で、同期済みなら）
+def analytics_cache_ready(username):
+    return analytics_cache_enabled() and read_sync_state(username) is not None
+
+
+def _month(value):
+    return pd.Timestamp(value).tz_convert("UTC").strftime("%Y-%m")
+
+
+# フィルタ条件（tools/database.py の build_timeline_filter と同じ形）を Arrow の式に変換
+# 期間は月のパーティションでも絞り込み、対象外の月のファイルは開かない
+def filter_expression(filters=None, extra=None):
+    filters = filters or {}
+    expressions = [] if extra is None else [extra]
+    if filters.get("start"):
+        expressions.append(ds.field("time") >= pa.scalar(pd.Timestamp(filters["start"]), type=UTC_MICROS))
+        expressions.append((ds.field("month") >= _month(filters["start"])) & (ds.field("month") != NO_MONTH))
+    if filters.get("end"):
+        expressions.append(ds.field("time") < pa.scalar(pd.Timestamp(filters["end"]), type=UTC_MICROS))
+        expressions.append(ds.field("month") <= _month(filters["end"]))
+    if filters.get("types"):
+        expressions.append(ds.field("type").isin(list(filters["types"])))
+    if filters.get("bbox"):
+        min_lat, min_lng, max_lat, max_lng = filters["bbox"]
+        expressions.append((ds.field("latitude") >= min_lat) & (ds.field("latitude") <= max_lat))
+        expressions.append((ds.field("longitude") >= min_lng) & (ds.field("longitude") <= max_lng))
+    expression = None
+    for e in expressions:
+        expression = e if expression is None else expression & e
+    return expression
+
+
+def _read(username, columns, filters=None, extra=None):
+    return user_dataset(username).to_table(columns=columns, filter=filter_expression(filters, extra))
+
+
+def _min_max(table, column):
+    result = pc.min_max(table[column])
+    return result["min"].as_py(), result["max"].as_py()
+
+
+# tools/database.py の get_timeline_summary と同じ項目
+def cached_timeline_summary(username, filters=None):
+    table = _read(username, ["time", "latitude", "longitude", "visit_placeId"], filters)
+    first_time, last_time = _min_max(table, "time")
+    min_latitude, max_latitude = _min_max(table, "latitude")
+    min_longitude, max_longitude = _min_max(table, "longitude")
+    return pd.Series({
+        "rows": table.num_rows,
+        "first_time": pd.Timestamp(first_time) if first_time else pd.NaT,
+        "last_time": pd.Timestamp(last_time) if last_time else pd.NaT,
+        "min_latitude": min_latitude if min_latitude is not None else np.nan,
+        "max_latitude": max_latitude if max_latitude is not None else np.nan,
+        "min_longitude": min_longitude if min_longitude is not None else np.nan,
+        "max_longitude": max_longitude if max_longitude is not None else np.nan,
+        "places": pc.count_distinct(table["visit_placeId"]).as_py(),
+    })
+
+
+# 列の値ごとの件数（NULL は除く、多い順）
+def cached_timeline_counts(username, column, filters=None):
+    values = _read(username, [column], filters)[column]
+    if pa.types.is_dictionary(values.type):
+        values = values.cast(values.type.value_type)
+    counts = pc.value_counts(values)
+    result = pd.Series(counts.field("counts").to_numpy(), index=counts.field("values").to_pylist(), name="count")
+    result = result[result.index.notna()].sort_values(ascending=False, kind="stable")
+    result.index.name = "value"
+    return result
+
+
+# アクティビティの種類ごとの移動距離（km）
+def cached_activity_distances(username, filters=None):
+    table = _read(username, ["activity_type", "activity_distanceMeters"], filters,
+                  extra=(ds.field("type") == "activity_start") & ds.field("activity_type").is_valid())
+    df = table.to_pandas()
+    km = df.groupby("activity_type", observed=True)["activity_distanceMeters"].sum() / 1000
+    km.index = km.index.astype(str)
+    km.index.name = "value"
+    return km.astype(np.float64).rename("km").sort_values(ascending=False, kind="stable")
+
+
+def _located(username, filters):
+    located = ds.field("latitude").is_valid() & ds.field("longitude").is_valid()
+    return _read(username, ["latitude", "longitude"], filters, extra=located)
+
+
+def cached_map_points(username, filters, limit):
+    return _located(username, filters).slice(0, limit).to_pandas()
+
+
+# tools/database.py の get_map_clusters と同じグリッドで集約
+def cached_map_clusters(username, filters, zoom, limit):
+    points = _located(username, filters).to_pandas()
+    size = grid_size(zoom)
+    cells = points.assign(
+        cell_lat=np.floor(points["latitude"] / size), cell_lng=np.floor(points["longitude"] / size)
+    ).groupby(["cell_lat", "cell_lng"], sort=False).agg(
+        count=("latitude", "size"), latitude=("latitude", "mean"), longitude=("longitude", "mean")
+    ).reset_index(drop=True)
+    return cells.sort_values("count", ascending=False, kind="stable").head(limit).reset_index(drop=True)
+
+
+# id のキーセットページング（after_id より後の行を page_size 件）
+def cached_timeline_page(username, columns, filters, after_id, page_size):
+    extra = ds.field("id") > after_id if after_id is not None else None
+    table = _read(username, columns, filters, extra=extra)
+    if table.num_rows > page_size:
+        table = table.take(pc.select_k_unstable(table, page_size, [("id", "ascending")]))
+    table = table.sort_by("id")
+    df = table.to_pandas()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
+
+
+# ユーザーのデータを1つの Parquet ファイル（バイト列）にする（ダウンロード用）
+def export_parquet(username):
+    columns = [name for name in CACHE_SCHEMA.names if name != "time"]
+    table = user_dataset(username).to_table(columns=columns)
+    buffer = io.BytesIO()
+    pq.write_table(table.sort_by("id"), buffer, compression="zstd")
+    return buffer.getvalue()
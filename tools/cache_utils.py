@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+
+# 件数とおおよそのバイト数の上限を持つ LRU キャッシュ（スレッドセーフ）
+# 状態は辞書で持ち、st.cache_resource に載せてセッション間で共有する
+def new_lru_cache(max_entries, max_bytes=None):
+    return {
+        "entries": OrderedDict(),   # key -> (value, size)
+        "bytes": 0,
+        "max_entries": max_entries,
+        "max_bytes": max_bytes,
+        "lock": threading.Lock(),
+        "metrics": {"hits": 0, "misses": 0, "evictions": 0},
+    }
+
+
+def lru_get(cache, key, default=None):
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry is None:
+            cache["metrics"]["misses"] += 1
+            return default
+        cache["entries"].move_to_end(key)
+        cache["metrics"]["hits"] += 1
+        return entry[0]
+
+
+def lru_put(cache, key, value, size=0):
+    with cache["lock"]:
+        old = cache["entries"].pop(key, None)
+        if old is not None:
+            cache["bytes"] -= old[1]
+        cache["entries"][key] = (value, size)
+        cache["bytes"] += size
+        _evict(cache)
+
+
+def lru_pop(cache, key):
+    with cache["lock"]:
+        entry = cache["entries"].pop(key, None)
+        if entry is None:
+            return None
+        cache["bytes"] -= entry[1]
+        return entry[0]
+
+
+def lru_clear(cache):
+    with cache["lock"]:
+        cache["entries"].clear()
+        cache["bytes"] = 0
+
+
+# 古いものから順に (key, value) を返す（ディスクへの保存用のスナップショット）
+def lru_items(cache):
+    with cache["lock"]:
+        return [(key, value) for key, (value, _) in cache["entries"].items()]
+
+
+def lru_metrics(cache):
+    with cache["lock"]:
+        metrics = dict(cache["metrics"])
+        metrics["entries"] = len(cache["entries"])
+        metrics["bytes"] = cache["bytes"]
+    lookups = metrics["hits"] + metrics["misses"]
+    metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+    return metrics
+
+
+def _evict(cache):
+    entries = cache["entries"]
+    max_bytes = cache["max_bytes"]
+    while entries and (len(entries) > cache["max_entries"] or (max_bytes and cache["bytes"] > max_bytes)):
+        _, (_, size) = entries.popitem(last=False)
+        cache["bytes"] -= size
+        cache["metrics"]["evictions"] += 1
@@ -4,36 +4,13 @@ import folium
 from streamlit_folium import folium_static
 import pandas as pd
 from datetime import datetime
-from supabase import create_client, Client
-
-# Supabase のセットアップ
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+from tools.supabase_client import get_supabase
+from tools.locations import save_locations
 
 def check_username():
     if "username" not in st.session_state or not st.session_state.username:
         st.error("⚠️ ダッシュボードでユーザーネームを作成してください。")
 
-# DBへ保存する関数
-def save_to_db(df):
-    for _, row in df.iterrows():
-        data = {
-            "username": row["username"],
-            "latitude": row["latitude"],
-            "longitude": row["longitude"],
-            "timestamp": row["timestamp"],
-            "comment": row["comment"]
-        }
-        # すでに同じデータがDBにあるか確認
-        existing = supabase.table("locations").select("*").eq("username", row["username"]).eq("timestamp", row["timestamp"]).execute()
-
-        if existing.data:  # すでに存在する場合は更新
-            supabase.table("locations").update({"comment": row["comment"]}).eq("username", row["username"]).eq("timestamp", row["timestamp"]).execute()
-        else:  # 存在しない場合は新規追加
-            supabase.table("locations").insert(data).execute()
-            
-
 def get_and_save_current_position():
     position = current_position()
     
@@ -76,7 +53,7 @@ def display_and_edit_location_data():
 
         # DBへ保存ボタン
         if st.button("DBへpush"):
-            save_to_db(st.session_state.location_data)
+            save_locations(get_supabase(), st.session_state.location_data)
             st.success("あなたの現在地がDBに保存されました！")
 
         last_entry = st.session_state.location_data.iloc[-1]
@@ -1,12 +1,8 @@
 import streamlit as st
-from supabase import create_client, Client
+from tools.supabase_client import get_supabase
 import folium
 import pandas as pd
-
-# Supabase のセットアップ
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+from tools.user_profile import current_user_id, get_username, register_username
 
 
 def show_session_info():
@@ -23,9 +19,8 @@ def show_session_info():
 
 
 def get_username_by_user_id():
-    try:
-        user_id = st.session_state.user.dict().get("id", None)
-    except AttributeError:
+    user_id = current_user_id()
+    if "user" not in st.session_state or st.session_state.user is None:
         st.warning("⚠ ユーザー情報がセッションに保存されていません。")
         return None
 
@@ -33,25 +28,19 @@ def get_username_by_user_id():
         st.warning("⚠ ユーザーIDが見つかりません。")
         return None
 
-    response = supabase.table("username").select("username").eq("user_id", user_id).execute()
+    username = get_username(get_supabase(), user_id)
 
     with st.container():
         st.markdown("### 📝 ユーザー名")
 
-        if response.data:
-            username = response.data[0]["username"]
-            st.session_state.username = username
+        if username:
             st.success(f"ようこそ **{username}** さん！")
             return username
         else:
             new_username = st.text_input("ユーザー名を入力してください")
             if st.button("登録"):
                 if new_username:
-                    supabase.table("username").insert({
-                        "user_id": user_id,
-                        "username": new_username
-                    }).execute()
-                    st.session_state.username = new_username
+                    register_username(get_supabase(), user_id, new_username)
                     st.success(f"ユーザー名「{new_username}」を登録しました。")
                     return new_username
                 else:
@@ -1,64 +1,525 @@
 import streamlit as st
-import psycopg2
 import pandas as pd
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from tools.db_pool import db_connection, get_pool_metrics
+from tools.query_cache import versioned_query, query_cache_metrics
+from tools.timeline_parser import compact_timeline_frame
+from tools.spatial import bbox_filter
+from tools.analytics_cache import (
+    analytics_cache_enabled, analytics_cache_ready, read_sync_state, sync_analytics_cache, export_parquet,
+    cached_timeline_summary, cached_timeline_counts, cached_activity_distances,
+    cached_map_points, cached_map_clusters, cached_timeline_page
+)
+from tools.segmentation import (
+    DEFAULT_STAY_RADIUS_M, DEFAULT_MIN_STAY_SECONDS, get_segmentation_run, rebuild_segmentation
+)
+from tools.map_clusters import (
+    RAW_POINT_LIMIT, MAP_CLUSTER_LIMIT, grid_size, zoom_for_bounds, intersect_bounds,
+    cluster_layer, point_layer, render_cluster_map
+)
 
-# .streamlit/secrets.toml から接続情報を読み取る
-db_config = st.secrets["postgresql"]
-
-# データベース接続関数
-def get_db_connection():
-    return psycopg2.connect(
-        dbname=db_config["dbname"],
-        user=db_config["user"],
-        password=db_config["password"],
-        host=db_config["host"],
-        port=db_config["port"]
-    )
+JST = ZoneInfo("Asia/Tokyo")
+
+# 各行の代表時刻（timelinePath は point_time、それ以外は start_time）
+TIME_EXPR = "coalesce(point_time, start_time)"
+
+TIMELINE_TYPES = ["timelinePath", "visit", "activity_start", "activity_end"]
+
+# 集計してよい列（SQL に埋め込むため列名はこの中からのみ選ぶ）
+COUNT_COLUMNS = {
+    "type": "type",
+    "visit_semanticType": "visit_semanticType",
+    "activity_type": "activity_type",
+}
+
+# ロールアップで同じ件数を出すための (集計する列, 条件)
+# category は visit なら visit_semanticType、activity_start / activity_end なら activity_type
+ROLLUP_COUNT_COLUMNS = {
+    "type": ("type", "TRUE"),
+    "visit_semanticType": ("category", "type = 'visit' AND category <> ''"),
+    "activity_type": ("category", "type IN ('activity_start', 'activity_end') AND category <> ''"),
+}
+
+# 地図に送る点の上限
+MAP_POINT_LIMIT = 50_000
+
+# 生データ表示の1ページあたりの行数
+PAGE_SIZE = 100
+
+# 移動の一覧に出す行数
+TRIP_LIST_LIMIT = 200
+
+PAGE_COLUMNS = [
+    "id", "type", "start_time", "end_time", "point_time", "latitude", "longitude",
+    "visit_semanticType", "activity_type", "activity_distanceMeters"
+]
+
+# フィルタ条件（期間・タイプ・範囲）を WHERE 句とパラメータに変換
+# filters: {"start": datetime, "end": datetime, "types": [...], "bbox": (min_lat, min_lng, max_lat, max_lng)}
+def build_timeline_filter(username, filters=None):
+    filters = filters or {}
+    clauses = ["username = %s"]
+    params = [username]
+
+    if filters.get("start"):
+        clauses.append(f"{TIME_EXPR} >= %s")
+        params.append(filters["start"])
+    if filters.get("end"):
+        clauses.append(f"{TIME_EXPR} < %s")
+        params.append(filters["end"])
+    if filters.get("types"):
+        clauses.append("type = ANY(%s)")
+        params.append(list(filters["types"]))
+    if filters.get("bbox") and geohash_available():
+        # geohash の索引で範囲内の候補だけを引く（表示範囲の点の数に比例した読み込みで済む）
+        where, bbox_params = bbox_filter(filters["bbox"])
+        clauses.append(where)
+        params.extend(bbox_params)
+    elif filters.get("bbox"):
+        min_lat, min_lng, max_lat, max_lng = filters["bbox"]
+        clauses.append("latitude BETWEEN %s AND %s AND longitude BETWEEN %s AND %s")
+        params.extend([min_lat, max_lat, min_lng, max_lng])
+
+    return " AND ".join(clauses), params
+
+# geohash 列（migrations/0006_geohash.sql）が適用済みか
+@st.cache_data(ttl=300)
+def geohash_available():
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'timeline_data' AND column_name = 'geohash'
+                )
+            """)
+            return cur.fetchone()[0]
+
+# ロールアップ（migrations/0004_timeline_rollups.sql）が適用済みか
+@st.cache_data(ttl=300)
+def rollups_available():
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('timeline_daily_stats') IS NOT NULL")
+            return cur.fetchone()[0]
+
+# フィルタ条件をロールアップ用の WHERE 句に変換する。ロールアップで答えられない条件なら None
+# 範囲（bbox）での絞り込みと、JST の日付の区切りにそろっていない期間は timeline_data を直接集計する
+# type_column=None は timeline_daily_places 用（場所は visit の行にしかない）
+def build_rollup_filter(username, filters=None, type_column="type"):
+    filters = filters or {}
+    if filters.get("bbox") or not rollups_available():
+        return None
 
-# データ取得関数
-def get_timeline_data(username=None):
-    conn = get_db_connection()
-    query = "SELECT * FROM timeline_data"
+    clauses = ["username = %s"]
+    params = [username]
+    if filters.get("start") or filters.get("end"):
+        # 時刻が NULL の行（day = '-infinity'）は期間で絞り込むと対象外
+        clauses.append("day > '-infinity'")
+    for key, op in (("start", ">="), ("end", "<")):
+        if not filters.get(key):
+            continue
+        local = filters[key].astimezone(JST)
+        if local.time() != time.min:
+            return None
+        clauses.append(f"day {op} %s")
+        params.append(local.date())
+    if filters.get("types"):
+        if type_column:
+            clauses.append(f"{type_column} = ANY(%s)")
+            params.append(list(filters["types"]))
+        elif "visit" not in filters["types"]:
+            clauses.append("FALSE")
+
+    return " AND ".join(clauses), params
+
+# データ取得関数（必要な列・条件だけをDB側で絞り込む）
+# 取得関数の結果はデータのバージョンごとにキャッシュし、取り込み・保存のたびに読み直す（tools/query_cache.py）
+@versioned_query
+def get_timeline_data(username=None, columns=None, filters=None, limit=None):
+    select = ", ".join(columns) if columns else "*"
+    query = f"SELECT {select} FROM timeline_data"
+    params = []
     if username:
-        query += " WHERE username = %s"
-        df = pd.read_sql(query, conn, params=(username,))
+        where, params = build_timeline_filter(username, filters)
+        query += f" WHERE {where}"
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    with db_connection() as conn:
+        return compact_timeline_frame(pd.read_sql(query, conn, params=params or None))
+
+# 件数・期間・範囲をDB側で集計（ロールアップで答えられる条件なら日別の集計から）
+# ローカルの分析用キャッシュ（tools/analytics_cache.py）が使えるなら DB には問い合わせない
+@versioned_query
+def get_timeline_summary(username, filters=None):
+    if analytics_cache_ready(username):
+        return cached_timeline_summary(username, filters)
+    rollup = build_rollup_filter(username, filters)
+    if rollup:
+        where, params = rollup
+        place_where, place_params = build_rollup_filter(username, filters, type_column=None)
+        query = f"""
+            SELECT coalesce(sum(rows), 0)::bigint AS rows,
+                   min(first_time) AS first_time, max(last_time) AS last_time,
+                   min(min_latitude) AS min_latitude, max(max_latitude) AS max_latitude,
+                   min(min_longitude) AS min_longitude, max(max_longitude) AS max_longitude,
+                   (SELECT count(DISTINCT place_id) FROM timeline_daily_places WHERE {place_where}) AS places
+            FROM timeline_daily_stats
+            WHERE {where}
+        """
+        with db_connection() as conn:
+            return pd.read_sql(query, conn, params=place_params + params).iloc[0]
+
+    where, params = build_timeline_filter(username, filters)
+    query = f"""
+        SELECT count(*) AS rows,
+               min({TIME_EXPR}) AS first_time, max({TIME_EXPR}) AS last_time,
+               min(latitude) AS min_latitude, max(latitude) AS max_latitude,
+               min(longitude) AS min_longitude, max(longitude) AS max_longitude,
+               count(DISTINCT visit_placeId) AS places
+        FROM timeline_data
+        WHERE {where}
+    """
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params).iloc[0]
+
+# 列ごとの件数を GROUP BY で集計（ロールアップで答えられる条件なら日別の集計から）
+@versioned_query
+def get_timeline_counts(username, column, filters=None):
+    if analytics_cache_ready(username):
+        return cached_timeline_counts(username, COUNT_COLUMNS[column], filters)
+    rollup = build_rollup_filter(username, filters)
+    if rollup:
+        where, params = rollup
+        value, condition = ROLLUP_COUNT_COLUMNS[column]
+        query = f"""
+            SELECT {value} AS value, sum(rows)::bigint AS count
+            FROM timeline_daily_stats
+            WHERE {where} AND {condition}
+            GROUP BY {value}
+            ORDER BY count DESC
+        """
+        with db_connection() as conn:
+            return pd.read_sql(query, conn, params=params).set_index("value")["count"]
+
+    column = COUNT_COLUMNS[column]
+    where, params = build_timeline_filter(username, filters)
+    query = f"""
+        SELECT {column} AS value, count(*) AS count
+        FROM timeline_data
+        WHERE {where} AND {column} IS NOT NULL
+        GROUP BY {column}
+        ORDER BY count DESC
+    """
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params).set_index("value")["count"]
+
+# アクティビティの種類ごとの移動距離（km）
+@versioned_query
+def get_activity_distances(username, filters=None):
+    if analytics_cache_ready(username):
+        return cached_activity_distances(username, filters)
+    rollup = build_rollup_filter(username, filters)
+    if rollup:
+        where, params = rollup
+        query = f"""
+            SELECT category AS value, sum(distance_m) / 1000 AS km
+            FROM timeline_daily_stats
+            WHERE {where} AND type = 'activity_start' AND category <> ''
+            GROUP BY category
+            ORDER BY km DESC
+        """
     else:
-        df = pd.read_sql(query, conn)
-    conn.close()
-    return df
+        where, params = build_timeline_filter(username, filters)
+        query = f"""
+            SELECT activity_type AS value, sum(activity_distanceMeters) / 1000 AS km
+            FROM timeline_data
+            WHERE {where} AND type = 'activity_start' AND activity_type IS NOT NULL
+            GROUP BY activity_type
+            ORDER BY km DESC
+        """
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params).set_index("value")["km"]
+
+# 地図用に緯度経度の列だけを取得
+@versioned_query
+def get_map_points(username, filters=None, limit=MAP_POINT_LIMIT):
+    if analytics_cache_ready(username):
+        return cached_map_points(username, filters, limit)
+    where, params = build_timeline_filter(username, filters)
+    query = f"""
+        SELECT latitude, longitude
+        FROM timeline_data
+        WHERE {where} AND latitude IS NOT NULL AND longitude IS NOT NULL
+        LIMIT %s
+    """
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params + [limit])
+
+# 地図用にズームレベルに応じたグリッドで集約し、セルごとの件数と重心だけを返す
+@versioned_query
+def get_map_clusters(username, filters=None, zoom=5, limit=MAP_CLUSTER_LIMIT):
+    if analytics_cache_ready(username):
+        return cached_map_clusters(username, filters, zoom, limit)
+    where, params = build_timeline_filter(username, filters)
+    size = grid_size(zoom)
+    query = f"""
+        SELECT count(*) AS count, avg(latitude) AS latitude, avg(longitude) AS longitude
+        FROM timeline_data
+        WHERE {where} AND latitude IS NOT NULL AND longitude IS NOT NULL
+        GROUP BY floor(latitude / %s), floor(longitude / %s)
+        ORDER BY count DESC
+        LIMIT %s
+    """
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params + [size, size, limit])
+
+# id のキーセットページング（after_id より後の行を page_size 件）
+@versioned_query
+def fetch_timeline_page(username, filters=None, after_id=None, page_size=PAGE_SIZE):
+    if analytics_cache_ready(username):
+        return cached_timeline_page(username, PAGE_COLUMNS, filters, after_id, page_size)
+    where, params = build_timeline_filter(username, filters)
+    if after_id is not None:
+        where += " AND id > %s"
+        params.append(after_id)
+    query = f"""
+        SELECT {", ".join(PAGE_COLUMNS)}
+        FROM timeline_data
+        WHERE {where}
+        ORDER BY id
+        LIMIT %s
+    """
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params + [page_size])
+
+# 滞在・移動（migrations/0005_stays_trips.sql）の期間の条件。開始時刻で絞り込む
+def build_segment_filter(username, filters=None):
+    filters = filters or {}
+    clauses = ["username = %s"]
+    params = [username]
+    if filters.get("start"):
+        clauses.append("start_time >= %s")
+        params.append(filters["start"])
+    if filters.get("end"):
+        clauses.append("start_time < %s")
+        params.append(filters["end"])
+    return " AND ".join(clauses), params
+
+# 移動手段ごとの回数・距離（km）・時間（h）と、期間内の滞在の件数
+@versioned_query
+def get_trip_summary(username, filters=None):
+    where, params = build_segment_filter(username, filters)
+    query = f"""
+        SELECT mode, count(*) AS trips, sum(distance_m) / 1000 AS km, sum(duration_s) / 3600 AS hours
+        FROM timeline_trips
+        WHERE {where}
+        GROUP BY mode
+        ORDER BY km DESC
+    """
+    with db_connection() as conn:
+        trips = pd.read_sql(query, conn, params=params).set_index("mode")
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT count(*) FROM timeline_stay_points WHERE {where}", params)
+            stays = cur.fetchone()[0]
+    return trips, stays
+
+# 期間内の新しい移動から limit 件
+@versioned_query
+def get_trips(username, filters=None, limit=TRIP_LIST_LIMIT):
+    where, params = build_segment_filter(username, filters)
+    query = f"""
+        SELECT start_time, end_time, mode, mode_source,
+               distance_m / 1000 AS km, duration_s / 60 AS minutes,
+               start_latitude, start_longitude, end_latitude, end_longitude
+        FROM timeline_trips
+        WHERE {where}
+        ORDER BY start_time DESC
+        LIMIT %s
+    """
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params + [limit])
 
 # タイムスタンプをJSTに変換
+# timestamptz は UTC のセッションで tz 付きの datetime64 として読まれるので、文字列の解析はしない
 def convert_to_jst(df, time_columns=['start_time', 'end_time', 'point_time']):
     for col in time_columns:
         if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce', utc=True)
+            if not isinstance(df[col].dtype, pd.DatetimeTZDtype):
+                df[col] = pd.to_datetime(df[col], errors='coerce', utc=True)
             df[col] = df[col].dt.tz_convert('Asia/Tokyo')
     return df
 
+# 絞り込み条件の入力
+def timeline_filter_inputs():
+    filters = {}
+    with st.expander("🔎 絞り込み"):
+        if st.checkbox("期間で絞り込む"):
+            today = datetime.now(JST).date()
+            period = st.date_input("期間", value=(today - timedelta(days=30), today))
+            if len(period) == 2:
+                filters["start"] = datetime.combine(period[0], time.min, tzinfo=JST)
+                filters["end"] = datetime.combine(period[1] + timedelta(days=1), time.min, tzinfo=JST)
+
+        filters["types"] = st.multiselect("タイプ", TIMELINE_TYPES)
+
+        if st.checkbox("範囲（緯度・経度）で絞り込む"):
+            col1, col2 = st.columns(2)
+            min_lat = col1.number_input("最小緯度", value=20.0, min_value=-90.0, max_value=90.0)
+            max_lat = col2.number_input("最大緯度", value=46.0, min_value=-90.0, max_value=90.0)
+            min_lng = col1.number_input("最小経度", value=122.0, min_value=-180.0, max_value=180.0)
+            max_lng = col2.number_input("最大経度", value=154.0, min_value=-180.0, max_value=180.0)
+            filters["bbox"] = (min_lat, min_lng, max_lat, max_lng)
+    return filters
+
+# 生データをページ単位で表示
+def show_timeline_pages(username, filters):
+    # 条件が変わったら1ページ目に戻す
+    page_key = (username, repr(filters))
+    if st.session_state.get("timeline_page_key") != page_key:
+        st.session_state.timeline_page_key = page_key
+        st.session_state.timeline_page_cursors = [None]
+
+    cursors = st.session_state.timeline_page_cursors
+    page = fetch_timeline_page(username, filters, after_id=cursors[-1])
+    st.dataframe(convert_to_jst(page), use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    if col1.button("◀ 前のページ", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if col2.button("次のページ ▶", disabled=len(page) < PAGE_SIZE):
+        cursors.append(int(page["id"].iloc[-1]))
+        st.rerun()
+    st.caption(f"{len(cursors)} ページ目")
+
+# 表示範囲の点をサーバー側で集約して地図に表示（範囲内の点が少なければそのまま表示）
+def show_timeline_map(username, filters, summary):
+    if pd.isna(summary["min_latitude"]):
+        st.info("位置情報のあるデータがありません。")
+        return
+
+    # 条件が変わったらデータ全体が収まる範囲から表示し直す
+    map_key = (username, repr(filters))
+    if st.session_state.get("timeline_map_key") != map_key:
+        extent = tuple(float(summary[c]) for c in ["min_latitude", "min_longitude", "max_latitude", "max_longitude"])
+        st.session_state.timeline_map_key = map_key
+        st.session_state.timeline_map_initial = {"zoom": zoom_for_bounds(extent), "bounds": extent}
+        st.session_state.timeline_map_view = st.session_state.timeline_map_initial
+
+    view = st.session_state.timeline_map_view
+    view_filters = {**filters, "bbox": intersect_bounds(filters.get("bbox"), view["bounds"])}
+    clusters = get_map_clusters(username, view_filters, view["zoom"])
+    total = int(clusters["count"].sum())
+    if total <= RAW_POINT_LIMIT:
+        layer = point_layer(get_map_points(username, view_filters, RAW_POINT_LIMIT))
+        st.caption(f"表示範囲の {total:,} 点をそのまま表示しています。")
+    else:
+        layer = cluster_layer(clusters)
+        st.caption(f"表示範囲の {total:,} 点を {len(clusters):,} セルに集約して表示しています。")
+
+    new_view = render_cluster_map(layer, st.session_state.timeline_map_initial, key="timeline_map")
+    if new_view and new_view != view:
+        st.session_state.timeline_map_view = new_view
+        st.rerun()
+
+# 滞在と移動（計算条件の入力と再計算、移動手段ごとの集計、移動の一覧）
+def show_stays_and_trips(username, filters):
+    with db_connection() as conn:
+        run = get_segmentation_run(conn, username)
+
+    col1, col2 = st.columns(2)
+    radius_m = col1.number_input(
+        "滞在とみなす半径（m）", min_value=20.0, max_value=2000.0, step=10.0,
+        value=float(run["radius_m"]) if run else DEFAULT_STAY_RADIUS_M
+    )
+    minutes = col2.number_input(
+        "滞在とみなす最短の時間（分）", min_value=1, max_value=24 * 60,
+        value=int(run["min_stay_seconds"] // 60) if run else DEFAULT_MIN_STAY_SECONDS // 60
+    )
+    if st.button("🔄 滞在と移動を計算し直す"):
+        with st.spinner("滞在と移動を計算しています..."):
+            result = rebuild_segmentation(username, radius_m, minutes * 60)
+        st.success(
+            f"{result['points']:,} 点から滞在 {result['stays']:,} 件・移動 {result['trips']:,} 件を求めました"
+            f"（{result['load_seconds'] + result['segment_seconds'] + result['save_seconds']:.1f} 秒）。"
+        )
+        with db_connection() as conn:
+            run = get_segmentation_run(conn, username)
+
+    if run is None:
+        st.info("まだ滞在と移動を計算していません。")
+        return
+    if run["source_max_id"] != run["current_max_id"]:
+        st.warning("前回の計算の後にデータが変わっています。計算し直してください。")
+
+    trips, stays = get_trip_summary(username, filters)
+    st.caption(f"期間内の滞在 {stays:,} 件・移動 {int(trips['trips'].sum()):,} 件")
+    if trips.empty:
+        return
+    st.bar_chart(trips["km"])
+    st.dataframe(trips, use_container_width=True)
+    st.dataframe(convert_to_jst(get_trips(username, filters), ["start_time", "end_time"]), use_container_width=True)
+
 # 統計表示
-def show_statistics(df):
+def show_statistics(username, filters=None, summary=None):
+    if summary is None:
+        summary = get_timeline_summary(username, filters)
+
     with st.container():
         st.header("📊 myDB")
-        df = convert_to_jst(df)
 
         with st.expander("🔍 基本統計量"):
-            st.write(df.describe(include='all'))
+            st.write(convert_to_jst(summary.to_frame().T, ["first_time", "last_time"]).T)
 
         with st.expander("📂 タイプ別データ数"):
-            if 'type' in df.columns:
-                st.bar_chart(df['type'].value_counts())
+            st.bar_chart(get_timeline_counts(username, "type", filters))
 
         with st.expander("🧭 Visit Semantic Type"):
-            if 'visit_semanticType' in df.columns:
-                st.bar_chart(df['visit_semanticType'].value_counts())
+            st.bar_chart(get_timeline_counts(username, "visit_semanticType", filters))
 
         with st.expander("🏃 Activity Type"):
-            if 'activity_type' in df.columns:
-                st.bar_chart(df['activity_type'].value_counts())
+            st.bar_chart(get_timeline_counts(username, "activity_type", filters))
+
+        with st.expander("🚶 移動距離（km）"):
+            st.bar_chart(get_activity_distances(username, filters))
+
+        with st.expander("🛤️ 滞在と移動"):
+            show_stays_and_trips(username, filters)
 
         with st.expander("🗺️ マップ"):
-            if 'latitude' in df.columns and 'longitude' in df.columns:
-                st.map(df[['latitude', 'longitude']])
+            show_timeline_map(username, filters, summary)
+
+        with st.expander("📄 データ"):
+            show_timeline_pages(username, filters)
+
+# ローカルの分析用キャッシュの状態・同期・Parquet でのダウンロード
+def show_analytics_cache(username):
+    state = read_sync_state(username)
+    if state:
+        synced_at = datetime.fromtimestamp(state["synced_at"], JST).strftime("%Y-%m-%d %H:%M")
+        st.caption(f"{state['rows']:,} 行（{synced_at} に同期）")
+
+    col1, col2 = st.columns(2)
+    if col1.button("🔄 最新のデータを取り込む"):
+        with st.spinner("同期しています..."):
+            result = sync_analytics_cache(username)
+        st.success(f"{result['rows']:,} 行を追加しました（{result['seconds']:.1f} 秒）。")
+    if col2.button("♻️ 作り直す"):
+        with st.spinner("作り直しています..."):
+            result = sync_analytics_cache(username, rebuild=True)
+        st.success(f"{result['total_rows']:,} 行を取り込みました（{result['seconds']:.1f} 秒）。")
+
+    if st.button("📦 Parquet を用意する"):
+        st.session_state.analytics_export = export_parquet(username)
+    if st.session_state.get("analytics_export"):
+        st.download_button(
+            "⬇ Parquet をダウンロード", st.session_state.analytics_export,
+            file_name=f"{username}_timeline.parquet", mime="application/vnd.apache.parquet",
+        )
 
 # メイン画面
 def database_view():
@@ -72,14 +533,30 @@ def database_view():
 
     with st.container():
         st.subheader("データベースから取得")
+        filters = timeline_filter_inputs()
         if st.button("📥 myDBへ接続"):
+            st.session_state.db_connected = True
+
+        if st.session_state.get("db_connected"):
             try:
-                df = get_timeline_data(username)
-                if df.empty:
-                    st.info(f"{username} のデータは存在しません。")
+                # 分析用キャッシュが有効なら、初回だけ DB から取り込み、以降はローカルの Parquet から表示する
+                if analytics_cache_enabled() and read_sync_state(username) is None:
+                    with st.spinner("分析用のローカルキャッシュを作成しています..."):
+                        sync_analytics_cache(username)
+                summary = get_timeline_summary(username, filters)
+                if summary["rows"] == 0:
+                    st.info(f"{username} の該当するデータは存在しません。")
                 else:
-                    show_statistics(df)
+                    show_statistics(username, filters, summary)
             except Exception as e:
                 st.error(f"データの取得に失敗しました: {e}")
 
+    if analytics_cache_enabled():
+        with st.expander("🗃️ 分析用のローカルキャッシュ"):
+            show_analytics_cache(username)
+
+    with st.expander("🔌 接続プール"):
+        st.write(get_pool_metrics())
 
+    with st.expander("🧮 クエリ結果のキャッシュ"):
+        st.write(query_cache_metrics())
@@ -0,0 +1,118 @@
+import streamlit as st
+import time
+import threading
+from contextlib import contextmanager
+from psycopg2 import extensions, OperationalError, InterfaceError
+from psycopg2.pool import ThreadedConnectionPool
+
+# .streamlit/secrets.toml の [postgresql_pool] で上書きできる
+POOL_DEFAULTS = {
+    "minconn": 1,
+    "maxconn": 10,
+    "timeout": 30,                 # 空きを待つ最大秒数
+    "health_check_interval": 30,   # この秒数以上使われていない接続は貸し出し前に確認する
+}
+
+# 接続のセッションのタイムゾーン。timestamptz を行ごとの時差なしで読み書きするため UTC に固定する
+SESSION_TIMEZONE = "UTC"
+
+
+def connection_params():
+    params = dict(st.secrets["postgresql"])
+    options = params.get("options", "")
+    params["options"] = f"{options} -c timezone={SESSION_TIMEZONE}".strip()
+    return params
+
+
+# プロセス全体で共有する接続プール
+@st.cache_resource
+def get_connection_pool():
+    config = {**POOL_DEFAULTS, **st.secrets.get("postgresql_pool", {})}
+    return {
+        "config": config,
+        "pool": ThreadedConnectionPool(config["minconn"], config["maxconn"], **connection_params()),
+        # ThreadedConnectionPool は上限に達すると即エラーになるため、空きが出るまでセマフォで待つ
+        "slots": threading.BoundedSemaphore(config["maxconn"]),
+        "last_used": {},
+        "lock": threading.Lock(),
+        "metrics": {
+            "checkouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+        },
+    }
+
+
+def get_pool_metrics():
+    state = get_connection_pool()
+    with state["lock"]:
+        metrics = dict(state["metrics"])
+    metrics["wait_seconds_avg"] = metrics["wait_seconds_total"] / metrics["checkouts"] if metrics["checkouts"] else 0.0
+    metrics["maxconn"] = state["config"]["maxconn"]
+    return metrics
+
+
+def _is_healthy(state, conn):
+    if conn.closed:
+        return False
+    last_used = state["last_used"].get(id(conn))
+    if last_used is None or time.monotonic() - last_used < state["config"]["health_check_interval"]:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except (OperationalError, InterfaceError):
+        return False
+
+
+def _checkout(state):
+    pool = state["pool"]
+    while True:
+        conn = pool.getconn()
+        if _is_healthy(state, conn):
+            return conn
+        # 切断されている接続は捨てて作り直す
+        pool.putconn(conn, close=True)
+        with state["lock"]:
+            state["metrics"]["discarded"] += 1
+            state["last_used"].pop(id(conn), None)
+
+
+def _checkin(state, conn):
+    if not conn.closed and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except (OperationalError, InterfaceError):
+            pass
+    state["last_used"][id(conn)] = time.monotonic()
+    state["pool"].putconn(conn, close=bool(conn.closed))
+
+
+# プールから接続を借りる（with を抜けると未コミットの処理はロールバックして返却）
+@contextmanager
+def db_connection():
+    state = get_connection_pool()
+    started = time.perf_counter()
+    if not state["slots"].acquire(timeout=state["config"]["timeout"]):
+        with state["lock"]:
+            state["metrics"]["timeouts"] += 1
+        raise TimeoutError("データベース接続の空きを待つ間にタイムアウトしました。")
+
+    conn = None
+    try:
+        conn = _checkout(state)
+        wait = time.perf_counter() - started
+        with state["lock"]:
+            metrics = state["metrics"]
+            metrics["checkouts"] += 1
+            metrics["wait_seconds_total"] += wait
+            metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], wait)
+        yield conn
+    finally:
+        if conn is not None:
+            _checkin(state, conn)
+        state["slots"].release()
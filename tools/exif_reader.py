@@ -0,0 +1,143 @@
+from datetime import datetime
+from PIL import Image
+from PIL.ExifTags import TAGS, GPSTAGS
+
+# JPEG の先頭から EXIF (APP1) を探すときに読む最大バイト数
+EXIF_HEADER_LIMIT = 256 * 1024
+
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+
+JPEG_SOI = b"\xff\xd8"
+EXIF_PREFIX = b"Exif\x00\x00"
+
+
+# JPEG のマーカーを順にたどり、APP1 (EXIF) セグメントのバイト列だけを返す
+# JPEG でない場合は None、EXIF がないまま画素データ (SOS) に到達した場合は b""
+def read_exif_segment(stream, limit=EXIF_HEADER_LIMIT):
+    if stream.read(2) != JPEG_SOI:
+        return None
+
+    consumed = 2
+    while consumed < limit:
+        marker = stream.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return b""
+        # 埋め草の 0xFF を読み飛ばす（途中でファイルが終わったら打ち切る）
+        while marker[1] == 0xFF:
+            marker = marker[1:] + stream.read(1)
+            consumed += 1
+            if len(marker) < 2 or consumed >= limit:
+                return b""
+        code = marker[1]
+
+        if code in (0xD9, 0xDA):  # EOI / SOS
+            return b""
+        if 0xD0 <= code <= 0xD7 or code == 0x01:  # 長さを持たないマーカー
+            consumed += 2
+            continue
+
+        length_bytes = stream.read(2)
+        if len(length_bytes) < 2:
+            return b""
+        # 長さは自身の2バイトを含むので 2 未満は壊れたファイル
+        length = int.from_bytes(length_bytes, "big")
+        if length < 2:
+            return b""
+        payload = stream.read(length - 2)
+        if code == 0xE1 and payload.startswith(EXIF_PREFIX):
+            return payload
+        consumed += 2 + length
+    return b""
+
+
+# EXIF セグメントを Image._getexif() と同じ形（タグ名 → 値、GPSInfo は辞書）に変換
+def parse_exif_segment(segment):
+    exif = Image.Exif()
+    exif.load(segment)
+    exif_data = {TAGS.get(tag, tag): value for tag, value in exif.items()}
+    exif_data.update({TAGS.get(tag, tag): value for tag, value in exif.get_ifd(EXIF_IFD).items()})
+    gps_info = exif.get_ifd(GPS_IFD)
+    if gps_info:
+        exif_data["GPSInfo"] = dict(gps_info)
+    return exif_data
+
+
+def get_exif_data(image):
+    exif_data = {}
+    info = image._getexif()
+    if info is not None:
+        for tag, value in info.items():
+            tag_name = TAGS.get(tag, tag)
+            exif_data[tag_name] = value
+    return exif_data
+
+
+def get_gps_info(exif_data):
+    if "GPSInfo" in exif_data:
+        gps_info = exif_data["GPSInfo"]
+        gps_data = {GPSTAGS.get(t, t): gps_info[t] for t in gps_info}
+
+        def convert_to_degrees(value):
+            d, m, s = value
+            return d + (m / 60.0) + (s / 3600.0)
+
+        if "GPSLatitude" in gps_data and "GPSLongitude" in gps_data:
+            lat = convert_to_degrees(gps_data["GPSLatitude"])
+            lon = convert_to_degrees(gps_data["GPSLongitude"])
+            if gps_data["GPSLatitudeRef"] == "S":
+                lat = -lat
+            if gps_data["GPSLongitudeRef"] == "W":
+                lon = -lon
+            return lat, lon
+    return None, None
+
+
+# EXIF の撮影日時を "YYYY-MM-DD HH:MM:SS" に（ない・読めない場合は None）
+def parse_exif_datetime(date_taken):
+    if date_taken:
+        try:
+            return datetime.strptime(date_taken, "%Y:%m:%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    return None
+
+
+def get_formatted_datetime(date_taken):
+    return parse_exif_datetime(date_taken) or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# 画像ファイルの EXIF を読む（JPEG はヘッダーのみ、それ以外は PIL で開く）
+def read_exif(file):
+    segment = read_exif_segment(file)
+    if segment is not None:
+        return parse_exif_segment(segment) if segment else {}
+
+    file.seek(0)
+    try:
+        return get_exif_data(Image.open(file))
+    except AttributeError:  # _getexif を持たない形式
+        return {}
+
+
+# ファイルの中身だけから決まる項目（キャッシュの対象）
+# 撮影日時がない写真は読み込んだ時刻で代用し、timestamp_source を "upload" にする
+def photo_metadata(file):
+    exif_data = read_exif(file)
+    latitude, longitude = get_gps_info(exif_data)
+    taken = parse_exif_datetime(exif_data.get("DateTimeOriginal"))
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp": taken or get_formatted_datetime(None),
+        "timestamp_source": "exif" if taken else "upload",
+    }
+
+
+# 1ファイル分のレコード（extract_metadata と同じ形）
+def metadata_record(metadata, username):
+    return {"username": username, **metadata, "comment": ""}
+
+
+def photo_record(file, username):
+    return metadata_record(photo_metadata(file), username)
@@ -0,0 +1,159 @@
+import io
+import numpy as np
+import pandas as pd
+from tools.db_pool import db_connection
+from tools.timeline_parser import TOKYO
+from tools.query_cache import versioned_query
+
+# 前後の経路点がこの秒数以上離れていたら、その間は移動経路が分からないものとして補間しない
+DEFAULT_MAX_GAP_SECONDS = 600
+
+# 写真の timestamp（EXIF の DateTimeOriginal。時差を持たないので JST とみなす）
+PHOTO_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 写真の時刻範囲にかかる経路点と滞在をまとめて取る（時刻は UTC のエポック秒）
+# 滞在は開始時刻で索引を引くため、範囲の前 VISIT_LOOKBACK_SECONDS に始まったものまで含める
+VISIT_LOOKBACK_SECONDS = 7 * 86400
+
+TIMELINE_POINT_COLUMNS = ["is_visit", "time", "end_time", "latitude", "longitude"]
+
+TIMELINE_POINTS_SQL = """
+    SELECT (type = 'visit')::int,
+           extract(epoch FROM coalesce(point_time, start_time)),
+           extract(epoch FROM end_time),
+           latitude, longitude
+    FROM timeline_data
+    WHERE username = %s
+      AND latitude IS NOT NULL AND longitude IS NOT NULL
+      AND ((type = 'timelinePath' AND coalesce(point_time, start_time) BETWEEN %s AND %s)
+           OR (type = 'visit' AND coalesce(point_time, start_time) BETWEEN %s AND %s))
+"""
+
+
+# 写真の timestamp 文字列を UTC のエポック秒に（解析できない値は NaN）
+def photo_epoch_seconds(timestamps):
+    times = pd.to_datetime(pd.Series(timestamps, dtype=object), format=PHOTO_TIMESTAMP_FORMAT, errors="coerce")
+    times = times.dt.tz_localize(TOKYO)
+    seconds = (times - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)
+    return seconds.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+# username の [start, end]（エポック秒）の経路点・滞在を1回の COPY で取り出す
+# 同じ写真の組で再実行したときは、タイムラインが変わっていなければキャッシュした結果を使う
+@versioned_query
+def fetch_timeline_points(username, start, end):
+    lower = pd.Timestamp(start, unit="s", tz="UTC").to_pydatetime()
+    upper = pd.Timestamp(end, unit="s", tz="UTC").to_pydatetime()
+    visit_lower = pd.Timestamp(start - VISIT_LOOKBACK_SECONDS, unit="s", tz="UTC").to_pydatetime()
+    buffer = io.StringIO()
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            query = cur.mogrify(TIMELINE_POINTS_SQL, (username, lower, upper, visit_lower, upper)).decode()
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+    buffer.seek(0)
+    rows = pd.read_csv(buffer, header=None, names=TIMELINE_POINT_COLUMNS, dtype=np.float64)
+
+    path = rows[rows["is_visit"] == 0].sort_values("time", kind="stable")
+    visits = rows[(rows["is_visit"] == 1) & (rows["end_time"] >= start)].sort_values("time", kind="stable")
+    return {
+        "path_time": path["time"].to_numpy(),
+        "path_latitude": path["latitude"].to_numpy(),
+        "path_longitude": path["longitude"].to_numpy(),
+        "visit_start": visits["time"].to_numpy(),
+        "visit_end": visits["end_time"].to_numpy(),
+        "visit_latitude": visits["latitude"].to_numpy(),
+        "visit_longitude": visits["longitude"].to_numpy(),
+    }
+
+
+# 時刻順の経路点に対する as-of 結合。写真の時刻を挟む2点の間を線形補間する
+# 挟む2点の間隔が max_gap_seconds を超える（または片側しかない）ときは、
+# 近い方の点まで max_gap_seconds / 2 以内ならその点の位置を使う（補間したときの最大のずれと同じ）
+def interpolate_path(photo_times, point_times, latitude, longitude, max_gap_seconds):
+    n = len(point_times)
+    result_lat = np.full(len(photo_times), np.nan)
+    result_lng = np.full(len(photo_times), np.nan)
+    if n == 0:
+        return result_lat, result_lng
+
+    after = np.searchsorted(point_times, photo_times, side="left")
+    before = np.searchsorted(point_times, photo_times, side="right") - 1
+    has_before = (before >= 0) & ~np.isnan(photo_times)
+    has_after = (after < n) & ~np.isnan(photo_times)
+    before = np.clip(before, 0, n - 1)
+    after = np.clip(after, 0, n - 1)
+    t0, t1 = point_times[before], point_times[after]
+
+    # 同時刻の点があれば before == after 側の点にそろう（t1 - t0 == 0）
+    bracket = has_before & has_after & (t1 - t0 <= max_gap_seconds)
+    span = np.where(t1 > t0, t1 - t0, 1.0)
+    fraction = np.where(t1 > t0, (photo_times - t0) / span, 0.0)
+    # 経度は日付変更線をまたぐ場合に短い方向へ補間する
+    delta_lng = (longitude[after] - longitude[before] + 180.0) % 360.0 - 180.0
+    interpolated_lat = latitude[before] + fraction * (latitude[after] - latitude[before])
+    interpolated_lng = (longitude[before] + fraction * delta_lng + 180.0) % 360.0 - 180.0
+
+    gap_before = np.where(has_before, photo_times - t0, np.inf)
+    gap_after = np.where(has_after, t1 - photo_times, np.inf)
+    nearest = np.where(gap_before <= gap_after, before, after)
+    snap = ~bracket & (np.minimum(gap_before, gap_after) <= max_gap_seconds / 2)
+
+    result_lat = np.where(bracket, interpolated_lat, np.where(snap, latitude[nearest], np.nan))
+    result_lng = np.where(bracket, interpolated_lng, np.where(snap, longitude[nearest], np.nan))
+    return result_lat, result_lng
+
+
+# 写真の時刻を含む滞在（visit）の場所。滞在は重ならない前提で、直前に始まった滞在だけを見る
+def match_visits(photo_times, visit_start, visit_end, latitude, longitude):
+    if len(visit_start) == 0:
+        return np.full(len(photo_times), np.nan), np.full(len(photo_times), np.nan)
+    index = np.searchsorted(visit_start, photo_times, side="right") - 1
+    found = index >= 0
+    index = np.clip(index, 0, len(visit_start) - 1)
+    inside = found & (photo_times <= visit_end[index])
+    return np.where(inside, latitude[index], np.nan), np.where(inside, longitude[index], np.nan)
+
+
+# 写真の時刻に対応する位置を、経路点の補間 → 滞在場所の順で求める
+def locate_photos(photo_times, points, max_gap_seconds=DEFAULT_MAX_GAP_SECONDS):
+    latitude, longitude = interpolate_path(
+        photo_times, points["path_time"], points["path_latitude"], points["path_longitude"], max_gap_seconds
+    )
+    visit_lat, visit_lng = match_visits(
+        photo_times, points["visit_start"], points["visit_end"], points["visit_latitude"], points["visit_longitude"]
+    )
+    missing = np.isnan(latitude)
+    latitude[missing] = visit_lat[missing]
+    longitude[missing] = visit_lng[missing]
+    return latitude, longitude
+
+
+# GPS を持たない写真のレコードに、同じ時刻のタイムラインから位置を補う
+# 位置の出所を location_source（"exif" / "timeline" / None）に記録する
+# 撮影日時がなく読み込んだ時刻で代用した写真（timestamp_source が "upload"）は補わない
+def geotag_records(records, username, max_gap_seconds=DEFAULT_MAX_GAP_SECONDS):
+    records = [dict(record) for record in records]
+    targets = []
+    for i, record in enumerate(records):
+        if pd.isna(record.get("latitude")) or pd.isna(record.get("longitude")):
+            record["location_source"] = None
+            if record.get("timestamp_source") != "upload":
+                targets.append(i)
+        else:
+            record["location_source"] = record.get("location_source") or "exif"
+    if not targets:
+        return records
+
+    photo_times = photo_epoch_seconds([records[i]["timestamp"] for i in targets])
+    valid = ~np.isnan(photo_times)
+    if not valid.any():
+        return records
+
+    points = fetch_timeline_points(
+        username, float(photo_times[valid].min() - max_gap_seconds), float(photo_times[valid].max() + max_gap_seconds)
+    )
+    latitude, longitude = locate_photos(photo_times, points, max_gap_seconds)
+    for i, lat, lng in zip(targets, latitude, longitude):
+        if not np.isnan(lat):
+            records[i].update(latitude=float(lat), longitude=float(lng), location_source="timeline")
+    return records
@@ -2,24 +2,29 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import io
-import json
+import os
+import tempfile
+from contextlib import closing
 from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import execute_values
-from supabase import create_client, Client
-
-# Supabase のセットアップ
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-
-def show_username_if_exists(supabase):
+from tools.supabase_client import get_supabase
+from tools.db_pool import db_connection
+from tools.user_profile import current_user_id, get_username
+from tools.timeline_parser import (
+    TIMELINE_COLUMNS, convert_series_to_utc, list_timeline_sources, iter_timeline_source_chunks
+)
+from tools.trajectory import SIMPLIFY_METHODS, DEFAULT_TOLERANCE_M, simplify_chunks
+from tools.segmentation import refresh_segmentation
+from tools.spatial import encode_geohash, require_geohash_column
+from tools.analytics_cache import refresh_analytics_cache
+from tools.query_cache import bump_data_version
+from tools.ingest_jobs import enqueue_timeline_job, show_ingest_jobs
+
+
+def show_username_if_exists(supabase=None):
     # セッションから user_id を取得
-    try:
-        user_dict = st.session_state.user.dict()
-        user_id = user_dict.get("id", None)
-    except AttributeError:
+    user_id = current_user_id()
+    if "user" not in st.session_state or st.session_state.user is None:
         st.warning("⚠ ユーザー情報がセッションに保存されていません。")
         return None
     
@@ -27,12 +32,10 @@ def show_username_if_exists(supabase):
         st.warning("⚠ ユーザーIDが見つかりません。")
         return None
 
-    # Supabaseから username を取得
-    response = supabase.table("username").select("username").eq("user_id", user_id).execute()
+    # キャッシュ（なければ Supabase）から username を取得
+    username = get_username(supabase or get_supabase(), user_id)
 
-    if response.data:
-        username = response.data[0]["username"]
-        st.session_state.username = username  # ← セッションに保存！
+    if username:
         st.markdown(f"**ユーザー名**: {username}")
         return username
     else:
@@ -40,112 +43,154 @@ def show_username_if_exists(supabase):
         return None
 
 
-def convert_series_to_utc(series: pd.Series) -> pd.Series:
-    dt_series = pd.to_datetime(series, errors='coerce')
-    if dt_series.dt.tz is None:
-        dt_series = dt_series.dt.tz_localize('Asia/Tokyo')
-    else:
-        dt_series = dt_series.dt.tz_convert('Asia/Tokyo')
-    return dt_series.dt.tz_convert('UTC')
-
-
-def extract_timeline_data(uploaded_file):
-    file_content = uploaded_file.getvalue().decode()
-    data = json.load(io.StringIO(file_content))
-
-    if 'semanticSegments' not in data:
-        raise ValueError("Error: 'semanticSegments' key not found in the JSON file.")
-
-    records = []
-    for segment in data['semanticSegments']:
-        start_time = segment.get('startTime')
-        end_time = segment.get('endTime')
-
-        if 'timelinePath' in segment:
-            for path in segment['timelinePath']:
-                point_time = path.get('time')
-
-                try:
-                    lat, lng = map(float, path['point'].replace('°', '').split(', '))
-                except Exception:
-                    lat, lng = None, None
-
-                records.append([
-                    "timelinePath", start_time, end_time, point_time, lat, lng,
-                    None, None, None, None, None, None, st.session_state.username
-                ])
-
-        if 'visit' in segment:
-            visit = segment['visit']
-            top_candidate = visit.get('topCandidate', {})
-            try:
-                lat, lng = map(float, top_candidate.get('placeLocation', {}).get('latLng', '').replace('°', '').split(', '))
-            except Exception:
-                lat, lng = None, None
-
-            records.append([
-                "visit", start_time, end_time, None, lat, lng,
-                visit.get('probability'), top_candidate.get('placeId'), top_candidate.get('semanticType'),
-                None, None, None, st.session_state.username
-            ])
-
-        if 'activity' in segment:
-            activity = segment['activity']
-            top_candidate = activity.get('topCandidate', {})
-            for key in ['start', 'end']:
-                if key in activity and 'latLng' in activity[key]:
-                    try:
-                        lat, lng = map(float, activity[key]['latLng'].replace('°', '').split(', '))
-                    except Exception:
-                        lat, lng = None, None
-
-                    records.append([
-                        f"activity_{key}", start_time, end_time, None, lat, lng,
-                        None, None, None,
-                        activity.get('distanceMeters'), top_candidate.get('type'), top_candidate.get('probability'),
-                        st.session_state.username
-                    ])
-
-    columns = [
-        "type", "start_time", "end_time", "point_time", "latitude", "longitude",
-        "visit_probability", "visit_placeId", "visit_semanticType",
-        "activity_distanceMeters", "activity_type", "activity_probability",
-        "username"
-    ]
-    df = pd.DataFrame(records, columns=columns)
-
-    # ⏱ タイムスタンプ列の高速一括変換
-    for col in ["start_time", "end_time", "point_time"]:
-        df[col] = convert_series_to_utc(df[col])
-
-    df = df.astype({
-        "latitude": "float64",
-        "longitude": "float64",
-        "activity_distanceMeters": "float32",
-        "visit_probability": "float32",
-        "activity_probability": "float32"
-    })
-
-    df = df.replace({np.nan: None})
-    return df
+# 1回の COPY / INSERT でコミットする行数
+UPLOAD_BATCH_SIZE = 100_000
+
+# アップロード前に表示するプレビューの行数
+PREVIEW_ROWS = 1_000
+
+TIMELINE_INSERT_COLUMNS = """
+    type, start_time, end_time, point_time,
+    latitude, longitude,
+    visit_probability, visit_placeId, visit_semanticType,
+    activity_distanceMeters, activity_type, activity_probability,
+    username, geohash
+"""
+
+
+# 書き込む列に、緯度・経度から求めた geohash（tools/spatial.py）を加える
+def with_geohash(chunk):
+    return chunk[TIMELINE_COLUMNS].assign(geohash=encode_geohash(chunk["latitude"], chunk["longitude"]))
+
+
+# チャンクを CSV にして COPY FROM STDIN で流し込む（NaN / NaT は空欄 = NULL になる）
+def copy_chunk(cur, chunk, table_name):
+    buffer = io.StringIO()
+    with_geohash(chunk).to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table_name} ({TIMELINE_INSERT_COLUMNS}) FROM STDIN WITH (FORMAT csv)", buffer)
+
 
+# DataFrame（category / NaN / NaT）を DB に渡す値（str / float / Timestamp / None）の行に変換する
+# 変換はチャンク単位で行い、全体を object 列にしたコピーは作らない
+def db_rows(chunk):
+    chunk = with_geohash(chunk)
+    return chunk.astype(object).where(chunk.notna(), None).values.tolist()
 
-def upload_to_postgresql(df, conn, table_name="timeline_data"):
-    # アップロード処理中の表示
-    with st.spinner("データをアップロードしています... 少々お待ちください。"):
-        with conn.cursor() as cur:
-            insert_query = f"""
-            INSERT INTO {table_name} (
-                type, start_time, end_time, point_time,
-                latitude, longitude,
-                visit_probability, visit_placeId, visit_semanticType,
-                activity_distanceMeters, activity_type, activity_probability,
-                username
-            ) VALUES %s
-            """
-            values = df.values.tolist()
-            execute_values(cur, insert_query, values)
-            conn.commit()
+
+# 従来の INSERT ... VALUES（COPY が使えない環境向けのフォールバック）
+def insert_chunk(cur, chunk, table_name):
+    insert_query = f"INSERT INTO {table_name} ({TIMELINE_INSERT_COLUMNS}) VALUES %s"
+    execute_values(cur, insert_query, db_rows(chunk), page_size=1000)
+
+
+# 重複取り込みの判定に使う行ハッシュ（同じ内容の行は同じ値になる）
+# migrations/0007_row_hash_everywhere.sql のトリガーも同じ式で、ここを通らない書き込みの行に入れる
+ROW_HASH_SQL = """
+    md5(concat_ws('|',
+        type,
+        coalesce(extract(epoch FROM start_time)::text, ''),
+        coalesce(extract(epoch FROM end_time)::text, ''),
+        coalesce(extract(epoch FROM point_time)::text, ''),
+        coalesce(latitude::text, ''),
+        coalesce(longitude::text, '')
+    ))::uuid
+"""
+
+
+# ユーザーの取り込み済みデータの終了時刻（これより前のセグメントは解析しない）
+def get_upload_high_water_mark(conn, username, table_name="timeline_data"):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT max(end_time) FROM {table_name} WHERE username = %s", (username,))
+        return cur.fetchone()[0]
+
+
+# 一時テーブルに書き込んだチャンクを、既存の行と重複しないものだけ本テーブルへ移す
+# timeline_data に row_hash 列と (username, row_hash) の一意制約が必要（migrations/0007 まで）
+def merge_staged_chunk(cur, table_name, staging_table):
+    cur.execute(f"""
+        INSERT INTO {table_name} ({TIMELINE_INSERT_COLUMNS}, row_hash)
+        SELECT {TIMELINE_INSERT_COLUMNS}, {ROW_HASH_SQL}
+        FROM {staging_table}
+        ON CONFLICT DO NOTHING
+    """)
+    return cur.rowcount
+
+
+# DataFrame のチャンク（iter_timeline_chunks など）を順に受け取り、batch_size 行ずつ
+# （チャンクがそれより小さければチャンクごとに）コミットしながらアップロードする
+# 先頭から数えて start_row 行目までは読み飛ばし、(コミット済みの行数, 新規に追加された行数) を返す
+# on_progress(コミット済み行数, ここまでに新規に追加された行数) がコミットごとに呼ばれるので、
+# 失敗時はその行数から再開できる（チャンクの並びは毎回同じである必要がある）
+# 既に保存されている行（row_hash が同じ行）はスキップする。DataFrame を1つだけ渡してもよい
+def upload_to_postgresql(chunks, conn, table_name="timeline_data", method="copy",
+                         batch_size=UPLOAD_BATCH_SIZE, start_row=0, on_progress=None):
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    write_chunk = copy_chunk if method == "copy" else insert_chunk
+    staging_table = f"{table_name}_staging"
+    position = 0
+    committed = start_row
+    inserted = 0
+    usernames = set()
+
+    require_geohash_column(conn, table_name)
+
+    # 画面からもバックグラウンドのジョブ（tools/ingest_jobs.py）からも呼ぶので、表示は呼び出し側で行う
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {staging_table} ON COMMIT DELETE ROWS AS
+            SELECT {TIMELINE_INSERT_COLUMNS} FROM {table_name} WITH NO DATA
+        """)
+
+        try:
+            for frame in chunks:
+                for offset in range(max(start_row - position, 0), len(frame), batch_size):
+                    chunk = frame.iloc[offset:offset + batch_size]
+                    write_chunk(cur, chunk, staging_table)
+                    inserted += merge_staged_chunk(cur, table_name, staging_table)
+                    conn.commit()
+                    committed = position + offset + len(chunk)
+                    usernames.update(chunk["username"].unique())
+                    if on_progress:
+                        on_progress(committed, inserted)
+                position += len(frame)
+        finally:
+            # 途中で失敗してもコミット済みのチャンクはあるので、キャッシュした結果は読み直させる
+            for username in usernames:
+                bump_data_version(username)
+    return committed, inserted
+
+
+# アップロードされたファイルを directory に保存し、(パス, ZIP内のメンバー名) のリストを返す
+def save_uploaded_sources(uploaded_files, directory):
+    paths = []
+    for i, uploaded_file in enumerate(uploaded_files):
+        path = os.path.join(directory, f"{i}_{os.path.basename(uploaded_file.name)}")
+        with open(path, "wb") as f:
+            f.write(uploaded_file.getbuffer())
+        paths.append(path)
+    sources = list_timeline_sources(paths)
+    if not sources:
+        raise ValueError("JSONファイルが見つかりませんでした。")
+    return sources
+
+
+# 先頭の PREVIEW_ROWS 行だけを解析する（同じファイル構成なら再実行時は結果を再利用）
+def preview_uploaded_timeline(uploaded_files, username, since=None):
+    preview_key = (tuple((f.name, f.size) for f in uploaded_files), since)
+    cached = st.session_state.get("timeline_preview")
+    if cached and cached["key"] == preview_key:
+        return cached["df"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sources = save_uploaded_sources(uploaded_files, tmp_dir)
+        with closing(iter_timeline_source_chunks(sources, username, PREVIEW_ROWS, since, max_workers=1)) as chunks:
+            df = next(chunks, None)
+    df = df.head(PREVIEW_ROWS) if df is not None else pd.DataFrame(columns=TIMELINE_COLUMNS)
+
+    st.session_state.timeline_preview = {"key": preview_key, "df": df}
+    return df
 
 
 def google_timeline():
@@ -171,22 +216,118 @@ def google_timeline():
 
     # アップロードUI
     st.markdown("### 📤 JSONファイルのアップロード")
-    uploaded_file = st.file_uploader("Google Timeline JSONファイルを選択", type=["json"])
+    mode = st.radio("取り込み方法", ["1つのJSONファイル", "複数ファイル / ZIP（一括）"], horizontal=True)
+
+    with st.expander("⚙ アップロード設定"):
+        # 最後に取り込んだ時刻より前のセグメントは、まだ保存していないものでも読み飛ばすので既定では使わない
+        incremental = st.checkbox("差分のみ取り込む（最後に取り込んだ時刻より前のセグメントは解析しない）", value=False)
+        method = st.radio("書き込み方式", ["copy", "insert"], horizontal=True,
+                          format_func=lambda m: "COPY（高速）" if m == "copy" else "INSERT（互換）")
+        batch_size = st.number_input("コミット単位（行）", min_value=1_000, max_value=1_000_000,
+                                     value=UPLOAD_BATCH_SIZE, step=10_000)
+        background = st.checkbox("バックグラウンドで取り込む（タブを閉じても処理を続ける）", value=True)
+        simplify = st.checkbox("timelinePath の点を間引いて保存する")
+        if simplify:
+            simplify_method = st.radio("間引き方法", SIMPLIFY_METHODS, horizontal=True,
+                                       format_func=lambda m: "Douglas–Peucker" if m == "douglas_peucker" else "距離・時間で間引く")
+            tolerance_m = st.number_input("許容誤差（m）", min_value=1.0, max_value=1_000.0,
+                                          value=DEFAULT_TOLERANCE_M, step=1.0)
 
-    if uploaded_file:
-        try:
-            df = extract_timeline_data(uploaded_file)
-            df["username"] = username  # ユーザー名を追加
-            st.success(f"{len(df)} 件のレコードを抽出しました。")
-            st.dataframe(df, use_container_width=True)
-
-            # PostgreSQLにアップロードボタン
-            if st.button("⬆ PostgreSQLにアップロード"):
-                with st.spinner("データをアップロード中..."):
-                    conn = psycopg2.connect(**st.secrets["postgresql"])
-                    upload_to_postgresql(df, conn)
-                    conn.close()
-                st.success("✅ アップロードが完了しました！")
-
-        except Exception as e:
-            st.error(f"エラーが発生しました: {e}")
\ No newline at end of file
+    try:
+        if mode == "1つのJSONファイル":
+            uploaded_file = st.file_uploader("Google Timeline JSONファイルを選択", type=["json"])
+            if not uploaded_file:
+                return
+            uploaded_files = [uploaded_file]
+        else:
+            uploaded_files = st.file_uploader(
+                "Google Timeline JSON / ZIPファイルを選択（複数可）", type=["json", "zip"], accept_multiple_files=True
+            )
+            if not uploaded_files:
+                return
+
+        if background:
+            if st.button("⬆ 取り込みジョブを登録"):
+                job_id = enqueue_timeline_job(uploaded_files, username, {
+                    "incremental": incremental,
+                    "method": method,
+                    "batch_size": int(batch_size),
+                    "simplify": {"method": simplify_method, "tolerance_m": tolerance_m} if simplify else None,
+                })
+                st.success(f"取り込みジョブ #{job_id} を登録しました。進捗は下の一覧で確認できます。")
+            return
+
+        # 取り込み状況（差分の基準時刻とコミット済み行数）はファイル構成ごとに保持する
+        upload_key = (tuple((f.name, f.size) for f in uploaded_files), incremental,
+                      (simplify_method, tolerance_m) if simplify else None)
+        progress_state = st.session_state.get("timeline_upload")
+        if not progress_state or progress_state["key"] != upload_key:
+            since = None
+            if incremental:
+                with db_connection() as conn:
+                    since = get_upload_high_water_mark(conn, username)
+            progress_state = {"key": upload_key, "since": since, "committed": 0, "done": False, "refresh_pending": False}
+            st.session_state.timeline_upload = progress_state
+
+        preview = preview_uploaded_timeline(uploaded_files, username, progress_state["since"])
+        st.markdown(f"#### 👀 先頭 {len(preview)} 件のプレビュー")
+        st.dataframe(preview, use_container_width=True)
+
+        # 途中で失敗した場合はコミット済みの行から再開する
+        resuming = progress_state["committed"] > 0 and not progress_state["done"]
+        if resuming:
+            st.info(f"前回のアップロードは {progress_state['committed']} 行目まで完了しています。")
+
+        # PostgreSQLにアップロードボタン
+        # ファイルは解析しながらチャンクごとにアップロードし、全体の DataFrame は作らない
+        if st.button("⬆ アップロードを再開" if resuming else "⬆ PostgreSQLにアップロード"):
+            status = st.empty()
+            file_status = st.empty()
+
+            def on_file(done, total, name, rows):
+                file_status.caption(f"ファイル {done} / {total} を解析しました: {name}（{rows:,} 行）")
+
+            def on_progress(committed, inserted):
+                progress_state["committed"] = committed
+                progress_state["refresh_pending"] = progress_state["refresh_pending"] or inserted > 0
+                status.caption(f"{committed:,} 行をコミットしました（新規 {inserted:,} 行）")
+
+            start_row = progress_state["committed"]
+            stats = {}
+            with st.spinner("ファイルを解析しながらアップロード中..."):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    sources = save_uploaded_sources(uploaded_files, tmp_dir)
+                    chunks = iter_timeline_source_chunks(sources, username, since=progress_state["since"], stats=stats,
+                                                         on_file=on_file)
+                    if simplify:
+                        chunks = simplify_chunks(chunks, simplify_method, tolerance_m, stats=stats)
+                    with db_connection() as conn:
+                        committed, inserted = upload_to_postgresql(
+                            chunks, conn, method=method, batch_size=int(batch_size), start_row=start_row,
+                            on_progress=on_progress
+                        )
+            progress_state["done"] = True
+            st.success(f"✅ アップロードが完了しました！ 新規 {inserted} 行 / "
+                       f"重複のためスキップ {committed - start_row - inserted} 行（全 {committed} 行）")
+            if stats.get("skipped_segments"):
+                st.info(f"取り込み済みの期間（{progress_state['since']} まで）のセグメント "
+                        f"{stats['skipped_segments']} 件をスキップしました。")
+            if simplify:
+                before, after = stats.get("path_points_before", 0), stats.get("path_points_after", 0)
+                st.info(f"timelinePath の点を {before} → {after} 点に間引きました"
+                        f"（{after / max(before, 1):.1%}、最大誤差 {stats.get('max_deviation_m', 0.0):.1f} m）。")
+
+            # 集計の更新で失敗した場合は、次にボタンを押したときに（アップロードする行がなくても）やり直す
+            if progress_state["refresh_pending"]:
+                with st.spinner("滞在と移動を計算し直しています..."):
+                    refreshed = refresh_segmentation(username)
+                if refreshed:
+                    st.info(f"滞在 {refreshed['stays']:,} 件・移動 {refreshed['trips']:,} 件に更新しました。")
+                refresh_analytics_cache(username)
+                progress_state["refresh_pending"] = False
+
+    except Exception as e:
+        st.error(f"エラーが発生しました: {e}")
+    finally:
+        st.markdown("### 📋 取り込みジョブ")
+        show_ingest_jobs(username)
@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+from tools.db_pool import db_connection
+from tools.timeline_parser import list_timeline_sources, iter_timeline_source_chunks
+from tools.trajectory import simplify_chunks
+from tools.segmentation import refresh_segmentation
+from tools.analytics_cache import refresh_analytics_cache
+
+# .streamlit/secrets.toml の [ingest_jobs] で上書きできる
+INGEST_JOB_DEFAULTS = {
+    "directory": ".ingest_jobs",   # ジョブの SQLite とアップロードされたファイルの置き場所
+    "workers": 2,
+    "poll_seconds": 2,             # 画面で進捗を更新する間隔
+    "stale_seconds": 60,           # 処理中のジョブの心拍がこの秒数途絶えたら、ワーカーが止まったとみなして待機中に戻す
+}
+
+# 空きジョブがないときにワーカーが待つ最大秒数
+WORKER_IDLE_SECONDS = 5
+
+# 処理中のジョブの heartbeat_at を更新する間隔（stale_seconds より十分短くする）
+HEARTBEAT_SECONDS = 10
+
+JOB_STATUS_LABELS = {
+    "queued": "⏳ 待機中",
+    "running": "⚙ 処理中",
+    "done": "✅ 完了",
+    "failed": "❌ 失敗",
+}
+
+# ingest_jobs テーブルを作ったあとで足した列
+ADDED_JOB_COLUMNS = {
+    "refresh_pending": "INTEGER NOT NULL DEFAULT 0",
+    "skipped_segments": "INTEGER NOT NULL DEFAULT 0",
+    "heartbeat_at": "REAL",
+}
+
+
+def job_config():
+    return {**INGEST_JOB_DEFAULTS, **st.secrets.get("ingest_jobs", {})}
+
+
+# ジョブの SQLite に接続する（自動コミット。with を抜けると閉じる）
+@contextmanager
+def _connect(directory):
+    conn = sqlite3.connect(os.path.join(directory, "jobs.sqlite3"), timeout=30, isolation_level=None)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        yield conn
+    finally:
+        conn.close()
+
+
+def init_job_store(directory):
+    os.makedirs(directory, exist_ok=True)
+    with _connect(directory) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                stage TEXT NOT NULL DEFAULT '',
+                file_names TEXT NOT NULL,          -- JSON: アップロード時のファイル名
+                options TEXT NOT NULL,             -- JSON: upload_to_postgresql などに渡す設定
+                total_rows INTEGER,
+                committed_rows INTEGER NOT NULL DEFAULT 0,
+                inserted_rows INTEGER NOT NULL DEFAULT 0,
+                refresh_pending INTEGER NOT NULL DEFAULT 0,  -- 1: 追加した行を集計・キャッシュに反映していない
+                skipped_segments INTEGER NOT NULL DEFAULT 0, -- 差分取り込みで解析しなかったセグメント数
+                heartbeat_at REAL,                 -- 処理中のジョブを持つワーカーが最後に生きていた時刻
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        # 以前のジョブの SQLite には、あとから足した列を追加する
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(ingest_jobs)")}
+        for name, definition in ADDED_JOB_COLUMNS.items():
+            if name not in columns:
+                conn.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {name} {definition}")
+
+
+def job_files_dir(directory, job_id):
+    return os.path.join(directory, str(job_id))
+
+
+def update_job(directory, job_id, **values):
+    values["updated_at"] = time.time()
+    assignments = ", ".join(f"{column} = ?" for column in values)
+    with _connect(directory) as conn:
+        conn.execute(f"UPDATE ingest_jobs SET {assignments} WHERE id = ?", [*values.values(), job_id])
+
+
+# アップロードされたファイルをジョブのディレクトリに保存してキューに積む
+# options: incremental, method, batch_size, simplify（None または {"method", "tolerance_m"}）
+def enqueue_timeline_job(uploaded_files, username, options):
+    runner = get_job_runner()
+    directory = runner["directory"]
+    now = time.time()
+    with _connect(directory) as conn:
+        job_id = conn.execute(
+            # ファイルを書き終えるまでは saving にしておき、ワーカーに拾わせない
+            "INSERT INTO ingest_jobs (username, status, file_names, options, created_at, updated_at) "
+            "VALUES (?, 'saving', ?, ?, ?, ?)",
+            (username, json.dumps([f.name for f in uploaded_files], ensure_ascii=False),
+             json.dumps(options), now, now),
+        ).lastrowid
+
+    files_dir = job_files_dir(directory, job_id)
+    os.makedirs(files_dir, exist_ok=True)
+    for i, uploaded_file in enumerate(uploaded_files):
+        with open(os.path.join(files_dir, f"{i}_{os.path.basename(uploaded_file.name)}"), "wb") as f:
+            f.write(uploaded_file.getbuffer())
+
+    update_job(directory, job_id, status="queued")
+    runner["wake"].set()
+    return job_id
+
+
+def list_jobs(username, limit=20):
+    directory = get_job_runner()["directory"]
+    with _connect(directory) as conn:
+        rows = conn.execute(
+            "SELECT * FROM ingest_jobs WHERE username = ? AND status <> 'saving' ORDER BY id DESC LIMIT ?",
+            (username, limit),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+# 失敗したジョブをコミット済みの行から再開する
+def retry_job(job_id):
+    runner = get_job_runner()
+    update_job(runner["directory"], job_id, status="queued", error=None)
+    runner["wake"].set()
+
+
+# 待機中のジョブを1件だけ取り出して running にする（複数のワーカーが同じジョブを取らないよう排他で）
+# 心拍が stale_seconds より古い処理中のジョブは、持っていたプロセスが終了したとみなして先に待機中に戻す
+def claim_next_job(directory, stale_seconds):
+    now = time.time()
+    with _connect(directory) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "UPDATE ingest_jobs SET status = 'queued' "
+            "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (now - stale_seconds,),
+        )
+        row = conn.execute("SELECT * FROM ingest_jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute("UPDATE ingest_jobs SET status = 'running', updated_at = ?, heartbeat_at = ? WHERE id = ?",
+                     (now, now, row["id"]))
+        conn.execute("COMMIT")
+    return dict(row)
+
+
+# 1件のジョブを処理する。解析結果は毎回同じ順序になるので、committed_rows から再開できる
+def run_timeline_job(directory, job):
+    from tools.google_timeline import upload_to_postgresql, get_upload_high_water_mark
+
+    job_id = job["id"]
+    username = job["username"]
+    options = json.loads(job["options"])
+
+    # 差分の基準時刻は最初の実行時に決めて保存し、再開時も同じ行の集合になるようにする
+    if options.get("incremental") and "since" not in options:
+        with db_connection() as conn:
+            since = get_upload_high_water_mark(conn, username)
+        options["since"] = since.isoformat() if since else None
+        update_job(directory, job_id, options=json.dumps(options))
+    since = datetime.fromisoformat(options["since"]) if options.get("since") else None
+
+    files_dir = job_files_dir(directory, job_id)
+    paths = sorted(
+        (os.path.join(files_dir, name) for name in os.listdir(files_dir)),
+        key=lambda path: int(os.path.basename(path).split("_", 1)[0]),
+    )
+    sources = list_timeline_sources(paths)
+    if not sources:
+        raise ValueError("JSONファイルが見つかりませんでした。")
+
+    # 2ファイル以上はプロセスプールで並列に解析し、解析し終えたファイルを stage に出す
+    def on_file(done, total, name, rows):
+        update_job(directory, job_id, stage=f"解析しながらアップロードしています（ファイル {done} / {total}: {name}）")
+
+    # ファイルは解析しながらチャンクごとにアップロードし、全体の DataFrame は作らない
+    # チャンクの並びは毎回同じなので、再開時は committed_rows 行目まで読み飛ばす
+    stats = {}
+    chunks = iter_timeline_source_chunks(sources, username, since=since, stats=stats, on_file=on_file)
+    if options.get("simplify"):
+        chunks = simplify_chunks(chunks, options["simplify"]["method"], options["simplify"]["tolerance_m"])
+
+    start_row = job["committed_rows"]
+    inserted = job["inserted_rows"]
+    update_job(directory, job_id, stage="解析しながらアップロードしています")
+
+    # 新規の行数と集計の更新待ちは、チャンクをコミットするたびに記録する（途中で失敗しても失われない）
+    def on_progress(committed, new_rows):
+        update_job(directory, job_id, committed_rows=committed, inserted_rows=inserted + new_rows,
+                   refresh_pending=int(bool(job["refresh_pending"] or new_rows)))
+
+    with db_connection() as conn:
+        committed, new_rows = upload_to_postgresql(
+            chunks, conn, method=options.get("method", "copy"), batch_size=int(options["batch_size"]),
+            start_row=start_row, on_progress=on_progress,
+        )
+    update_job(directory, job_id, total_rows=committed, skipped_segments=stats.get("skipped_segments", 0))
+
+    # 以前に滞在・移動を計算したユーザーなら同じ条件で計算し直し、分析用キャッシュにも追記する
+    # 集計の更新で失敗した場合も、再開すると（アップロードする行が残っていなくても）ここからやり直す
+    if job["refresh_pending"] or new_rows:
+        update_job(directory, job_id, stage="集計を更新しています")
+        refresh_segmentation(username)
+        refresh_analytics_cache(username)
+    update_job(directory, job_id, status="done", stage="", committed_rows=committed,
+               inserted_rows=inserted + new_rows, refresh_pending=0)
+    shutil.rmtree(files_dir, ignore_errors=True)
+
+
+def _worker_loop(runner):
+    directory = runner["directory"]
+    stale_seconds = float(runner["config"]["stale_seconds"])
+    while True:
+        job = claim_next_job(directory, stale_seconds)
+        if job is None:
+            runner["wake"].wait(WORKER_IDLE_SECONDS)
+            runner["wake"].clear()
+            continue
+        with runner["lock"]:
+            runner["running"].add(job["id"])
+        try:
+            run_timeline_job(directory, job)
+        except Exception as e:
+            update_job(directory, job["id"], status="failed", stage="", error=str(e))
+        finally:
+            with runner["lock"]:
+                runner["running"].discard(job["id"])
+
+
+# このプロセスのワーカーが処理中のジョブの heartbeat_at を定期的に更新する
+# 解析や集計の更新のように進捗が長く書かれない段階でも、他のプロセスから止まったとみなされないように
+def _heartbeat_loop(runner):
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        with runner["lock"]:
+            job_ids = list(runner["running"])
+        if not job_ids:
+            continue
+        try:
+            with _connect(runner["directory"]) as conn:
+                conn.execute(
+                    f"UPDATE ingest_jobs SET heartbeat_at = ? "
+                    f"WHERE status = 'running' AND id IN ({', '.join('?' * len(job_ids))})",
+                    [time.time(), *job_ids],
+                )
+        except sqlite3.Error:
+            # 書き込めなかった回は飛ばし、次の間隔で更新する
+            pass
+
+
+# プロセス全体で共有するワーカースレッド
+# 処理中のまま心拍が途絶えたジョブ（前回のプロセスが終了したなど）は、ワーカーが待機中に戻して
+# コミット済みの行から再開する。同じディレクトリを使う他のプロセスが処理中のジョブには触れない
+@st.cache_resource
+def get_job_runner():
+    config = job_config()
+    directory = os.path.abspath(config["directory"])
+    init_job_store(directory)
+    with _connect(directory) as conn:
+        # ファイルの保存中に終了したジョブ（他のプロセスが保存中のものは updated_at が新しい）
+        conn.execute("DELETE FROM ingest_jobs WHERE status = 'saving' AND updated_at < ?",
+                     (time.time() - float(config["stale_seconds"]),))
+
+    runner = {"directory": directory, "config": config, "wake": threading.Event(), "threads": [],
+              "lock": threading.Lock(), "running": set()}
+    for i in range(int(config["workers"])):
+        thread = threading.Thread(target=_worker_loop, args=(runner,), name=f"ingest-worker-{i}", daemon=True)
+        thread.start()
+        runner["threads"].append(thread)
+    thread = threading.Thread(target=_heartbeat_loop, args=(runner,), name="ingest-heartbeat", daemon=True)
+    thread.start()
+    runner["threads"].append(thread)
+    return runner
+
+
+# 取り込みジョブの一覧（poll_seconds ごとにこの部分だけ再描画する）
+def show_ingest_jobs(username):
+    @st.fragment(run_every=get_job_runner()["config"]["poll_seconds"])
+    def jobs_panel():
+        jobs = list_jobs(username)
+        if not jobs:
+            st.caption("取り込みジョブはありません。")
+            return
+        for job in jobs:
+            files = ", ".join(json.loads(job["file_names"]))
+            label = JOB_STATUS_LABELS.get(job["status"], job["status"])
+            st.markdown(f"**#{job['id']}** {label} {files}")
+            # 総行数は解析し終えるまで分からないので、それまではコミット済みの行数だけを出す
+            if job["total_rows"]:
+                text = f"{job['committed_rows']} / {job['total_rows']} 行"
+                if job["status"] == "done":
+                    text += f"（新規 {job['inserted_rows']} 行）"
+                st.progress(job["committed_rows"] / job["total_rows"], text=text)
+            elif job["committed_rows"]:
+                st.caption(f"{job['committed_rows']} 行をコミット済み（新規 {job['inserted_rows']} 行）")
+            if job["skipped_segments"]:
+                st.caption(f"取り込み済みの期間のセグメント {job['skipped_segments']} 件をスキップしました。")
+            if job["stage"]:
+                st.caption(job["stage"])
+            if job["status"] == "failed":
+                st.error(job["error"])
+                if st.button("🔁 再開", key=f"retry_job_{job['id']}"):
+                    retry_job(job["id"])
+                    st.rerun(scope="fragment")
+            st.caption(f"登録: {pd.Timestamp(job['created_at'], unit='s', tz='Asia/Tokyo'):%Y-%m-%d %H:%M:%S}")
+
+    jobs_panel()
@@ -0,0 +1,89 @@
+import time
+import pandas as pd
+from tools.spatial import GEOHASH_MIGRATION_MESSAGE, encode_geohash
+from tools.query_cache import bump_data_version
+
+# 1回の upsert で送る行数
+UPSERT_CHUNK_SIZE = 500
+UPSERT_MAX_RETRIES = 3
+UPSERT_BACKOFF_SECONDS = 0.5
+
+# source_key は写真の取り込み元（tools/photo_cache.py のキー）。現在地ページの行では None
+LOCATION_COLUMNS = ["username", "latitude", "longitude", "timestamp", "comment", "source_key"]
+
+# 保存済みの source_key を一度に問い合わせる数（キーは URL に入るので ZIP 内のファイル名の長さに注意）
+SOURCE_KEY_LOOKUP_CHUNK = 200
+
+# PostgreSQL の「列が存在しない」エラー
+UNDEFINED_COLUMN = "42703"
+
+SOURCE_KEY_MIGRATION_MESSAGE = "locations に source_key 列がありません。python -m tools.migrations でマイグレーションを適用してください。"
+
+
+# locations に column 列があるか確かめる（なければ message の RuntimeError）
+def _require_locations_column(supabase, column, message):
+    try:
+        supabase.table("locations").select(column).limit(1).execute()
+    except Exception as e:
+        if getattr(e, "code", None) == UNDEFINED_COLUMN:
+            raise RuntimeError(message) from e
+        raise
+
+
+# 書き込む前に locations にあとから足した列があるか確かめる
+def require_locations_columns(supabase):
+    # migrations/0006_geohash.sql
+    _require_locations_column(supabase, "geohash", GEOHASH_MIGRATION_MESSAGE.format(table="locations"))
+    # migrations/0008_locations_source_key.sql
+    _require_locations_column(supabase, "source_key", SOURCE_KEY_MIGRATION_MESSAGE)
+
+
+# keys のうち username の locations にすでに保存されているもの
+def stored_source_keys(supabase, username, keys):
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return set()
+    _require_locations_column(supabase, "source_key", SOURCE_KEY_MIGRATION_MESSAGE)
+    stored = set()
+    for start in range(0, len(keys), SOURCE_KEY_LOOKUP_CHUNK):
+        response = (
+            supabase.table("locations").select("source_key")
+            .eq("username", username).in_("source_key", keys[start:start + SOURCE_KEY_LOOKUP_CHUNK])
+            .execute()
+        )
+        stored.update(row["source_key"] for row in response.data)
+    return stored
+
+
+# チャンク単位で upsert し、失敗したら間隔を倍にしながら再試行する
+def upsert_chunk(supabase, chunk, max_retries=UPSERT_MAX_RETRIES):
+    for attempt in range(max_retries + 1):
+        try:
+            return supabase.table("locations").upsert(chunk, on_conflict="username,timestamp").execute()
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(UPSERT_BACKOFF_SECONDS * 2 ** attempt)
+
+
+# locations へ (username, timestamp) をキーにまとめて保存（写真ページ・現在地ページ共通）
+# locations に (username, timestamp) の一意制約が必要
+def save_locations(supabase, df, chunk_size=UPSERT_CHUNK_SIZE, on_progress=None):
+    # 同じキーの行が1つのチャンクに複数あると upsert が失敗するので、後の行を残す
+    df = df.reindex(columns=LOCATION_COLUMNS).drop_duplicates(subset=["username", "timestamp"], keep="last")
+    # 範囲・場所での検索用の geohash と、写真の取り込み元の source_key
+    require_locations_columns(supabase)
+    df = df.assign(geohash=encode_geohash(
+        pd.to_numeric(df["latitude"], errors="coerce"), pd.to_numeric(df["longitude"], errors="coerce")
+    ))
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+    try:
+        for start in range(0, len(records), chunk_size):
+            upsert_chunk(supabase, records[start:start + chunk_size])
+            if on_progress:
+                on_progress(min(start + chunk_size, len(records)), len(records))
+    finally:
+        for username in df["username"].unique():
+            bump_data_version(username)
+    return len(records)
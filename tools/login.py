@@ -1,10 +1,5 @@
 import streamlit as st
-from supabase import create_client, Client
-
-# Supabase のセットアップ
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+from tools.supabase_client import get_auth_client
 
 
 # ーーー　ログイン　サインアップ　ログアウト　ーーー
@@ -12,15 +7,15 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 
 def sign_up(email, password):
-    return supabase.auth.sign_up({"email": email, "password": password})
+    return get_auth_client().auth.sign_up({"email": email, "password": password})
 
 def sign_in(email, password):
-    return supabase.auth.sign_in_with_password({"email": email, "password": password})
+    return get_auth_client().auth.sign_in_with_password({"email": email, "password": password})
 
 
 # ログアウト
 def sign_out():
-    supabase.auth.sign_out()
+    get_auth_client().auth.sign_out()
     st.session_state.clear()
     st.session_state.logged_in = False
     st.session_state.user = None
@@ -36,7 +31,7 @@ def login():
     if st.button("ログイン"):
         try:
             res = sign_in(email, password)  # ユーザー認証
-            session = supabase.auth.get_session()  # セッションを取得
+            session = get_auth_client().auth.get_session()  # セッションを取得
 
             if session and session.access_token:
                 st.session_state.logged_in = True  # ログイン状態を設定
@@ -0,0 +1,121 @@
+import math
+import numpy as np
+import pandas as pd
+import folium
+from streamlit_folium import st_folium
+
+# 256px タイル1枚を何マスに分けて集約するか（1マス ≒ 32px）
+MAP_CELLS_PER_TILE = 8
+
+# 表示範囲内の点がこの数以下なら集約せずにそのまま送る
+RAW_POINT_LIMIT = 2_000
+
+# 集約セルの上限（表示範囲が広すぎるときの保険）
+MAP_CLUSTER_LIMIT = 5_000
+
+MIN_ZOOM = 1
+MAX_ZOOM = 18
+
+MAP_HEIGHT = 500
+MAP_WIDTH = 700
+
+
+# ズームレベルごとの集約セルの大きさ（度）
+def grid_size(zoom):
+    return 360.0 / (2 ** zoom * MAP_CELLS_PER_TILE)
+
+
+# 範囲 (min_lat, min_lng, max_lat, max_lng) が地図に収まるズームレベル
+def zoom_for_bounds(bounds, width=MAP_WIDTH, height=MAP_HEIGHT):
+    min_lat, min_lng, max_lat, max_lng = bounds
+    lng_span = max(max_lng - min_lng, 1e-6)
+    lat_span = max(max_lat - min_lat, 1e-6)
+    zoom_lng = math.log2(360.0 * width / 256 / lng_span)
+    zoom_lat = math.log2(180.0 * height / 256 / lat_span)
+    return int(min(max(math.floor(min(zoom_lng, zoom_lat)), MIN_ZOOM), MAX_ZOOM))
+
+
+def bounds_center(bounds):
+    min_lat, min_lng, max_lat, max_lng = bounds
+    return ((min_lat + max_lat) / 2, (min_lng + max_lng) / 2)
+
+
+# 2つの範囲の共通部分（どちらかが None ならもう一方）
+def intersect_bounds(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+
+
+# st_folium の戻り値から表示中の範囲とズームを取り出す
+def view_from_folium(result):
+    if not result or not result.get("bounds") or result.get("zoom") is None:
+        return None
+    south_west = result["bounds"].get("_southWest") or {}
+    north_east = result["bounds"].get("_northEast") or {}
+    if south_west.get("lat") is None or north_east.get("lat") is None:
+        return None
+    bounds = (
+        max(south_west["lat"], -90.0), max(south_west["lng"], -180.0),
+        min(north_east["lat"], 90.0), min(north_east["lng"], 180.0),
+    )
+    return {"zoom": int(result["zoom"]), "bounds": bounds}
+
+
+# DataFrame の点をグリッドで集約する（DB を通さない写真用）
+# 範囲内の点が RAW_POINT_LIMIT 以下なら (None, 点) を、そうでなければ (集約セル, None) を返す
+def cluster_points(df, zoom, bounds=None):
+    points = df.dropna(subset=["latitude", "longitude"])
+    if bounds is not None:
+        min_lat, min_lng, max_lat, max_lng = bounds
+        points = points[points["latitude"].between(min_lat, max_lat) & points["longitude"].between(min_lng, max_lng)]
+    if len(points) <= RAW_POINT_LIMIT:
+        return None, points
+
+    size = grid_size(zoom)
+    latitude = points["latitude"].to_numpy(dtype=float)
+    longitude = points["longitude"].to_numpy(dtype=float)
+    cells = pd.DataFrame({
+        "cell_lat": np.floor(latitude / size),
+        "cell_lng": np.floor(longitude / size),
+        "latitude": latitude,
+        "longitude": longitude,
+    })
+    clusters = cells.groupby(["cell_lat", "cell_lng"], sort=False).agg(
+        count=("latitude", "size"), latitude=("latitude", "mean"), longitude=("longitude", "mean")
+    )
+    return clusters.reset_index(drop=True), None
+
+
+# 集約セルを件数つきの円で描く
+def cluster_layer(clusters, name="clusters"):
+    layer = folium.FeatureGroup(name=name)
+    for row in clusters.itertuples(index=False):
+        folium.CircleMarker(
+            [row.latitude, row.longitude],
+            radius=6 + 4 * math.log10(row.count),
+            tooltip=f"{row.count:,} 件",
+            color="#3186cc", fill=True, fill_opacity=0.6, weight=1,
+        ).add_to(layer)
+    return layer
+
+
+# 集約しない点を小さな円で描く
+def point_layer(points, name="points"):
+    layer = folium.FeatureGroup(name=name)
+    for row in points.itertuples(index=False):
+        folium.CircleMarker([row.latitude, row.longitude], radius=3, color="#e4572e", fill=True, weight=1).add_to(layer)
+    return layer
+
+
+# 地図を描き、ユーザーが動かした後の表示範囲を返す
+# 地図本体は初期表示のまま固定し、レイヤーだけを差し替えるので再描画でも表示位置が戻らない
+def render_cluster_map(layer, initial_view, key):
+    fig = folium.Map(location=bounds_center(initial_view["bounds"]), zoom_start=initial_view["zoom"])
+    result = st_folium(
+        fig, key=key, feature_group_to_add=layer, returned_objects=["bounds", "zoom"],
+        height=MAP_HEIGHT, use_container_width=True,
+    )
+    return view_from_folium(result)
@@ -0,0 +1,97 @@
+import os
+import sys
+import glob
+import argparse
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+# 同時に複数のプロセスから適用しないためのアドバイザリロックのキー
+MIGRATION_LOCK_ID = 7_351_924
+
+
+def migration_version(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def applied_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version text PRIMARY KEY,
+                applied_at timestamptz NOT NULL DEFAULT now()
+            )
+        """)
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+
+# 1ファイルを1トランザクションで適用し、schema_migrations に記録する
+def apply_migration_file(conn, path):
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (migration_version(path),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# migrations/ 直下の *.sql のうち未適用のものをファイル名順に適用し、適用したバージョンを返す
+def apply_migrations(conn, directory=MIGRATIONS_DIR):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        done = applied_versions(conn)
+        applied = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.sql"))):
+            if migration_version(path) in done:
+                continue
+            apply_migration_file(conn, path)
+            applied.append(migration_version(path))
+        return applied
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+
+def connect(dsn=None):
+    if dsn:
+        return psycopg2.connect(dsn)
+    import streamlit as st
+    return psycopg2.connect(**st.secrets["postgresql"])
+
+
+# python -m tools.migrations [--dsn DSN] [--file PATH]
+# DSN を省略すると .streamlit/secrets.toml の [postgresql] に接続する
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="timeline_data / locations のマイグレーションを適用する")
+    parser.add_argument("--dsn", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--file", help="指定したファイルだけを適用する（migrations/optional/ など）")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.dsn)
+    try:
+        if args.file:
+            applied_versions(conn)
+            apply_migration_file(conn, args.file)
+            applied = [migration_version(args.file)]
+        else:
+            applied = apply_migrations(conn)
+    finally:
+        conn.close()
+
+    for version in applied:
+        print(f"applied {version}")
+    if not applied:
+        print("no pending migrations")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
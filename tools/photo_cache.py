@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import streamlit as st
+from tools.cache_utils import new_lru_cache, lru_get, lru_put, lru_items, lru_metrics
+
+try:
+    import xxhash
+except ImportError:  # xxhash がなければ標準ライブラリのハッシュで代用する
+    xxhash = None
+
+# .streamlit/secrets.toml の [photo_cache] で上書きできる
+PHOTO_CACHE_DEFAULTS = {
+    "max_entries": 50_000,
+    "max_bytes": 64 * 1024 * 1024,
+    "path": None,   # 指定するとキャッシュをこの JSON ファイルに保存し、起動時に読み込む
+}
+
+# 内容ハッシュに使う先頭・末尾のブロックサイズ
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def _hasher():
+    return xxhash.xxh3_128() if xxhash else hashlib.blake2b(digest_size=16)
+
+
+# ファイル全体は読まず、先頭と末尾のブロックとサイズからキーを作る
+def file_content_key(file):
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    h = _hasher()
+    h.update(file.read(HASH_BLOCK_SIZE))
+    if size > HASH_BLOCK_SIZE:
+        file.seek(max(size - HASH_BLOCK_SIZE, HASH_BLOCK_SIZE))
+        h.update(file.read(HASH_BLOCK_SIZE))
+    file.seek(0)
+    return f"{h.hexdigest()}:{size}"
+
+
+# ZIP のエントリは中央ディレクトリのファイル名・CRC・サイズをそのままキーにする（展開不要）
+# locations の source_key にも保存し、同じエントリを次に取り込むときは展開せずに読み飛ばす
+def zip_entry_key(info):
+    return f"zip:{info.filename}:{info.CRC:08x}:{info.file_size}"
+
+
+def metadata_size(key, metadata):
+    return sys.getsizeof(key) + sys.getsizeof(metadata) + sum(sys.getsizeof(v) for v in metadata.values())
+
+
+def _load_from_disk(cache, path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return
+    for key, metadata in entries:
+        lru_put(cache, key, metadata, metadata_size(key, metadata))
+
+
+# プロセス全体で共有するメタデータキャッシュ（内容が同じファイルは誰のアップロードでも同じ結果）
+@st.cache_resource
+def get_photo_cache():
+    config = {**PHOTO_CACHE_DEFAULTS, **st.secrets.get("photo_cache", {})}
+    cache = new_lru_cache(config["max_entries"], config["max_bytes"])
+    cache["path"] = config["path"]
+    if config["path"]:
+        _load_from_disk(cache, config["path"])
+    return cache
+
+
+def get_cached_metadata(key):
+    return lru_get(get_photo_cache(), key)
+
+
+def put_cached_metadata(key, metadata):
+    lru_put(get_photo_cache(), key, metadata, metadata_size(key, metadata))
+
+
+# 一時ファイルに書いてから置き換え、途中で落ちても壊れたファイルを残さない
+def persist_photo_cache():
+    cache = get_photo_cache()
+    path = cache["path"]
+    if not path:
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(lru_items(cache), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+
+def photo_cache_metrics():
+    return lru_metrics(get_photo_cache())
@@ -1,122 +1,203 @@
 import streamlit as st
 import pandas as pd
 import zipfile  
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import folium
 from streamlit_folium import folium_static
-from supabase import create_client, Client
-from datetime import datetime
-
-# Supabase のセットアップ
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+from tools.supabase_client import get_supabase
+from tools.locations import save_locations, stored_source_keys
+from tools.exif_reader import photo_metadata, metadata_record, photo_record
+from tools.map_clusters import zoom_for_bounds, cluster_points, cluster_layer, render_cluster_map
+from tools.photo_cache import file_content_key, zip_entry_key, get_cached_metadata, put_cached_metadata, persist_photo_cache, photo_cache_metrics
+from tools.geotag import DEFAULT_MAX_GAP_SECONDS, geotag_records
 
 def check_username():
     if "username" not in st.session_state or not st.session_state.username:
         st.error("⚠️ ダッシュボードでユーザーネームを作成してください。")
 
-def get_exif_data(image):
-    exif_data = {}
-    info = image._getexif()
-    if info is not None:
-        for tag, value in info.items():
-            tag_name = TAGS.get(tag, tag)
-            exif_data[tag_name] = value
-    return exif_data
-
-def get_gps_info(exif_data):
-    if "GPSInfo" in exif_data:
-        gps_info = exif_data["GPSInfo"]
-        gps_data = {GPSTAGS.get(t, t): gps_info[t] for t in gps_info}
-
-        def convert_to_degrees(value):
-            d, m, s = value
-            return d + (m / 60.0) + (s / 3600.0)
-
-        if "GPSLatitude" in gps_data and "GPSLongitude" in gps_data:
-            lat = convert_to_degrees(gps_data["GPSLatitude"])
-            lon = convert_to_degrees(gps_data["GPSLongitude"])
-            if gps_data["GPSLatitudeRef"] == "S":
-                lat = -lat
-            if gps_data["GPSLongitudeRef"] == "W":
-                lon = -lon
-            return lat, lon
-    return None, None
-
-def get_formatted_datetime(date_taken):
-    if date_taken:
+# EXIF の読み取りを並列に行うスレッド数（ヘッダーだけを読むので I/O 待ちが中心）
+EXIF_WORKERS = 8
+
+PHOTO_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+# 中央ディレクトリ（ファイル名・CRC）だけを見て、展開せずに対象の画像エントリを選ぶ
+def zip_photo_entries(zip_ref):
+    return [
+        info for info in zip_ref.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and info.filename.lower().endswith(PHOTO_SUFFIXES)
+    ]
+
+# エントリを丸ごと展開せず、EXIF ヘッダーに必要な分だけをストリームで読む
+def read_zip_member(zip_ref, info):
+    with zip_ref.open(info) as file:
+        return photo_metadata(file)
+
+def read_uploaded_image(uploaded_file):
+    uploaded_file.seek(0)
+    return photo_metadata(uploaded_file)
+
+# アップロード順を保ったまま EXIF を並列に読み、1件ごとに on_progress(done, total) を呼ぶ
+# 内容ハッシュ（ZIP はファイル名と CRC）でキャッシュを引き、一度読んだファイルは再実行やセッションをまたいでも読み直さない
+# ZIP のエントリのうち locations に保存済みのもの（source_key が同じもの）は展開せずに除き、stats["skipped_entries"] に数える
+def process_uploaded_files(uploaded_images, uploaded_zip, on_progress=None, stats=None):
+    username = st.session_state.username
+    zip_ref = zipfile.ZipFile(uploaded_zip, 'r') if uploaded_zip else None
+    try:
+        metadata_list = []
+        keys = []
+        tasks = []
+
+        def add(key, func, *args):
+            metadata = get_cached_metadata(key)
+            # timestamp_source がない以前のキャッシュと、撮影日時のない写真（読み込んだ時刻で代用）は読み直す
+            if metadata is None or metadata.get("timestamp_source") != "exif":
+                metadata = None
+                tasks.append((len(metadata_list), key, func, args))
+            metadata_list.append(metadata)
+            keys.append(key)
+
+        if zip_ref:
+            entries = [(zip_entry_key(info), info) for info in zip_photo_entries(zip_ref)]
+            stored = stored_source_keys(get_supabase(), username, [key for key, _ in entries])
+            if stats is not None:
+                stats["skipped_entries"] = sum(key in stored for key, _ in entries)
+            for key, info in entries:
+                if key not in stored:
+                    add(key, read_zip_member, zip_ref, info)
+        if uploaded_images:
+            for uploaded_file in uploaded_images:
+                add(file_content_key(uploaded_file), read_uploaded_image, uploaded_file)
+
+        with ThreadPoolExecutor(max_workers=EXIF_WORKERS) as executor:
+            futures = {executor.submit(func, *args): (i, key) for i, key, func, args in tasks}
+            cached = 0
+            for done, future in enumerate(as_completed(futures), start=1):
+                i, key = futures[future]
+                metadata_list[i] = future.result()
+                # 読み込んだ時刻で代用した撮影日時は、内容が同じでも読むたびに変わるのでキャッシュしない
+                if metadata_list[i]["timestamp_source"] == "exif":
+                    put_cached_metadata(key, metadata_list[i])
+                    cached += 1
+                if on_progress:
+                    on_progress(done, len(tasks))
+        if cached:
+            persist_photo_cache()
+
+        return [{**metadata_record(metadata, username), "source_key": key} for metadata, key in zip(metadata_list, keys)]
+    finally:
+        if zip_ref:
+            zip_ref.close()
+
+# GPS のない写真の位置を、撮影時刻の Google Timeline（myDB の timeline_data）から補う
+# upload_key（uploaded_files_key）を渡すと、結果をファイルの構成と最大間隔ごとにセッションに保持し、同じ条件の再実行では計算し直さない
+def geotag_uploaded_photos(data_list, upload_key=None):
+    if not st.checkbox("📍 GPS のない写真の位置をタイムラインから補う", value=True):
+        return data_list
+    max_gap_minutes = st.number_input("前後の経路点の最大間隔（分）", min_value=1, max_value=180, value=DEFAULT_MAX_GAP_SECONDS // 60)
+    geotag_key = (upload_key, max_gap_minutes)
+    cached = st.session_state.get("photo_geotag")
+    if cached and cached[0] == geotag_key and upload_key is not None:
+        tagged = cached[1]
+    else:
         try:
-            return datetime.strptime(date_taken, "%Y:%m:%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
-        except ValueError:
-            pass
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-def save_to_db(supabase, df):
-    for _, row in df.iterrows():
-        timestamp = row["timestamp"]
-        data = {
-            "username": row["username"],
-            "latitude": row["latitude"],
-            "longitude": row["longitude"],
-            "timestamp": timestamp,
-            "comment": row["comment"]
-        }
-        existing = supabase.table("locations").select("*").eq("username", row["username"]).eq("timestamp", timestamp).execute()
-        if existing.data:
-            supabase.table("locations").update({"comment": row["comment"]}).eq("username", row["username"]).eq("timestamp", timestamp).execute()
-        else:
-            supabase.table("locations").insert(data).execute()
-
-def process_uploaded_files(uploaded_images, uploaded_zip):
-    data_list = []
-    if uploaded_zip:
-        with zipfile.ZipFile(uploaded_zip, 'r') as zip_ref:
-            for file_name in zip_ref.namelist():
-                if file_name.lower().endswith((".jpg", ".jpeg", ".png")):
-                    with zip_ref.open(file_name) as file:
-                        data_list.append(extract_metadata(file))
-    if uploaded_images:
-        for uploaded_file in uploaded_images:
-            data_list.append(extract_metadata(uploaded_file))
-    return data_list
+            tagged = geotag_records(data_list, st.session_state.username, max_gap_minutes * 60)
+        except Exception as e:
+            st.warning(f"タイムラインから位置を補えませんでした: {e}")
+            return data_list
+        st.session_state.photo_geotag = (geotag_key, tagged)
+    filled = sum(record["location_source"] == "timeline" for record in tagged)
+    unknown = sum(record["location_source"] is None for record in tagged)
+    undated = sum(record["location_source"] is None and record.get("timestamp_source") == "upload" for record in tagged)
+    st.caption(f"タイムラインから {filled} 枚の位置を補いました（位置が分からない写真: {unknown} 枚、"
+               f"うち撮影日時がない写真: {undated} 枚）")
+    return tagged
+
+# アップロードしたファイルの構成（ファイル名とサイズ）
+def uploaded_files_key(uploaded_images, uploaded_zip):
+    files = list(uploaded_images or []) + ([uploaded_zip] if uploaded_zip else [])
+    return tuple((f.name, f.size) for f in files)
 
 def extract_metadata(file):
-    image = Image.open(file)
-    exif_data = get_exif_data(image)
-    latitude, longitude = get_gps_info(exif_data)
-    formatted_date = get_formatted_datetime(exif_data.get("DateTimeOriginal"))
-    return {"username": st.session_state.username, "latitude": latitude, "longitude": longitude, "timestamp": formatted_date, "comment": ""}
+    return photo_record(file, st.session_state.username)
 
+# 写真が多いときは表示範囲の点をグリッドで集約し、少なければ1枚ずつマーカーを立てる
 def display_map(data_list):
     st.subheader("位置情報を地図で表示")
-    map_location = folium.Map(location=[35.0, 135.0], zoom_start=5)
-    for data in data_list:
-        if data["latitude"] is not None and data["longitude"] is not None:
+    df = pd.DataFrame(data_list)
+    located = df.dropna(subset=["latitude", "longitude"])
+    if located.empty:
+        folium_static(folium.Map(location=[35.0, 135.0], zoom_start=5))
+        return
+
+    extent = (
+        float(located["latitude"].min()), float(located["longitude"].min()),
+        float(located["latitude"].max()), float(located["longitude"].max()),
+    )
+    if st.session_state.get("photo_map_extent") != extent:
+        st.session_state.photo_map_extent = extent
+        st.session_state.photo_map_initial = {"zoom": zoom_for_bounds(extent), "bounds": extent}
+        st.session_state.photo_map_view = st.session_state.photo_map_initial
+
+    view = st.session_state.photo_map_view
+    clusters, points = cluster_points(located, view["zoom"], view["bounds"])
+    if clusters is not None:
+        layer = cluster_layer(clusters)
+        st.caption(f"表示範囲の {int(clusters['count'].sum()):,} 枚を {len(clusters):,} セルに集約して表示しています。")
+    else:
+        layer = folium.FeatureGroup(name="photos")
+        for data in points.to_dict(orient="records"):
             folium.Marker([data["latitude"], data["longitude"]],
-                          popup=f"Username: {data['username']}\nComment: {data['comment']}\nTimestamp: {data['timestamp']}").add_to(map_location)
-    folium_static(map_location)
+                          popup=f"Username: {data['username']}\nComment: {data['comment']}\nTimestamp: {data['timestamp']}").add_to(layer)
+
+    new_view = render_cluster_map(layer, st.session_state.photo_map_initial, key="photo_map")
+    if new_view and new_view != view:
+        st.session_state.photo_map_view = new_view
+        st.rerun()
 
 
 def main():
     st.title("📸 写真アップローダー & EXIFデータ取得")
     uploaded_images = st.file_uploader("画像ファイルをアップロードしてください", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
     uploaded_zip = st.file_uploader("ZIPファイルをアップロードしてください", type=["zip"], accept_multiple_files=False)
-    data_list = process_uploaded_files(uploaded_images, uploaded_zip)
+    progress = st.empty()
+
+    def on_progress(done, total):
+        progress.progress(done / total, text=f"EXIF を読み取り中... {done} / {total}")
+
+    # EXIF はアップロードしたファイルの構成（名前とサイズ）が変わったときだけ読む
+    # コメントの編集などの再実行では読み直さない
+    upload_key = uploaded_files_key(uploaded_images, uploaded_zip)
+    if st.session_state.get("photo_upload_key") != upload_key:
+        stats = {}
+        st.session_state.photo_records = process_uploaded_files(uploaded_images, uploaded_zip, on_progress, stats)
+        st.session_state.photo_upload_stats = stats
+        st.session_state.photo_upload_key = upload_key
+    progress.empty()
+    data_list = st.session_state.photo_records
+    skipped = st.session_state.photo_upload_stats.get("skipped_entries")
+    if skipped:
+        st.info(f"ZIP 内の {skipped} 枚はすでに保存されているため読み飛ばしました。")
+    with st.expander("🗃️ EXIF キャッシュ"):
+        st.write(photo_cache_metrics())
     if data_list:
-        st.session_state.data_list = data_list
+        tagged = geotag_uploaded_photos(data_list, upload_key)
+        # ファイルか位置の補い方が変わったときだけ表を作り直し、それ以外は編集したコメントを残す
+        if st.session_state.get("photo_data_source") is not tagged:
+            st.session_state.photo_data_source = tagged
+            st.session_state.data_list = tagged
         st.success("データが保存されました！")
     if "data_list" in st.session_state and st.session_state.data_list:
         df = pd.DataFrame(st.session_state.data_list)
-        edited_df = st.data_editor(df, column_config={"comment": {"editable": True}}, disabled=["username", "latitude", "longitude", "timestamp"], num_rows="fixed")
+        edited_df = st.data_editor(df, column_config={"comment": {"editable": True}, "source_key": None}, disabled=["username", "latitude", "longitude", "timestamp", "timestamp_source", "location_source"], num_rows="fixed")
         st.session_state.data_list = edited_df.to_dict(orient="records")
         display_map(st.session_state.data_list)
         if st.button("DBへpush"):
-            save_to_db(supabase, pd.DataFrame(st.session_state.data_list))
+            save_locations(get_supabase(), pd.DataFrame(st.session_state.data_list))
             st.success("データがDBに保存されました！")
     st.title(f"DBに保存されている{st.session_state.username}のデータ")
-    response = supabase.table("locations").select("*").eq("username", st.session_state.username).execute()
+    response = get_supabase().table("locations").select("*").eq("username", st.session_state.username).execute()
     if response.data:
         st.dataframe(pd.DataFrame(response.data))
     else:
@@ -0,0 +1,112 @@
+import sys
+import inspect
+import functools
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+from tools.cache_utils import new_lru_cache, lru_get, lru_put, lru_metrics
+
+# .streamlit/secrets.toml の [query_cache] で上書きできる
+QUERY_CACHE_DEFAULTS = {
+    "max_entries": 512,
+    "max_bytes": 256 * 1024 * 1024,
+}
+
+# username を指定しない問い合わせ（全ユーザー）用のバージョンのキー
+ALL_USERS = None
+
+
+# プロセス全体で共有する結果のキャッシュと、ユーザーごとのデータのバージョン
+# バージョンはデータを書き込むたびに上がり、古いバージョンのキーの結果は使われずに LRU で追い出される
+@st.cache_resource
+def get_query_cache():
+    config = {**QUERY_CACHE_DEFAULTS, **st.secrets.get("query_cache", {})}
+    cache = new_lru_cache(config["max_entries"], config["max_bytes"])
+    cache["versions"] = {}
+    cache["versions_lock"] = threading.Lock()
+    return cache
+
+
+def data_version(username):
+    cache = get_query_cache()
+    with cache["versions_lock"]:
+        return cache["versions"].get(username, 0)
+
+
+# username のデータが変わったときに呼ぶ（全ユーザー分の問い合わせのバージョンも上げる）
+def bump_data_version(username):
+    cache = get_query_cache()
+    with cache["versions_lock"]:
+        for key in {username, ALL_USERS}:
+            cache["versions"][key] = cache["versions"].get(key, 0) + 1
+
+
+def result_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, tuple):
+        return sum(result_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(result_size(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+# 呼び出し側が表示用に書き換えても（convert_to_jst など）キャッシュの中身は変わらないようにする
+def _copy(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    return value
+
+
+# 引数をキャッシュのキーにできる値にする（dict / list は tuple に直す）
+# DataFrame や配列などハッシュできない値は、キーを取り違えないように TypeError にする
+def _key_value(value):
+    if isinstance(value, dict):
+        return tuple(sorted(((k, _key_value(v)) for k, v in value.items()), key=lambda item: repr(item[0])))
+    if isinstance(value, (list, tuple)):
+        return tuple(_key_value(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_key_value(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        raise TypeError(f"キャッシュのキーにできない引数です: {type(value).__name__}") from None
+    return value
+
+
+# 第1引数の username ごとに、(関数名, 引数, データのバージョン) をキーに結果をキャッシュする
+# 引数は既定値を補って名前で並べるので、位置引数で渡してもキーワード引数で渡しても同じキーになる
+def versioned_query(func):
+    signature = inspect.signature(func)
+    username_parameter = next(iter(signature.parameters))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        username = bound.arguments[username_parameter]
+        cache = get_query_cache()
+        key = (func.__qualname__, _key_value(bound.arguments), data_version(username))
+        value = lru_get(cache, key)
+        if value is None:
+            value = func(*bound.args, **bound.kwargs)
+            lru_put(cache, key, value, result_size(value))
+        return _copy(value)
+    return wrapper
+
+
+def query_cache_metrics():
+    cache = get_query_cache()
+    metrics = lru_metrics(cache)
+    with cache["versions_lock"]:
+        metrics["users"] = len([key for key in cache["versions"] if key is not ALL_USERS])
+    return metrics
@@ -0,0 +1,308 @@
+import io
+import math
+import time
+import numpy as np
+import pandas as pd
+from tools.db_pool import db_connection
+from tools.query_cache import bump_data_version
+from tools.trajectory import EARTH_RADIUS_M, haversine_m
+
+# 滞在とみなす半径（m）と最短の時間
+DEFAULT_STAY_RADIUS_M = 200.0
+DEFAULT_MIN_STAY_SECONDS = 20 * 60
+
+# アンカーから半径の外に出る点を探すとき、最初の SCALAR_CHECKS 点は1点ずつ（徒歩など、数点で半径を出る区間が多い）、
+# それ以降は SEARCH_BLOCK 点ずつまとめて距離を測る（見つからなければブロックを倍にする）
+SCALAR_CHECKS = 8
+SEARCH_BLOCK = 64
+
+# Timeline の移動手段がない区間は平均速度（m/s）で推定する（上限, 移動手段）
+SPEED_MODES = [(2.2, "WALKING"), (7.0, "CYCLING"), (60.0, "IN_PASSENGER_VEHICLE"), (np.inf, "FLYING")]
+
+STAY_COLUMNS = ["username", "seq", "start_time", "end_time", "latitude", "longitude", "points"]
+
+TRIP_COLUMNS = [
+    "username", "seq", "from_stay", "to_stay", "start_time", "end_time",
+    "start_latitude", "start_longitude", "end_latitude", "end_longitude",
+    "distance_m", "duration_s", "mode", "mode_source", "points",
+]
+
+# 位置のある行を時刻つきの点にする。visit と activity は開始・終了の両方の時刻にその位置を置く
+SEGMENTATION_POINTS_SQL = """
+    SELECT extract(epoch FROM coalesce(point_time, start_time)), latitude, longitude
+    FROM timeline_data
+    WHERE username = %(username)s AND type IN ('timelinePath', 'visit', 'activity_start')
+      AND coalesce(point_time, start_time) IS NOT NULL
+      AND latitude IS NOT NULL AND longitude IS NOT NULL
+    UNION ALL
+    SELECT extract(epoch FROM end_time), latitude, longitude
+    FROM timeline_data
+    WHERE username = %(username)s AND type IN ('visit', 'activity_end')
+      AND end_time IS NOT NULL
+      AND latitude IS NOT NULL AND longitude IS NOT NULL
+"""
+
+SEGMENTATION_ACTIVITIES_SQL = """
+    SELECT extract(epoch FROM start_time), extract(epoch FROM end_time), activity_type
+    FROM timeline_data
+    WHERE username = %(username)s AND type = 'activity_start'
+      AND start_time IS NOT NULL AND end_time IS NOT NULL AND activity_type IS NOT NULL
+"""
+
+
+# アンカー a から見て、[start, stop) のうち半径の外にある最初の点（なければ stop）
+# 緯度経度はラジアン、cos(緯度) は前計算しておき、距離そのものではなく haversine の値を閾値と比べる
+def _first_outside(phi, lam, cos_phi, a, start, stop, threshold):
+    phi_a, lam_a, cos_a = float(phi[a]), float(lam[a]), float(cos_phi[a])
+    end = min(start + SCALAR_CHECKS, stop)
+    for k in range(start, end):
+        h = math.sin((float(phi[k]) - phi_a) / 2) ** 2 + cos_a * float(cos_phi[k]) * math.sin((float(lam[k]) - lam_a) / 2) ** 2
+        if h > threshold:
+            return k
+
+    start = end
+    block = SEARCH_BLOCK
+    while start < stop:
+        end = min(start + block, stop)
+        h = np.sin((phi[start:end] - phi_a) / 2) ** 2 + cos_a * cos_phi[start:end] * np.sin((lam[start:end] - lam_a) / 2) ** 2
+        outside = np.flatnonzero(h > threshold)
+        if len(outside):
+            return start + int(outside[0])
+        start = end
+        block *= 2
+    return stop
+
+
+# 時刻順の点列から滞在（アンカーから半径 radius_m 以内に min_stay_seconds 以上とどまった区間）を探す
+# アンカーから半径の外に出た最初の点を次のアンカーにする1パスで、各点を調べるのは定数回
+# 返り値は滞在ごとの最初と最後の点の添字
+def detect_stays(times, latitude, longitude, radius_m, min_stay_seconds):
+    n = len(times)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    step = haversine_m(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:])
+    path_length = np.concatenate([[0.0], np.cumsum(step)])
+    index = np.arange(n)
+    # アンカーからの道のりが radius_m 以内の点は直線距離でも半径内なので調べなくてよい
+    lower = np.minimum(np.searchsorted(path_length, path_length + radius_m, side="right"), n)
+    lower = np.maximum(lower, index + 1)
+    # 直前の点から 2 * radius_m を超えて離れた点は、どのアンカーから見ても半径の外（そこで必ず区切れる）
+    jumps = np.append(np.flatnonzero(step > 2 * radius_m) + 1, n)
+    upper = jumps[np.searchsorted(jumps, index, side="right")]
+    # 次の点がすでに半径の外にあるアンカーは1点だけの区間（滞在にならない）なので、まとめて読み飛ばす
+    single = np.append(step > radius_m, True)
+    not_single = np.append(np.flatnonzero(~single), n)
+    next_not_single = not_single[np.searchsorted(not_single, index)]
+
+    phi, lam = np.radians(latitude), np.radians(longitude)
+    cos_phi = np.cos(phi)
+    threshold = math.sin(radius_m / (2 * EARTH_RADIUS_M)) ** 2
+
+    first, last = [], []
+    a = 0
+    while a < n:
+        if single[a]:
+            a = int(next_not_single[a])
+            continue
+        lo, hi = int(lower[a]), int(upper[a])
+        j = _first_outside(phi, lam, cos_phi, a, lo, hi, threshold) if lo < hi else hi
+        if times[j - 1] - times[a] >= min_stay_seconds:
+            first.append(a)
+            last.append(j - 1)
+        a = j
+    return np.array(first, dtype=np.int64), np.array(last, dtype=np.int64)
+
+
+# 点 [first, last] の重心（累積和から区間ごとに求める）
+def _centroids(latitude, longitude, first, last):
+    lat_sum = np.concatenate([[0.0], np.cumsum(latitude)])
+    lng_sum = np.concatenate([[0.0], np.cumsum(longitude)])
+    count = last - first + 1
+    return (lat_sum[last + 1] - lat_sum[first]) / count, (lng_sum[last + 1] - lng_sum[first]) / count
+
+
+# 間に点がなく、重心どうしが radius_m 以内の続いた滞在は1つにまとめる（半径の境目で分かれた滞在）
+def merge_adjacent_stays(latitude, longitude, first, last, radius_m):
+    if len(first) < 2:
+        return first, last
+    lat, lng = _centroids(latitude, longitude, first, last)
+    joined = (first[1:] == last[:-1] + 1) & (haversine_m(lat[:-1], lng[:-1], lat[1:], lng[1:]) <= radius_m)
+    starts = np.flatnonzero(np.concatenate([[True], ~joined]))
+    ends = np.append(starts[1:] - 1, len(first) - 1)
+    return first[starts], last[ends]
+
+
+# 区間の移動手段。Timeline の activity（中間の時刻を含むもの）があればその種類、なければ平均速度から推定
+def trip_modes(midpoints, speeds, activities):
+    modes = np.array([mode for _, mode in SPEED_MODES], dtype=object)[
+        np.searchsorted([limit for limit, _ in SPEED_MODES], speeds, side="left")
+    ]
+    sources = np.full(len(midpoints), "speed", dtype=object)
+    if len(activities) and len(midpoints):
+        index = np.searchsorted(activities["start"].to_numpy(), midpoints, side="right") - 1
+        found = index >= 0
+        index = np.clip(index, 0, len(activities) - 1)
+        inside = found & (midpoints <= activities["end"].to_numpy()[index])
+        modes = np.where(inside, activities["type"].to_numpy(dtype=object)[index], modes)
+        sources = np.where(inside, "timeline", sources)
+    return modes, sources
+
+
+# 時刻順の点（points: time, latitude, longitude）を滞在と、滞在の間の移動に分ける
+# activities: Timeline の activity の区間（start, end, type）。移動手段の判定に使う
+def segment_timeline(points, activities, radius_m=DEFAULT_STAY_RADIUS_M, min_stay_seconds=DEFAULT_MIN_STAY_SECONDS):
+    points = points.sort_values("time", kind="stable")
+    times = points["time"].to_numpy(dtype=np.float64)
+    latitude = points["latitude"].to_numpy(dtype=np.float64)
+    longitude = points["longitude"].to_numpy(dtype=np.float64)
+    activities = activities.sort_values("start", kind="stable")
+
+    first, last = detect_stays(times, latitude, longitude, radius_m, min_stay_seconds)
+    first, last = merge_adjacent_stays(latitude, longitude, first, last, radius_m)
+    stay_lat, stay_lng = _centroids(latitude, longitude, first, last)
+    stays = pd.DataFrame({
+        "seq": np.arange(len(first)),
+        "start_time": times[first],
+        "end_time": times[last],
+        "latitude": stay_lat,
+        "longitude": stay_lng,
+        "points": last - first + 1,
+    })
+
+    # 滞在 k の最後の点から滞在 k + 1 の最初の点までが1つの移動
+    step = haversine_m(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:]) if len(times) > 1 else np.empty(0)
+    path_length = np.concatenate([[0.0], np.cumsum(step)])
+    origin, destination = last[:-1], first[1:]
+    duration = times[destination] - times[origin]
+    distance = path_length[destination] - path_length[origin]
+    speed = np.divide(distance, duration, out=np.zeros_like(distance), where=duration > 0)
+    modes, sources = trip_modes((times[origin] + times[destination]) / 2, speed, activities)
+    trips = pd.DataFrame({
+        "seq": np.arange(len(origin)),
+        "from_stay": np.arange(len(origin)),
+        "to_stay": np.arange(1, len(origin) + 1),
+        "start_time": times[origin],
+        "end_time": times[destination],
+        "start_latitude": stay_lat[:-1],
+        "start_longitude": stay_lng[:-1],
+        "end_latitude": stay_lat[1:],
+        "end_longitude": stay_lng[1:],
+        "distance_m": distance,
+        "duration_s": duration,
+        "mode": modes,
+        "mode_source": sources,
+        "points": destination - origin + 1,
+    })
+    return stays, trips
+
+
+def _copy_out(cur, query, params, names, dtype):
+    buffer = io.StringIO()
+    cur.copy_expert(f"COPY ({cur.mogrify(query, params).decode()}) TO STDOUT WITH (FORMAT csv)", buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer, header=None, names=names, dtype=dtype)
+
+
+# ユーザーの点と activity の区間を COPY で読み出す（時刻は UTC のエポック秒）
+def load_segmentation_input(conn, username):
+    params = {"username": username}
+    with conn.cursor() as cur:
+        cur.execute("SELECT max(id) FROM timeline_data WHERE username = %s", (username,))
+        source_max_id = cur.fetchone()[0]
+        points = _copy_out(cur, SEGMENTATION_POINTS_SQL, params, ["time", "latitude", "longitude"], np.float64)
+        activities = _copy_out(cur, SEGMENTATION_ACTIVITIES_SQL, params, ["start", "end", "type"],
+                               {"start": np.float64, "end": np.float64, "type": object})
+    return points, activities, source_max_id
+
+
+def _copy_in(cur, df, table_name, columns):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, columns=columns)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _epoch_to_utc(seconds):
+    return pd.to_datetime(seconds, unit="s", utc=True)
+
+
+# ユーザーの滞在・移動を入れ替える（同じユーザーの再計算はアドバイザリロックで順番に行う）
+def save_segmentation(conn, username, stays, trips, radius_m, min_stay_seconds, source_rows, source_max_id):
+    stays = stays.assign(username=username, start_time=_epoch_to_utc(stays["start_time"]),
+                         end_time=_epoch_to_utc(stays["end_time"]))
+    trips = trips.assign(username=username, start_time=_epoch_to_utc(trips["start_time"]),
+                         end_time=_epoch_to_utc(trips["end_time"]))
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('timeline_segmentation:' || %s))", (username,))
+            cur.execute("DELETE FROM timeline_stay_points WHERE username = %s", (username,))
+            cur.execute("DELETE FROM timeline_trips WHERE username = %s", (username,))
+            _copy_in(cur, stays, "timeline_stay_points", STAY_COLUMNS)
+            _copy_in(cur, trips, "timeline_trips", TRIP_COLUMNS)
+            cur.execute("""
+                INSERT INTO timeline_segmentation_runs AS r
+                    (username, radius_m, min_stay_seconds, source_rows, source_max_id, stays, trips, computed_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, now())
+                ON CONFLICT (username) DO UPDATE SET
+                    radius_m = excluded.radius_m, min_stay_seconds = excluded.min_stay_seconds,
+                    source_rows = excluded.source_rows, source_max_id = excluded.source_max_id,
+                    stays = excluded.stays, trips = excluded.trips, computed_at = excluded.computed_at
+            """, (username, radius_m, min_stay_seconds, source_rows, source_max_id, len(stays), len(trips)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    bump_data_version(username)
+
+
+# 滞在・移動のテーブル（migrations/0005_stays_trips.sql）が適用済みか
+def segmentation_available(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('timeline_segmentation_runs') IS NOT NULL")
+        return cur.fetchone()[0]
+
+
+# 前回の計算条件と、その時点の timeline_data の最大 id（未計算・未適用なら None）
+def get_segmentation_run(conn, username):
+    if not segmentation_available(conn):
+        return None
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT r.radius_m, r.min_stay_seconds, r.source_rows, r.source_max_id, r.stays, r.trips, r.computed_at,
+                   (SELECT max(id) FROM timeline_data WHERE username = r.username) AS current_max_id
+            FROM timeline_segmentation_runs r
+            WHERE r.username = %s
+        """, (username,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column.name for column in cur.description], row))
+
+
+# ユーザーの滞在・移動を timeline_data から計算し直して保存する
+def rebuild_segmentation(username, radius_m=DEFAULT_STAY_RADIUS_M, min_stay_seconds=DEFAULT_MIN_STAY_SECONDS):
+    started = time.perf_counter()
+    with db_connection() as conn:
+        points, activities, source_max_id = load_segmentation_input(conn, username)
+        loaded = time.perf_counter()
+        stays, trips = segment_timeline(points, activities, radius_m, min_stay_seconds)
+        segmented = time.perf_counter()
+        save_segmentation(conn, username, stays, trips, radius_m, min_stay_seconds, len(points), source_max_id)
+    return {
+        "points": len(points),
+        "stays": len(stays),
+        "trips": len(trips),
+        "load_seconds": loaded - started,
+        "segment_seconds": segmented - loaded,
+        "save_seconds": time.perf_counter() - segmented,
+    }
+
+
+# 取り込みの後に呼ぶ。一度でも計算したユーザーだけ、前回と同じ条件で計算し直す
+def refresh_segmentation(username):
+    with db_connection() as conn:
+        run = get_segmentation_run(conn, username)
+    if run is None or run["source_max_id"] == run["current_max_id"]:
+        return None
+    return rebuild_segmentation(username, run["radius_m"], run["min_stay_seconds"])
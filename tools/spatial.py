@@ -0,0 +1,256 @@
+import math
+import numpy as np
+import pandas as pd
+from tools.db_pool import db_connection
+from tools.trajectory import EARTH_RADIUS_M
+
+# 取り込み時に timeline_data / locations の geohash 列へ入れる桁数（9桁 ≒ 4.8 m 四方）
+# migrations/0006_geohash.sql の geohash_encode と同じ値になる
+GEOHASH_PRECISION = 9
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_ALPHABET = np.frombuffer(GEOHASH_BASE32.encode(), dtype=np.uint8)
+
+# 範囲をこの数以下のセルで覆える最も細かい桁数を選ぶ（多いほど範囲外の読み込みが減り、条件が長くなる）
+GEOHASH_COVER_CELLS = 32
+
+# 検索できるテーブルと、その時刻の列（新しい順に並べるのに使う）
+SPATIAL_TABLES = {
+    "timeline_data": "coalesce(point_time, start_time)",
+    "locations": '"timestamp"',
+}
+
+SPATIAL_COLUMNS = {
+    "timeline_data": [
+        "id", "type", "start_time", "end_time", "point_time", "latitude", "longitude",
+        "visit_placeId", "visit_semanticType", "activity_type", "geohash"
+    ],
+    "locations": ["id", "latitude", "longitude", "timestamp", "comment", "geohash"],
+}
+
+
+# geohash 列（migrations/0006_geohash.sql）がないテーブルへ書き込もうとしたときのメッセージ
+GEOHASH_MIGRATION_MESSAGE = "{table} に geohash 列がありません。python -m tools.migrations でマイグレーションを適用してください。"
+
+
+# 書き込む前に geohash 列があるか確かめる（ないまま書き込むと列の数が合わずに失敗する）
+def require_geohash_column(conn, table):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = %s AND column_name = 'geohash'
+            )
+        """, (table,))
+        if not cur.fetchone()[0]:
+            raise RuntimeError(GEOHASH_MIGRATION_MESSAGE.format(table=table))
+
+
+def _bits(precision):
+    # 経度が先に1ビット多い（5桁なら経度 13 ビット・緯度 12 ビット）
+    total = 5 * precision
+    return (total + 1) // 2, total // 2
+
+
+def _grid_index(values, lower, span, bits):
+    index = np.floor((values - lower) / span * (1 << bits))
+    return np.clip(index, 0, (1 << bits) - 1).astype(np.uint64)
+
+
+# 下位 32 ビットを1ビットおきに広げる（Morton 順の並べ替え）
+def _spread(x):
+    x = x & np.uint64(0x00000000FFFFFFFF)
+    x = (x | (x << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x3333333333333333)
+    x = (x | (x << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return x
+
+
+# 経度・緯度のセル番号を geohash のビット列（整数）にする
+def _interleave(lng_index, lat_index, precision):
+    lng_bits, lat_bits = _bits(precision)
+    lat_index = lat_index << np.uint64(lng_bits - lat_bits)
+    key = (_spread(lng_index) << np.uint64(1)) | _spread(lat_index)
+    return key >> np.uint64(2 * lng_bits - 5 * precision)
+
+
+def _key_strings(keys, precision):
+    shifts = np.arange(precision - 1, -1, -1, dtype=np.uint64) * np.uint64(5)
+    digits = (keys[:, None] >> shifts) & np.uint64(31)
+    chars = np.ascontiguousarray(GEOHASH_ALPHABET[digits.astype(np.intp)])
+    return chars.view(f"S{precision}").ravel().astype(str)
+
+
+def _grid_indices(latitude, longitude, precision):
+    lng_bits, lat_bits = _bits(precision)
+    return _grid_index(longitude, -180.0, 360.0, lng_bits), _grid_index(latitude, -90.0, 180.0, lat_bits)
+
+
+# 緯度・経度の配列をまとめて geohash にする（どちらかが NaN の行は None）
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    valid = ~(np.isnan(latitude) | np.isnan(longitude))
+    result = np.full(len(latitude), None, dtype=object)
+    if valid.any():
+        lng_index, lat_index = _grid_indices(latitude[valid], longitude[valid], precision)
+        result[valid] = _key_strings(_interleave(lng_index, lat_index, precision), precision).tolist()
+    return result
+
+
+# geohash のセルの範囲 (min_lat, min_lng, max_lat, max_lng)
+def geohash_bounds(cell):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            target = lng_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            target[0 if value >> shift & 1 else 1] = mid
+            even = not even
+    return (lat_range[0], lng_range[0], lat_range[1], lng_range[1])
+
+
+# 範囲を覆うセルを、geohash の文字列の区間 [lower, upper) のリストにする（upper が None なら上限なし）
+# 同じ桁数のセルは Morton 順に並ぶので、番号が連続するセルは1つの区間にまとめる
+# 空の範囲（南端が北端より北、西端が東端より東）なら []
+def geohash_ranges(bbox, max_cells=GEOHASH_COVER_CELLS):
+    min_lat, min_lng, max_lat, max_lng = bbox
+    if min_lat > max_lat or min_lng > max_lng:
+        return []
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lng_index, lat_index = _grid_indices(
+            np.array([min_lat, max_lat]), np.array([min_lng, max_lng]), precision
+        )
+        lng_count = int(lng_index[1] - lng_index[0]) + 1
+        lat_count = int(lat_index[1] - lat_index[0]) + 1
+        if lng_count * lat_count <= max_cells or precision == 1:
+            break
+
+    lng_grid, lat_grid = np.meshgrid(
+        np.arange(lng_count, dtype=np.uint64) + lng_index[0],
+        np.arange(lat_count, dtype=np.uint64) + lat_index[0],
+    )
+    keys = np.unique(_interleave(lng_grid.ravel(), lat_grid.ravel(), precision))
+    breaks = np.flatnonzero(np.diff(keys) != 1) + 1
+    starts = keys[np.r_[0, breaks]]
+    stops = keys[np.r_[breaks - 1, len(keys) - 1]] + np.uint64(1)
+
+    lowers = _key_strings(starts, precision).tolist()
+    last = np.uint64(1) << np.uint64(5 * precision)
+    uppers = _key_strings(stops % last, precision).tolist()
+    return [(lower, None if stop == last else upper) for lower, upper, stop in zip(lowers, uppers, stops)]
+
+
+# 範囲で絞り込む WHERE 句。geohash の索引で候補を引いてから緯度・経度で正確に絞り込む
+# geohash が未設定の行（マイグレーション外から書き込まれた行）も対象に含める
+def bbox_filter(bbox):
+    min_lat, min_lng, max_lat, max_lng = bbox
+    ranges = geohash_ranges(bbox)
+    if not ranges:
+        return "FALSE", []
+    clauses, params = [], []
+    for lower, upper in ranges:
+        if upper is None:
+            clauses.append("geohash >= %s")
+            params.append(lower)
+        else:
+            clauses.append("(geohash >= %s AND geohash < %s)")
+            params.extend([lower, upper])
+    clauses.append("geohash IS NULL")
+    where = f"({' OR '.join(clauses)}) AND latitude BETWEEN %s AND %s AND longitude BETWEEN %s AND %s"
+    return where, params + [min_lat, max_lat, min_lng, max_lng]
+
+
+# 中心から radius_m 以内を含む範囲（極・日付変更線をまたぐ場合は経度の全域）
+def radius_bbox(latitude, longitude, radius_m):
+    delta_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    min_lat, max_lat = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    delta_lng = math.degrees(radius_m / (EARTH_RADIUS_M * cos_lat)) if cos_lat > 1e-12 else 180.0
+    if longitude - delta_lng < -180.0 or longitude + delta_lng > 180.0:
+        return (min_lat, -180.0, max_lat, 180.0)
+    return (min_lat, longitude - delta_lng, max_lat, longitude + delta_lng)
+
+
+def _select(table, columns):
+    if table not in SPATIAL_TABLES:
+        raise ValueError(f"検索できないテーブルです: {table}")
+    return ", ".join(f'"{c}"' if c == "timestamp" else c for c in (columns or SPATIAL_COLUMNS[table]))
+
+
+def _types_filter(table, types):
+    if not types or table != "timeline_data":
+        return "", []
+    return " AND type = ANY(%s)", [list(types)]
+
+
+# 範囲 (min_lat, min_lng, max_lat, max_lng) 内の行を新しい順に
+def find_in_bbox(username, bbox, table="timeline_data", columns=None, types=None, limit=None):
+    where, params = bbox_filter(bbox)
+    type_where, type_params = _types_filter(table, types)
+    query = f"""
+        SELECT {_select(table, columns)}
+        FROM {table}
+        WHERE username = %s AND {where}{type_where}
+        ORDER BY {SPATIAL_TABLES[table]} DESC
+    """
+    params = [username] + params + type_params
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params)
+
+
+# 中心から radius_m 以内の行を近い順に（distance_m 列を付ける）
+def find_within_radius(username, latitude, longitude, radius_m, table="timeline_data", columns=None,
+                       types=None, limit=None):
+    where, params = bbox_filter(radius_bbox(latitude, longitude, radius_m))
+    type_where, type_params = _types_filter(table, types)
+    distance = """
+        2 * %s * asin(sqrt(
+            power(sin(radians(latitude - %s) / 2), 2)
+            + cos(radians(%s)) * cos(radians(latitude)) * power(sin(radians(longitude - %s) / 2), 2)
+        ))
+    """
+    distance_params = [EARTH_RADIUS_M, latitude, latitude, longitude]
+    query = f"""
+        SELECT *
+        FROM (
+            SELECT {_select(table, columns)}, {distance} AS distance_m
+            FROM {table}
+            WHERE username = %s AND {where}{type_where}
+        ) candidates
+        WHERE distance_m <= %s
+        ORDER BY distance_m
+    """
+    params = distance_params + [username] + params + type_params + [radius_m]
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params)
+
+
+# geohash のセル（桁数は任意）に含まれる滞在（visit）を新しい順に
+# "~" は geohash のどの文字よりも後に並ぶので、[cell, cell + "~") がそのセルの前方一致になる
+def find_cell_visits(username, cell, limit=None):
+    min_lat, min_lng, max_lat, max_lng = geohash_bounds(cell)
+    query = f"""
+        SELECT {_select("timeline_data", None)}
+        FROM timeline_data
+        WHERE username = %s AND type = 'visit'
+          AND ((geohash >= %s AND geohash < %s)
+               OR (geohash IS NULL AND latitude >= %s AND latitude < %s AND longitude >= %s AND longitude < %s))
+        ORDER BY start_time DESC
+    """
+    params = [username, cell, cell + "~", min_lat, max_lat, min_lng, max_lng]
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    with db_connection() as conn:
+        return pd.read_sql(query, conn, params=params)
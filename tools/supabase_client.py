@@ -0,0 +1,16 @@
+import streamlit as st
+
+
+# プロセス全体で1つだけ作成する Supabase クライアント（テーブルの読み書き用）
+@st.cache_resource
+def get_supabase():
+    from supabase import create_client
+    return create_client(st.secrets["supabase"]["url"], st.secrets["supabase"]["key"])
+
+
+# ログイン・サインアップ・ログアウト用のクライアント
+# サインインするとクライアントが認証トークンを保持するため、テーブル用とは分けておく
+@st.cache_resource
+def get_auth_client():
+    from supabase import create_client
+    return create_client(st.secrets["supabase"]["url"], st.secrets["supabase"]["key"])
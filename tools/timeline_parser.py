@@ -0,0 +1,482 @@
+import pandas as pd
+import numpy as np
+import io
+import csv
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import ijson
+from pandas.api.types import union_categoricals
+
+TOKYO = ZoneInfo("Asia/Tokyo")
+
+# 1チャンクあたりのレコード数（ピークメモリはこの値で決まる）
+TIMELINE_CHUNK_SIZE = 50_000
+
+TIMELINE_COLUMNS = [
+    "type", "start_time", "end_time", "point_time", "latitude", "longitude",
+    "visit_probability", "visit_placeId", "visit_semanticType",
+    "activity_distanceMeters", "activity_type", "activity_probability",
+    "username"
+]
+
+# type 列の値（buffers_to_frame の並び順 rank と同じ順）
+TIMELINE_ROW_TYPES = ["timelinePath", "visit", "activity_start", "activity_end"]
+
+# 値の種類が少なく、同じ文字列が何度も現れる列（category で持つ）
+TIMELINE_CATEGORY_COLUMNS = ["type", "visit_placeId", "visit_semanticType", "activity_type", "username"]
+
+TIMELINE_FLOAT_DTYPES = {
+    "latitude": "float64",
+    "longitude": "float64",
+    "activity_distanceMeters": "float32",
+    "visit_probability": "float32",
+    "activity_probability": "float32",
+}
+
+
+# 時刻文字列を一度に数値化する行数（U 配列は 1 文字 4 バイトなので、ピークメモリをこの単位に抑える）
+TIMESTAMP_BLOCK_SIZE = 262_144
+
+# 固定位置で読む時刻文字列の最大長（YYYY-MM-DDTHH:MM:SS.fffffffff+HH:MM）
+TIMESTAMP_MAX_LENGTH = 35
+
+# 値がない行（NaT）の内部表現
+_NAT = np.iinfo(np.int64).min
+
+
+def convert_series_to_utc(series: pd.Series) -> pd.Series:
+    if series.dtype.kind == 'M':
+        if series.dt.tz is None:
+            series = series.dt.tz_localize(TOKYO)
+        return series.dt.tz_convert('UTC')
+    return pd.Series(parse_timeline_timestamps(series.to_numpy(dtype=object)), index=series.index, name=series.name)
+
+
+# codes[:, start:stop] の数字を整数にする（数字以外が含まれる行は ok=False）
+def _digits(codes, start, stop):
+    value = np.zeros(len(codes), dtype=np.int64)
+    ok = np.ones(len(codes), dtype=bool)
+    for i in range(start, stop):
+        digit = codes[:, i].astype(np.int64) - 48
+        ok &= (digit >= 0) & (digit <= 9)
+        value = value * 10 + digit
+    return value, ok
+
+
+# "YYYY-MM-DDTHH:MM:SS[.f...](Z|±HH:MM)" を UTC のエポックマイクロ秒に変換する
+# 書式に合わない行・時差のない行は ok=False（呼び出し側で1件ずつ解析する）
+def _parse_timestamp_block(values):
+    n = len(values)
+    # 1文字多く取り、切り詰められた（長すぎる）値を見分ける
+    width = TIMESTAMP_MAX_LENGTH + 1
+    text = values.astype(f"U{width}")
+    codes = text.view(np.uint32).reshape(n, width)
+    rows = np.arange(n)
+    length = np.char.str_len(text)
+
+    year, ok = _digits(codes, 0, 4)
+    ok &= length <= TIMESTAMP_MAX_LENGTH
+    fields = []
+    for start in (5, 8, 11, 14, 17):
+        value, digit_ok = _digits(codes, start, start + 2)
+        fields.append(value)
+        ok &= digit_ok
+    month, day, hour, minute, second = fields
+    for position, char in ((4, '-'), (7, '-'), (10, 'T'), (13, ':'), (16, ':')):
+        ok &= codes[:, position] == ord(char)
+
+    # 末尾の時差（Z または ±HH:MM）。行ごとに異なってよい
+    zulu = codes[rows, np.maximum(length - 1, 0)] == ord('Z')
+    sign_position = np.maximum(length - 6, 0)
+    sign = codes[rows, sign_position]
+    numeric_offset = (length >= 25) & ((sign == ord('+')) | (sign == ord('-'))) \
+        & (codes[rows, np.maximum(length - 3, 0)] == ord(':'))
+    offset_codes = np.stack([codes[rows, np.minimum(sign_position + i, width - 1)] for i in (1, 2, 4, 5)], axis=1)
+    offset_hour, offset_hour_ok = _digits(offset_codes, 0, 2)
+    offset_minute, offset_minute_ok = _digits(offset_codes, 2, 4)
+    numeric_offset &= offset_hour_ok & offset_minute_ok & (offset_hour <= 23) & (offset_minute <= 59)
+    offset_minutes = np.where(numeric_offset, (offset_hour * 60 + offset_minute) * np.where(sign == ord('-'), -1, 1), 0)
+    zone_start = np.where(zulu, length - 1, np.where(numeric_offset, sign_position, length))
+    ok &= zulu | numeric_offset
+
+    # 小数秒は 1〜9 桁（マイクロ秒より下は切り捨て）
+    fraction = zone_start > 19
+    ok &= ~fraction | ((codes[:, 19] == ord('.')) & (zone_start >= 21) & (zone_start <= 29))
+    micros = np.zeros(n, dtype=np.int64)
+    for k in range(9):
+        inside = 20 + k < zone_start
+        digit = codes[:, 20 + k].astype(np.int64) - 48
+        ok &= ~inside | ((digit >= 0) & (digit <= 9))
+        if k < 6:
+            micros += np.where(inside, digit, 0) * 10 ** (5 - k)
+
+    # 暦日の範囲チェックと日数への変換は datetime64[M] に任せる
+    ok &= (month >= 1) & (month <= 12)
+    month_index = np.where(ok, (year - 1970) * 12 + month - 1, 0)
+    first_day = month_index.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    days_in_month = (month_index + 1).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) - first_day
+    ok &= (day >= 1) & (day <= days_in_month) & (hour <= 23) & (minute <= 59) & (second <= 59)
+
+    minutes = ((first_day + day - 1) * 24 + hour) * 60 + minute - offset_minutes
+    return (minutes * 60 + second) * 1_000_000 + micros, ok
+
+
+# 1件ずつ解析する（書式が崩れている場合のフォールバック）。時差のない時刻は JST とみなす
+def _parse_timestamps_rowwise(values):
+    result = []
+    for value in values:
+        try:
+            timestamp = pd.Timestamp(value)
+        except (ValueError, TypeError):
+            timestamp = pd.NaT
+        if timestamp is not pd.NaT:
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.tz_localize(TOKYO)
+            timestamp = timestamp.tz_convert('UTC')
+        result.append(timestamp)
+    return pd.DatetimeIndex(result, dtype="datetime64[us, UTC]").asi8
+
+
+# Timeline の時刻文字列をまとめて UTC の DatetimeIndex にする
+# 行ごとの時差（夏時間や旅行先の時差）をそのまま反映し、欠損・解析できない値は NaT
+def parse_timeline_timestamps(values):
+    values = np.asarray(values, dtype=object)
+    missing = pd.isna(values)
+    result = np.full(len(values), _NAT, dtype=np.int64)
+    for start in range(0, len(values), TIMESTAMP_BLOCK_SIZE):
+        block = slice(start, start + TIMESTAMP_BLOCK_SIZE)
+        present = ~missing[block]
+        text = values[block][present]
+        if len(text) == 0:
+            continue
+        epoch, ok = _parse_timestamp_block(text)
+        parsed = np.where(ok, epoch, _NAT)
+        if not ok.all():
+            parsed[~ok] = _parse_timestamps_rowwise(text[~ok])
+        result[start:start + len(present)][present] = parsed
+    return pd.DatetimeIndex(result.view("datetime64[us]"), dtype="datetime64[us, UTC]")
+
+
+# バイトストリームから semanticSegments を1件ずつ取り出す
+def iter_semantic_segments(stream):
+    found = False
+    for segment in ijson.items(stream, 'semanticSegments.item', use_float=True):
+        found = True
+        yield segment
+
+    # セグメントが1件もない場合のみ、キー自体が存在するかを確認する
+    if not found:
+        stream.seek(0)
+        for prefix, event, value in ijson.parse(stream):
+            if prefix == '' and event == 'map_key' and value == 'semanticSegments':
+                return
+        raise ValueError("Error: 'semanticSegments' key not found in the JSON file.")
+
+
+# チャンク内の列バッファ（行ではなく列ごとに値を貯める）
+def new_column_buffers():
+    return {
+        "seg_start": [], "seg_end": [],
+        "path_counts": [], "path_point": [], "path_time": [],
+        "visit_seg": [], "visit_latlng": [], "visit_probability": [],
+        "visit_placeId": [], "visit_semanticType": [],
+        "activity_seg": [], "activity_key": [], "activity_latlng": [],
+        "activity_distanceMeters": [], "activity_type": [], "activity_probability": [],
+    }
+
+
+def buffered_rows(buffers):
+    return len(buffers["path_point"]) + len(buffers["visit_seg"]) + len(buffers["activity_seg"])
+
+
+# 1セグメント分の値を列バッファに追加
+def append_segment(buffers, segment):
+    seg = len(buffers["seg_start"])
+    buffers["seg_start"].append(segment.get('startTime'))
+    buffers["seg_end"].append(segment.get('endTime'))
+
+    path = segment.get('timelinePath', [])
+    buffers["path_counts"].append(len(path))
+    buffers["path_point"].extend(p.get('point') for p in path)
+    buffers["path_time"].extend(p.get('time') for p in path)
+
+    if 'visit' in segment:
+        visit = segment['visit']
+        top_candidate = visit.get('topCandidate', {})
+        buffers["visit_seg"].append(seg)
+        buffers["visit_latlng"].append(top_candidate.get('placeLocation', {}).get('latLng'))
+        buffers["visit_probability"].append(visit.get('probability'))
+        buffers["visit_placeId"].append(top_candidate.get('placeId'))
+        buffers["visit_semanticType"].append(top_candidate.get('semanticType'))
+
+    if 'activity' in segment:
+        activity = segment['activity']
+        top_candidate = activity.get('topCandidate', {})
+        for key in ['start', 'end']:
+            if key in activity and 'latLng' in activity[key]:
+                buffers["activity_seg"].append(seg)
+                buffers["activity_key"].append(key)
+                buffers["activity_latlng"].append(activity[key]['latLng'])
+                buffers["activity_distanceMeters"].append(activity.get('distanceMeters'))
+                buffers["activity_type"].append(top_candidate.get('type'))
+                buffers["activity_probability"].append(top_candidate.get('probability'))
+
+
+# 1件ずつ float に変換する（書式が崩れている場合のフォールバック）
+def _parse_latlng_rowwise(values):
+    lat = np.full(len(values), np.nan)
+    lng = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            lat[i], lng[i] = map(float, value.replace('°', '').split(', '))
+        except Exception:
+            pass
+    return lat, lng
+
+
+# "lat°, lng°" 形式の文字列をまとめて数値化
+def parse_latlng(values):
+    if len(values) == 0:
+        return np.empty(0), np.empty(0)
+
+    text = "\n".join(v if isinstance(v, str) else "" for v in values).replace('°', '')
+    try:
+        parsed = pd.read_csv(
+            io.StringIO(text), header=None, sep=",", skipinitialspace=True,
+            skip_blank_lines=False, quoting=csv.QUOTE_NONE, float_precision="high"
+        )
+    except (ValueError, pd.errors.ParserError):
+        return _parse_latlng_rowwise(values)
+
+    if parsed.shape != (len(values), 2) or not all(dtype.kind == 'f' for dtype in parsed.dtypes):
+        return _parse_latlng_rowwise(values)
+
+    lat = parsed[0].to_numpy(dtype=np.float64, copy=True)
+    lng = parsed[1].to_numpy(dtype=np.float64, copy=True)
+    invalid = np.isnan(lat) | np.isnan(lng)
+    lat[invalid] = np.nan
+    lng[invalid] = np.nan
+    return lat, lng
+
+
+def _object_column(n, positions, values):
+    column = np.full(n, None, dtype=object)
+    column[positions] = values
+    return column
+
+
+def _float_column(n, positions, values):
+    column = np.full(n, np.nan)
+    column[positions] = np.array(values, dtype=np.float64)
+    return column
+
+
+# 列バッファを DataFrame に変換
+def buffers_to_frame(buffers, username):
+    n_path = len(buffers["path_point"])
+    n_visit = len(buffers["visit_seg"])
+    n_activity = len(buffers["activity_seg"])
+    n = n_path + n_visit + n_activity
+
+    # 元のファイル順（セグメント順 → path, visit, activity_start, activity_end）に並べ替える
+    seg_idx = np.concatenate([
+        np.repeat(np.arange(len(buffers["path_counts"])), buffers["path_counts"]),
+        np.array(buffers["visit_seg"], dtype=np.int64),
+        np.array(buffers["activity_seg"], dtype=np.int64),
+    ]).astype(np.int64)
+    rank = np.concatenate([
+        np.zeros(n_path, dtype=np.int8),
+        np.ones(n_visit, dtype=np.int8),
+        np.where(np.array(buffers["activity_key"], dtype=object) == 'start', 2, 3).astype(np.int8),
+    ])
+    order = np.lexsort((rank, seg_idx))
+    seg_idx = seg_idx[order]
+
+    path_pos = slice(0, n_path)
+    visit_pos = slice(n_path, n_path + n_visit)
+    activity_pos = slice(n_path + n_visit, n)
+
+    lat, lng = parse_latlng(buffers["path_point"] + buffers["visit_latlng"] + buffers["activity_latlng"])
+
+    # start_time / end_time はセグメント単位で変換してから行に展開する
+    used_segments, seg_rows = np.unique(seg_idx, return_inverse=True)
+    seg_start = convert_series_to_utc(pd.Series(np.array(buffers["seg_start"], dtype=object)[used_segments]))
+    seg_end = convert_series_to_utc(pd.Series(np.array(buffers["seg_end"], dtype=object)[used_segments]))
+
+    # 文字列の列は category（整数コード + 値の一覧）で持ち、数値・時刻の欠損は NaN / NaT のままにする
+    df = pd.DataFrame({
+        "type": pd.Categorical.from_codes(rank[order], TIMELINE_ROW_TYPES),
+        "start_time": seg_start.array.take(seg_rows),
+        "end_time": seg_end.array.take(seg_rows),
+        "point_time": _object_column(n, path_pos, buffers["path_time"])[order],
+        "latitude": lat[order],
+        "longitude": lng[order],
+        "visit_probability": _float_column(n, visit_pos, buffers["visit_probability"])[order],
+        "visit_placeId": pd.Categorical(_object_column(n, visit_pos, buffers["visit_placeId"])[order]),
+        "visit_semanticType": pd.Categorical(_object_column(n, visit_pos, buffers["visit_semanticType"])[order]),
+        "activity_distanceMeters": _float_column(n, activity_pos, buffers["activity_distanceMeters"])[order],
+        "activity_type": pd.Categorical(_object_column(n, activity_pos, buffers["activity_type"])[order]),
+        "activity_probability": _float_column(n, activity_pos, buffers["activity_probability"])[order],
+        "username": username_column(n, username),
+    }, columns=TIMELINE_COLUMNS)
+
+    # ⏱ タイムスタンプ列の高速一括変換
+    df["point_time"] = convert_series_to_utc(df["point_time"])
+
+    return df.astype(TIMELINE_FLOAT_DTYPES)
+
+
+def username_column(n, username):
+    if username is None:
+        return pd.Categorical(np.full(n, None, dtype=object))
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [username])
+
+
+# DB から読んだ timeline_data の行を同じ省メモリの型にそろえる
+# （列名は PostgreSQL が小文字にするため大文字小文字を区別せずに対応させる）
+def compact_timeline_frame(df):
+    names = {column.lower(): column for column in df.columns}
+    dtypes = {}
+    for column in TIMELINE_CATEGORY_COLUMNS:
+        if column.lower() in names:
+            dtypes[names[column.lower()]] = "category"
+    for column, dtype in TIMELINE_FLOAT_DTYPES.items():
+        if column.lower() in names:
+            df[names[column.lower()]] = pd.to_numeric(df[names[column.lower()]], errors="coerce")
+            dtypes[names[column.lower()]] = dtype
+    return df.astype(dtypes)
+
+
+# category の列は値の一覧をそろえてから結合する（そのまま concat すると object に戻る）
+def concat_timeline_frames(frames):
+    frames = list(frames)
+    if len(frames) > 1:
+        for column in TIMELINE_CATEGORY_COLUMNS:
+            categories = union_categoricals([frame[column] for frame in frames]).categories
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+# セグメントの終了時刻が since より前か（since は tz-aware な datetime）
+def segment_before(segment, since):
+    end_time = segment.get('endTime')
+    if not end_time:
+        return False
+    try:
+        end = datetime.fromisoformat(end_time)
+    except ValueError:
+        return False
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=TOKYO)
+    return end < since
+
+
+# 固定サイズのチャンクごとに DataFrame を返す
+# since を指定すると、それより前に終わったセグメント（取り込み済みの期間）は読み飛ばす
+def iter_timeline_chunks(uploaded_file, username, chunk_size=TIMELINE_CHUNK_SIZE, since=None, stats=None):
+    uploaded_file.seek(0)
+    buffers = new_column_buffers()
+    for segment in iter_semantic_segments(uploaded_file):
+        if since is not None and segment_before(segment, since):
+            if stats is not None:
+                stats["skipped_segments"] = stats.get("skipped_segments", 0) + 1
+            continue
+        append_segment(buffers, segment)
+        if buffered_rows(buffers) >= chunk_size:
+            yield buffers_to_frame(buffers, username)
+            buffers = new_column_buffers()
+
+    if buffered_rows(buffers):
+        yield buffers_to_frame(buffers, username)
+
+
+def extract_timeline_data(uploaded_file, username, since=None, stats=None):
+    chunks = list(iter_timeline_chunks(uploaded_file, username, since=since, stats=stats))
+    if not chunks:
+        return buffers_to_frame(new_column_buffers(), username)
+    return concat_timeline_frames(chunks)
+
+
+# アップロードされたファイルパスを (パス, ZIP内のメンバー名) のリストに展開
+def list_timeline_sources(paths):
+    sources = []
+    for path in paths:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zip_ref:
+                for member in zip_ref.namelist():
+                    if member.lower().endswith(".json") and not member.startswith("__MACOSX/"):
+                        sources.append((path, member))
+        else:
+            sources.append((path, None))
+    return sources
+
+
+def timeline_source_label(source):
+    path, member = source
+    return member if member else os.path.basename(path)
+
+
+# 1ファイル分のチャンクを iter_timeline_chunks で順に返す
+def iter_source_chunks(source, username, chunk_size=TIMELINE_CHUNK_SIZE, since=None, stats=None):
+    path, member = source
+    try:
+        if member is None:
+            with open(path, "rb") as f:
+                yield from iter_timeline_chunks(f, username, chunk_size, since, stats)
+        else:
+            with zipfile.ZipFile(path) as zip_ref, zip_ref.open(member) as f:
+                yield from iter_timeline_chunks(f, username, chunk_size, since, stats)
+    except Exception as e:
+        raise ValueError(f"{timeline_source_label(source)}: {e}") from e
+
+
+# ワーカープロセスで1ファイル分を解析し、(チャンクのリスト, 読み飛ばしたセグメント数) を返す
+def extract_timeline_source(source, username, chunk_size=TIMELINE_CHUNK_SIZE, since=None):
+    stats = {}
+    chunks = list(iter_source_chunks(source, username, chunk_size, since, stats))
+    return chunks, stats.get("skipped_segments", 0)
+
+
+# 複数ファイルのチャンクを、ファイルの順に返す（ファイル間の重複は DB 側の row_hash で除く）
+# 2ファイル以上ならプロセスプールで並列に解析する。先に解析するのは max_workers ファイルまでなので、
+# ピークメモリはおよそファイル max_workers + 1 個分になる（1ファイルずつ読むときは chunk_size で決まる）
+# 行の並びはどちらでも同じなので、途中から再開するときに読み飛ばす行もずれない
+# on_file(完了数, 総数, ファイル名, 行数) が1ファイルを解析し終えるごとに呼ばれる
+def iter_timeline_source_chunks(sources, username, chunk_size=TIMELINE_CHUNK_SIZE, since=None, stats=None,
+                                max_workers=None, on_file=None):
+    max_workers = max_workers or min(len(sources), os.cpu_count() or 1)
+    if max_workers <= 1:
+        for done, source in enumerate(sources, 1):
+            rows = 0
+            for chunk in iter_source_chunks(source, username, chunk_size, since, stats):
+                rows += len(chunk)
+                yield chunk
+            if on_file:
+                on_file(done, len(sources), timeline_source_label(source), rows)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"))
+    try:
+        pending = deque(
+            pool.submit(extract_timeline_source, source, username, chunk_size, since)
+            for source in sources[:max_workers]
+        )
+        for i, source in enumerate(sources):
+            chunks, skipped = pending.popleft().result()
+            # 1ファイル取り出したら次のファイルを解析に回す
+            if i + max_workers < len(sources):
+                pending.append(pool.submit(extract_timeline_source, sources[i + max_workers], username, chunk_size, since))
+            if stats is not None:
+                stats["skipped_segments"] = stats.get("skipped_segments", 0) + skipped
+            if on_file:
+                on_file(i + 1, len(sources), timeline_source_label(source), sum(len(chunk) for chunk in chunks))
+            while chunks:
+                yield chunks.pop(0)
+    finally:
+        # 途中で止めたときは、まだ始まっていない解析を取り消す
+        pool.shutdown(wait=True, cancel_futures=True)
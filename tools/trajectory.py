@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_M = 6_371_008.8
+
+SIMPLIFY_METHODS = ["douglas_peucker", "decimate"]
+
+# 許容誤差（m）。douglas_peucker は元の線からのずれの上限、decimate は点を残す距離の間隔
+DEFAULT_TOLERANCE_M = 10.0
+
+# decimate で、移動が少なくてもこの秒数ごとに1点は残す
+DEFAULT_MIN_SECONDS = 300
+
+
+# 2点間の距離（m）
+def haversine_m(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+# 緯度経度を平面（m）に投影する（1セグメント程度の範囲なら正距円筒図法で十分）
+# origin_latitude はセグメントごとの基準緯度（点ごとの配列でもよい）
+def project_meters(latitude, longitude, origin_latitude):
+    x = EARTH_RADIUS_M * np.radians(longitude) * np.cos(np.radians(origin_latitude))
+    y = EARTH_RADIUS_M * np.radians(latitude)
+    return x, y
+
+
+# 点 (px, py) と線分 (a, b) の距離
+def point_segment_distance(px, py, ax, ay, bx, by):
+    dx = bx - ax
+    dy = by - ay
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(length2 > 0, ((px - ax) * dx + (py - ay) * dy) / length2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+# Douglas–Peucker で残す点のマスク
+# bounds はセグメントの境界（先頭位置の配列 + 末尾）。全セグメントの区間を段ごとにまとめて処理し、
+# 1段ごとに「各区間で弦から最も離れた点」をベクトル演算で求める
+def douglas_peucker_mask(x, y, tolerance, bounds=None):
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    if bounds is None:
+        bounds = np.array([0, n])
+    starts, ends = bounds[:-1], bounds[1:] - 1
+    keep[starts] = keep[ends] = True
+
+    while len(starts):
+        open_ = ends - starts >= 2
+        starts, ends = starts[open_], ends[open_]
+        if not len(starts):
+            break
+        lengths = ends - starts - 1
+        owner = np.repeat(np.arange(len(starts)), lengths)
+        interior = np.arange(owner.size) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[owner] + 1
+        a, b = starts[owner], ends[owner]
+        distance = point_segment_distance(x[interior], y[interior], x[a], y[a], x[b], y[b])
+
+        offsets = np.cumsum(lengths) - lengths
+        farthest = np.maximum.reduceat(distance, offsets)
+        split = farthest > tolerance
+        # 区間ごとに最大距離となる最初の点を分割点にする
+        is_max = (distance == farthest[owner]) & split[owner]
+        owners, first = np.unique(owner[is_max], return_index=True)
+        pivots = interior[is_max][first]
+        keep[pivots] = True
+
+        starts = np.concatenate([starts[owners], pivots])
+        ends = np.concatenate([pivots, ends[owners]])
+    return keep
+
+
+# 間引きで残す点のマスク（全セグメントまとめて計算する）
+# セグメント内で累積移動距離が tolerance を、経過時間が min_seconds を超えるごとに1点残す
+def decimate_mask(x, y, seconds, group, tolerance, min_seconds):
+    n = len(x)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    first = np.r_[True, group[1:] != group[:-1]]
+    last = np.r_[group[1:] != group[:-1], True]
+
+    step = np.r_[0.0, np.hypot(np.diff(x), np.diff(y))]
+    step[first] = 0.0
+    travelled = np.cumsum(step)
+    travelled -= np.maximum.accumulate(np.where(first, travelled, 0.0))
+
+    start_seconds = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+    elapsed = seconds - seconds[start_seconds]
+
+    distance_bucket = np.floor(travelled / tolerance)
+    time_bucket = np.floor(elapsed / min_seconds)
+    changed = np.r_[True, (np.diff(distance_bucket) != 0) | (np.diff(time_bucket) != 0)]
+    return first | last | changed
+
+
+# 間引かれた各点と、前後に残った点を結ぶ線分との距離の最大値（m）
+def max_deviation_m(x, y, keep):
+    if keep.all():
+        return 0.0
+    index = np.arange(len(keep))
+    prev_kept = np.maximum.accumulate(np.where(keep, index, 0))
+    next_kept = np.minimum.accumulate(np.where(keep, index, len(keep) - 1)[::-1])[::-1]
+    dropped = ~keep
+    distance = point_segment_distance(
+        x[dropped], y[dropped],
+        x[prev_kept[dropped]], y[prev_kept[dropped]],
+        x[next_kept[dropped]], y[next_kept[dropped]],
+    )
+    return float(distance.max())
+
+
+# timelinePath の点をセグメントごとに間引く（他のタイプの行はそのまま残す）
+# stats を渡すと path_points_before / path_points_after / max_deviation_m を書き込む
+def simplify_timeline(df, method="douglas_peucker", tolerance_m=DEFAULT_TOLERANCE_M,
+                      min_seconds=DEFAULT_MIN_SECONDS, stats=None):
+    latitude = pd.to_numeric(df["latitude"], errors="coerce").to_numpy(dtype=float)
+    longitude = pd.to_numeric(df["longitude"], errors="coerce").to_numpy(dtype=float)
+    is_path = (df["type"] == "timelinePath").to_numpy() & ~np.isnan(latitude) & ~np.isnan(longitude)
+
+    positions = np.flatnonzero(is_path)
+    # 同じ timelinePath セグメントの点は start_time / end_time が共通
+    group, _ = pd.factorize(pd.MultiIndex.from_arrays([df["start_time"].iloc[positions], df["end_time"].iloc[positions]]))
+    order = np.argsort(group, kind="stable")
+    positions, group = positions[order], group[order]
+
+    lat, lng = latitude[positions], longitude[positions]
+    origin_latitude = (np.bincount(group, lat) / np.bincount(group))[group] if len(group) else lat
+    x, y = project_meters(lat, lng, origin_latitude)
+
+    if method == "douglas_peucker":
+        bounds = np.flatnonzero(np.r_[True, group[1:] != group[:-1], True])
+        keep = douglas_peucker_mask(x, y, tolerance_m, bounds)
+    elif method == "decimate":
+        point_time = pd.to_datetime(df["point_time"].iloc[positions], utc=True)
+        seconds = (point_time - point_time.min()).dt.total_seconds().fillna(0).to_numpy()
+        keep = decimate_mask(x, y, seconds, group, tolerance_m, min_seconds)
+    else:
+        raise ValueError(f"未対応の間引き方法です: {method}")
+
+    # どちらの方法もセグメントの最初と最後の点は残すので、誤差はセグメントをまたいで測られない
+    deviation = max_deviation_m(x, y, keep) if len(keep) else 0.0
+
+    keep_rows = np.ones(len(df), dtype=bool)
+    keep_rows[positions[~keep]] = False
+    if stats is not None:
+        stats["path_points_before"] = int(len(positions))
+        stats["path_points_after"] = int(keep.sum())
+        stats["max_deviation_m"] = deviation
+    return df[keep_rows].reset_index(drop=True)
+
+
+# チャンクごとに間引く（iter_timeline_chunks のチャンクはセグメントの途中で切れないので、まとめて間引くのと同じ結果になる）
+# stats には全チャンクの点数の合計と最大誤差を書き込む
+def simplify_chunks(chunks, method="douglas_peucker", tolerance_m=DEFAULT_TOLERANCE_M,
+                    min_seconds=DEFAULT_MIN_SECONDS, stats=None):
+    for chunk in chunks:
+        chunk_stats = {}
+        simplified = simplify_timeline(chunk, method, tolerance_m, min_seconds, stats=chunk_stats)
+        if stats is not None:
+            stats["path_points_before"] = stats.get("path_points_before", 0) + chunk_stats["path_points_before"]
+            stats["path_points_after"] = stats.get("path_points_after", 0) + chunk_stats["path_points_after"]
+            stats["max_deviation_m"] = max(stats.get("max_deviation_m", 0.0), chunk_stats["max_deviation_m"])
+        yield simplified
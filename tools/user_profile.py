@@ -0,0 +1,68 @@
+import time
+import threading
+import streamlit as st
+
+# ユーザー名キャッシュの有効期限（秒）。未登録の結果は短めに保持する
+USERNAME_CACHE_TTL = 600
+MISSING_USERNAME_CACHE_TTL = 30
+
+
+# プロセス全体で共有する user_id → (username, 有効期限) のキャッシュ
+@st.cache_resource
+def _username_cache():
+    return {"entries": {}, "lock": threading.Lock()}
+
+
+def current_user_id():
+    try:
+        return st.session_state.user.dict().get("id", None)
+    except AttributeError:
+        return None
+
+
+def _remember_in_session(user_id, username):
+    st.session_state.username = username
+    st.session_state.username_user_id = user_id
+
+
+# user_id からユーザー名を取得（セッション → 共有キャッシュ → Supabase の順に探す）
+def get_username(supabase, user_id):
+    if st.session_state.get("username_user_id") == user_id and st.session_state.get("username"):
+        return st.session_state.username
+
+    cache = _username_cache()
+    now = time.monotonic()
+    with cache["lock"]:
+        entry = cache["entries"].get(user_id)
+
+    if entry and entry[1] > now:
+        username = entry[0]
+    else:
+        response = supabase.table("username").select("username").eq("user_id", user_id).execute()
+        username = response.data[0]["username"] if response.data else None
+        ttl = USERNAME_CACHE_TTL if username else MISSING_USERNAME_CACHE_TTL
+        with cache["lock"]:
+            cache["entries"][user_id] = (username, now + ttl)
+
+    if username:
+        _remember_in_session(user_id, username)
+    return username
+
+
+def invalidate_username(user_id):
+    cache = _username_cache()
+    with cache["lock"]:
+        cache["entries"].pop(user_id, None)
+    if st.session_state.get("username_user_id") == user_id:
+        st.session_state.pop("username", None)
+        st.session_state.pop("username_user_id", None)
+
+
+# ユーザー名を登録し、キャッシュを更新する
+def register_username(supabase, user_id, username):
+    supabase.table("username").insert({
+        "user_id": user_id,
+        "username": username
+    }).execute()
+    invalidate_username(user_id)
+    _remember_in_session(user_id, username)